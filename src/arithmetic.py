@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import operator
+from collections import namedtuple
+
+KARATSUBA_THRESHOLD = 12  # width under which Karatsuba multiplies by schoolbook
+
+
+class CircuitBuilder:
+    """A builder of circuits with as few AND gates as possible.
+
+    Wires are gate IDs, or False and True for constants, which are folded
+    into the gates reading them. Values are lists of wires, least
+    significant bit first, in two's complement when signed. With Free-XOR,
+    XOR and NOT gates are free: every function is built with XOR, NOT and
+    AND gates only, and ORs are a ^ b ^ (a & b).
+    """
+    def __init__(self):
+        self.next_id = 1
+        self.gates = []
+        self.nots = {}  # map from wires to their negation
+
+    def inputs(self, n):
+        """Return a value of n fresh input wires."""
+        wires = list(range(self.next_id, self.next_id + n))
+        self.next_id += n
+        return wires
+
+    def gate(self, gate_type, *wires):
+        """Add a gate and return its output wire."""
+        self.gates.append({"id": self.next_id, "type": gate_type,
+                           "in": list(wires)})
+        self.next_id += 1
+        return self.next_id - 1
+
+    def xor(self, a, b):
+        if is_constant(b):
+            a, b = b, a
+        if is_constant(a):
+            return (not b if is_constant(b) else self.not_(b)) if a else b
+        return False if a == b else self.gate("XOR", a, b)
+
+    def and_(self, a, b):
+        if is_constant(b):
+            a, b = b, a
+        if is_constant(a):
+            return b if a else False
+        return a if a == b else self.gate("AND", a, b)
+
+    def or_(self, a, b):
+        return self.xor(self.xor(a, b), self.and_(a, b))
+
+    def not_(self, a):
+        if is_constant(a):
+            return not a
+        if a not in self.nots:
+            self.nots[a] = self.gate("NOT", a)
+        return self.nots[a]
+
+    def add(self, x, y, carry=False, carry_out=False):
+        """Return x + y + carry, with one AND gate per bit.
+
+        The carry of each full adder is c ^ ((x ^ c) & (y ^ c)).
+
+        Args:
+            x: A value.
+            y: A value of the same width as x.
+            carry: Optional; the carry in. (False by default)
+            carry_out: Optional; whether to return the carry out as an extra
+                bit. (False by default: the sum is modulo 2^width)
+        """
+        result = []
+        for i, (a, b) in enumerate(zip(x, y)):
+            result.append(self.xor(self.xor(a, b), carry))
+            if carry_out or i < len(x) - 1:
+                carry = self.xor(carry, self.and_(self.xor(a, carry),
+                                                  self.xor(b, carry)))
+        return result + [carry] if carry_out else result
+
+    def sub(self, x, y, carry_out=False):
+        """Return x - y modulo 2^width, as x + ~y + 1.
+
+        The carry out, if asked for, is 1 when x >= y as unsigned ints.
+        """
+        return self.add(x, [self.not_(b) for b in y], True, carry_out)
+
+    def add_at(self, x, y, offset):
+        """Return x + (y << offset), modulo 2^len(x)."""
+        high = x[offset:]
+        return x[:offset] + self.add(high, extend(y[:len(high)], len(high)))
+
+    def mul(self, x, y):
+        """Return the product of unsigned values, of len(x) + len(y) bits.
+
+        Partial products are added row by row (schoolbook).
+        """
+        result = [self.and_(a, y[0]) for a in x]
+        for i, b in enumerate(y[1:], 1):
+            row = [self.and_(a, b) for a in x]
+            high = self.add(extend(result[i:], len(x)), row, carry_out=True)
+            result = result[:i] + high
+        return extend(result, len(x) + len(y))
+
+    def karatsuba(self, x, y, threshold=KARATSUBA_THRESHOLD):
+        """Return the product of unsigned values of the same width.
+
+        With x = x1 2^h + x0 and y = y1 2^h + y0, the product is z2 2^2h +
+        z1 2^h + z0, where z0 = x0 y0, z2 = x1 y1 and z1 = (x0 + x1)
+        (y0 + y1) - z0 - z2: three half-width products instead of four.
+
+        Args:
+            x: A value.
+            y: A value of the same width as x.
+            threshold: Optional; the width under which values are multiplied
+                by schoolbook. (KARATSUBA_THRESHOLD by default)
+        """
+        n = len(x)
+        if n <= max(threshold, 1):
+            return self.mul(x, y)
+        h = n // 2
+        z0 = self.karatsuba(x[:h], y[:h], threshold)
+        z2 = self.karatsuba(x[h:], y[h:], threshold)
+        x_sum = self.add(extend(x[:h], n - h), x[h:], carry_out=True)
+        y_sum = self.add(extend(y[:h], n - h), y[h:], carry_out=True)
+        z1 = self.karatsuba(x_sum, y_sum, threshold)
+        z1 = self.sub(z1, extend(z0, len(z1)))
+        z1 = self.sub(z1, extend(z2, len(z1)))
+        return self.add_at(z0 + z2, z1, h)  # z0 and z2 do not overlap
+
+    def signed_mul(self, x, y, karatsuba=False, threshold=KARATSUBA_THRESHOLD):
+        """Return the product of signed values of the same width n, of 2n bits.
+
+        As signed, x is its unsigned value minus x[n-1] 2^n: the unsigned
+        product is corrected by subtracting (x[n-1] y + y[n-1] x) 2^n.
+        """
+        n = len(x)
+        if karatsuba:
+            product = self.karatsuba(x, y, threshold)
+        else:
+            product = self.mul(x, y)
+        high = product[n:]
+        high = self.sub(high, [self.and_(x[-1], b) for b in y])
+        high = self.sub(high, [self.and_(y[-1], a) for a in x])
+        return product[:n] + high
+
+    def less_than(self, x, y):
+        """Return the bit x < y of signed values: the sign of x - y."""
+        n = len(x) + 1
+        return self.sub(sign_extend(x, n), sign_extend(y, n))[-1]
+
+    def equal(self, x, y):
+        """Return the bit x == y, with a tree of AND gates."""
+        bits = [self.not_(self.xor(a, b)) for a, b in zip(x, y)]
+        while len(bits) > 1:
+            bits = [self.and_(*bits[i:i + 2]) if i + 1 < len(bits) else bits[i]
+                    for i in range(0, len(bits), 2)]
+        return bits[0]
+
+    def sum(self, values):
+        """Return the sum of values of the same width, modulo 2^width.
+
+        Values are reduced three to two by rows of full adders (carry-save
+        adders) until two are left, which are added: one AND gate per bit
+        and per value.
+        """
+        values = list(values)
+        while len(values) > 2:
+            x, y, z = values.pop(0), values.pop(0), values.pop(0)
+            sums, carries = [], [False]
+            for a, b, c in zip(x, y, z):
+                sums.append(self.xor(self.xor(a, b), c))
+                carries.append(self.xor(c, self.and_(self.xor(a, c),
+                                                     self.xor(b, c))))
+            values += [sums, carries[:len(x)]]
+        if len(values) == 1:
+            return values[0]
+        return self.add(*values)
+
+    def circuit(self, circuit_id, alice, bob, out):
+        """Return the spec of the circuit computing 'out'.
+
+        Gates no output depends on are dropped, and constant outputs are
+        computed from the first input wire (w ^ w, or its negation).
+
+        Args:
+            circuit_id: The id of the circuit.
+            alice: The value of Alice's input wires.
+            bob: The value of Bob's input wires.
+            out: The value of the output wires.
+
+        Returns:
+            A dict containing the circuit spec, whose wire lists are most
+            significant bit first.
+        """
+        first = (alice + bob)[0]
+        out = [self.gate("XNOR" if w else "XOR", first, first)
+               if is_constant(w) else w for w in out]
+        live = set(out)
+        gates = []
+        for gate in reversed(self.gates):
+            if gate["id"] in live:
+                live.update(gate["in"])
+                gates.append(gate)
+        return {
+            "id": circuit_id,
+            "alice": alice[::-1],
+            "bob": bob[::-1],
+            "out": out[::-1],
+            "gates": gates[::-1],
+        }
+
+
+def is_constant(wire):
+    """Return whether a wire is a constant rather than a gate ID."""
+    return isinstance(wire, bool)
+
+
+def extend(x, n):
+    """Return an unsigned value zero-extended to n bits."""
+    return x + [False] * (n - len(x))
+
+
+def sign_extend(x, n):
+    """Return a signed value sign-extended to n bits."""
+    return x + [x[-1]] * (n - len(x))
+
+
+def adder(n):
+    """Return an adder of signed n-bit values, with an (n + 1)-bit sum."""
+    builder = CircuitBuilder()
+    x, y = builder.inputs(n), builder.inputs(n)
+    out = builder.add(sign_extend(x, n + 1), sign_extend(y, n + 1))
+    return builder.circuit(f"{n}-bit add", x, y, out)
+
+
+def subtractor(n):
+    """Return a subtractor of signed n-bit values, with an (n + 1)-bit
+    difference."""
+    builder = CircuitBuilder()
+    x, y = builder.inputs(n), builder.inputs(n)
+    out = builder.sub(sign_extend(x, n + 1), sign_extend(y, n + 1))
+    return builder.circuit(f"{n}-bit sub", x, y, out)
+
+
+def less_than(n):
+    """Return a comparator x < y of signed n-bit values.
+
+    The result has a leading 0 bit, so that it reads as a positive number.
+    """
+    builder = CircuitBuilder()
+    x, y = builder.inputs(n), builder.inputs(n)
+    out = [builder.less_than(x, y), False]
+    return builder.circuit(f"{n}-bit lt", x, y, out)
+
+
+def equality(n):
+    """Return a comparator x == y of n-bit values.
+
+    The result has a leading 0 bit, so that it reads as a positive number.
+    """
+    builder = CircuitBuilder()
+    x, y = builder.inputs(n), builder.inputs(n)
+    out = [builder.equal(x, y), False]
+    return builder.circuit(f"{n}-bit eq", x, y, out)
+
+
+def multiplier(n, karatsuba=False, threshold=KARATSUBA_THRESHOLD):
+    """Return a multiplier of signed n-bit values, with a 2n-bit product.
+
+    Args:
+        n: The width of the inputs.
+        karatsuba: Optional; multiply with Karatsuba's algorithm instead of
+            schoolbook. (False by default)
+        threshold: Optional; the width under which Karatsuba multiplies by
+            schoolbook. (KARATSUBA_THRESHOLD by default)
+    """
+    builder = CircuitBuilder()
+    x, y = builder.inputs(n), builder.inputs(n)
+    out = builder.signed_mul(x, y, karatsuba, threshold)
+    name = "karatsuba" if karatsuba else "mul"
+    return builder.circuit(f"{n}-bit {name}", x, y, out)
+
+
+def multi_adder(n, operands):
+    """Return an adder of 'operands' signed n-bit values.
+
+    Alice holds the first half of the values (rounded up), each on n
+    consecutive input wires, and Bob the others. The sum is wide enough
+    not to overflow.
+    """
+    builder = CircuitBuilder()
+    width = n + (operands - 1).bit_length()
+    values = [builder.inputs(n) for _ in range(operands)]
+    out = builder.sum(sign_extend(x, width) for x in values)
+    half = (operands + 1) // 2
+    return builder.circuit(f"{operands}x{n}-bit sum",
+                           [w for x in values[:half] for w in x],
+                           [w for x in values[half:] for w in x], out)
+
+
+Function = namedtuple("Function", ["generate", "reference"])
+
+# Functions of two signed values, by name: circuit generator of the given
+# width and result in the clear
+FUNCTIONS = {
+    "add": Function(adder, operator.add),
+    "sub": Function(subtractor, operator.sub),
+    "lt": Function(less_than, lambda x, y: int(x < y)),
+    "eq": Function(equality, lambda x, y: int(x == y)),
+    "mul": Function(multiplier, operator.mul),
+    "karatsuba": Function(lambda n: multiplier(n, karatsuba=True),
+                          operator.mul),
+}
+
+
+def cost(circuit):
+    """Return the cost of a circuit when garbled with Free-XOR.
+
+    Args:
+        circuit: A dict containing circuit spec, whose gates are in
+            topological order.
+
+    Returns:
+        A dict with the number of "gates", of AND gates ("and") and the AND
+        depth ("depth"), the largest number of AND gates on a path from an
+        input to an output.
+    """
+    depth = {}
+    and_gates = 0
+    for gate in circuit["gates"]:
+        free = gate["type"] in ("XOR", "XNOR", "NOT")
+        and_gates += not free
+        depth[gate["id"]] = max(depth.get(w, 0) for w in gate["in"]) + (
+            not free)
+    return {
+        "gates": len(circuit["gates"]),
+        "and": and_gates,
+        "depth": max((depth.get(w, 0) for w in circuit["out"]), default=0),
+    }
+
+
+def generate_and_save_circuit(path, function, number_of_bits):
+    """Generate the circuit of a function and save it to file.
+
+    Args:
+        path: A string containing the path for the file to save the circuit to.
+        function: The name of the function, one of FUNCTIONS.
+        number_of_bits: The width of the inputs.
+
+    Returns:
+        A dict containing the circuit spec.
+    """
+    circuit = FUNCTIONS[function].generate(number_of_bits)
+    with open(path, "w") as f:
+        json.dump({"name": function, "circuits": [circuit]}, f, indent=1)
+    return circuit
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Report the cost of the arithmetic circuits.")
+    parser.add_argument("functions",
+                        nargs="*",
+                        metavar="function",
+                        help=f"the functions to report, among "
+                        f"{', '.join([*FUNCTIONS, 'sum'])} (default all)")
+    parser.add_argument("--widths",
+                        type=int,
+                        nargs="+",
+                        default=[8, 32, 64, 128],
+                        help="the widths of the inputs (default 8 32 64 128)")
+    parser.add_argument("--operands",
+                        type=int,
+                        default=8,
+                        help="the number of values of sum (default 8)")
+    parser.add_argument("--output",
+                        help="save the circuits to this JSON file")
+    args = parser.parse_args()
+    for function in args.functions:
+        if function not in FUNCTIONS and function != "sum":
+            parser.error(f"unknown function '{function}'")
+
+    circuits = []
+    print(f"{'circuit':>24} {'gates':>10} {'and':>10} {'depth':>6}")
+    for function in args.functions or [*FUNCTIONS, "sum"]:
+        for n in args.widths:
+            if function == "sum":
+                circuit = multi_adder(n, args.operands)
+            else:
+                circuit = FUNCTIONS[function].generate(n)
+            circuits.append(circuit)
+            c = cost(circuit)
+            print(f"{circuit['id']:>24} {c['gates']:>10} {c['and']:>10} "
+                  f"{c['depth']:>6}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"name": "arithmetic", "circuits": circuits}, f,
+                      indent=1)
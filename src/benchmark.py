@@ -0,0 +1,606 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import compiler
+import contextlib
+import inspect
+import io
+import itertools
+import json
+import os
+import ot
+import parallel
+import parties
+import pickle
+import resource
+import secrets
+import sys
+import tempfile
+import time
+import util
+import yao
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+# Groups compared by the OT benchmark, as (backend, group name)
+OT_GROUPS = [("prime", None)] + [
+    ("prime", name) for name in util.STANDARD_GROUPS
+] + [("ec", None)]
+WIDTHS = (8, 64, 512, 4096, 16384)  # adder sizes swept by default, in bits
+MEMORY_WIDTHS = (16384, 65536)  # adder sizes of the memory benchmark
+# Fields telling results apart, matched when comparing with a baseline
+KEY_FIELDS = ("backend", "group", "scheme", "mode", "bits", "workers",
+              "lean")
+TOLERANCE = 0.25  # relative slowdown over the baseline flagged as regression
+MIN_TIME = 0.001  # seconds under which timings are too noisy to compare
+
+_endpoints = itertools.count()  # suffixes of the in-process endpoints
+
+
+def measure(func, repeat):
+    """Return the mean time of 'repeat' calls of func, in seconds."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def adder(bits):
+    """Return the spec of the adder circuit of 'bits' bits."""
+    return util.generate_circuit(bits, "adder", "adder")["circuits"][0]
+
+
+def random_inputs(garbled_circuit, wires):
+    """Return a dict mapping wires to the (key, encr_bit) of a random bit."""
+    keys, pbits = garbled_circuit.get_keys(), garbled_circuit.get_pbits()
+    inputs = {}
+    for w in wires:
+        bit = secrets.randbits(1)
+        inputs[w] = (keys[w][bit], pbits[w] ^ bit)
+    return inputs
+
+
+def local_sockets():
+    """Return a pair of connected (garbler, evaluator) in-process sockets."""
+    endpoint = f"inproc://benchmark-{next(_endpoints)}"
+    evaluator = util.EvaluatorSocket(endpoint)
+    return util.GarblerSocket(endpoint), evaluator
+
+
+def local_ot(G, b=1, msgs=(bytes(17), bytes(range(17)))):
+    """Run one oblivious transfer between two local parties.
+
+    Returns:
+        The message selected by the receiver.
+    """
+    c = G.gen_pow(G.rand_int())
+    x, h0 = ot.ObliviousTransfer.ot_choose(G, c, b)
+    c1, e0, e1 = ot.ObliviousTransfer.ot_encrypt(G, c, h0, msgs)
+    return ot.ObliviousTransfer.ot_decrypt(G, x, c1, (e0, e1)[b])
+
+
+def bench_ot_groups(repeat=100):
+    """Compare the groups of the public-key OTs.
+
+    Args:
+        repeat: Optional; the number of operations timed for each group.
+
+    Returns:
+        A list of dicts, one for each group of OT_GROUPS, with the times in
+        milliseconds of the setup of the group ("load_ms", process cache
+        excluded), of exponentiations of the generator ("gen_pow_ms") and of
+        other elements ("pow_ms"), and of a whole OT ("ot_ms").
+    """
+    results = []
+    for backend, name in OT_GROUPS:
+        start = time.perf_counter()
+        G = ot.GROUP_BACKENDS[backend].load(name)
+        load_ms = (time.perf_counter() - start) * 1000
+        element = G.gen_pow(G.rand_int())
+        results.append({
+            "backend": backend,
+            "group": name,
+            "load_ms": load_ms,
+            "gen_pow_ms": measure(lambda: G.gen_pow(G.rand_int()), repeat) *
+            1000,
+            "pow_ms": measure(lambda: G.pow(element, G.rand_int()), repeat) *
+            1000,
+            "ot_ms": measure(lambda: local_ot(G), repeat) * 1000,
+        })
+    return results
+
+
+def bench_parallel_garbling(repeat=1, workers=None, bits=1024):
+    """Report the speedup of garbling across worker processes.
+
+    Args:
+        repeat: Optional; the number of garblings timed for each scheme.
+        workers: Optional; the number of worker processes.
+            (by default, the number of CPUs)
+        bits: Optional; the size of the adder circuit garbled.
+
+    Returns:
+        A list of dicts, one for each scheme, with the number of "gates",
+        the times in seconds of sequential ("sequential_s") and parallel
+        ("parallel_s") garbling, and the "speedup".
+    """
+    workers = workers or os.cpu_count()
+    circuit = util.generate_circuit(bits, "adder", "adder")["circuits"][0]
+    results = []
+    for scheme in yao.SCHEMES:
+        sequential = measure(lambda: yao.GarbledCircuit(circuit, scheme=scheme),
+                             repeat)
+        parallel_ = measure(
+            lambda: parallel.ParallelGarbledCircuit(
+                circuit, scheme=scheme, workers=workers), repeat)
+        results.append({
+            "scheme": scheme,
+            "workers": workers,
+            "gates": len(circuit["gates"]),
+            "sequential_s": sequential,
+            "parallel_s": parallel_,
+            "speedup": sequential / parallel_,
+        })
+    return results
+
+
+def bench_garbling(repeat=1, widths=WIDTHS):
+    """Time the garbling of adders of several sizes with each scheme.
+
+    Args:
+        repeat: Optional; the number of garblings timed for each size.
+        widths: Optional; the sizes of the adders, in bits.
+
+    Returns:
+        A list of dicts, one for each size and scheme, with the number of
+        "gates" and the time in seconds of GarbledCircuit ("garble_s").
+    """
+    results = []
+    for bits in widths:
+        circuit = adder(bits)
+        for scheme in yao.SCHEMES:
+            results.append({
+                "bits": bits,
+                "scheme": scheme,
+                "gates": len(circuit["gates"]),
+                "garble_s": measure(
+                    lambda: yao.GarbledCircuit(circuit, scheme=scheme),
+                    repeat),
+            })
+    return results
+
+
+def max_rss():
+    """Return the peak resident set size of the process, in bytes.
+
+    On Linux, it is read from /proc: ru_maxrss also counts the memory of the
+    parent process when it was forked.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # else in KiB
+
+
+def garbling_rss(circuit, scheme, lean):
+    """Garble a circuit and keep what a garbler keeps of it; run in a fresh
+    process, so that its peak RSS is due to this garbling only.
+
+    Args:
+        circuit: The CompiledCircuit.
+        scheme: The garbling scheme, one of yao.SCHEMES.
+        lean: Whether to garble a yao.LeanGarbledCircuit.
+
+    Returns:
+        The peak RSS of the process in bytes, before and after garbling.
+    """
+    before = max_rss()
+    garbled_circuit = (yao.LeanGarbledCircuit if lean else
+                       yao.GarbledCircuit)(circuit, scheme=scheme)
+    # What YaoGarbler.garble keeps, alive until the peak is read
+    entry = (garbled_circuit.get_garbled_tables(), garbled_circuit.get_keys(),
+             garbled_circuit.get_pbits())
+    return before, max_rss()
+
+
+def bench_memory(widths=MEMORY_WIDTHS, scheme="half-gates"):
+    """Measure the memory taken by garbling adders, lean or not.
+
+    Each garbling is run in a new process, which only receives the compiled
+    circuit, and its peak resident set size (RSS) measured.
+
+    Args:
+        widths: Optional; the sizes of the adders, in bits.
+        scheme: Optional; the garbling scheme, one of yao.LABEL_SCHEMES.
+
+    Returns:
+        A list of dicts, one for each size and mode, with the number of
+        "gates", the peak RSS of the process in MiB ("peak_mib") and the
+        growth of the peak RSS due to garbling, per million gates
+        ("mib_per_mgate").
+    """
+    results = []
+    for bits in widths:
+        circuit = compiler.compile_circuit(adder(bits))
+        for lean in (False, True):
+            with ProcessPoolExecutor(
+                    max_workers=1, mp_context=get_context("spawn")) as executor:
+                before, after = executor.submit(garbling_rss, circuit, scheme,
+                                                lean).result()
+            results.append({
+                "bits": bits,
+                "scheme": scheme,
+                "lean": lean,
+                "gates": circuit.num_gates,
+                "peak_mib": after / 2**20,
+                "mib_per_mgate": (after - before) / 2**20 * 10**6 /
+                circuit.num_gates,
+            })
+    return results
+
+
+def bench_evaluation(repeat=1, widths=WIDTHS):
+    """Time the evaluation of adders of several sizes with each scheme.
+
+    Args:
+        repeat: Optional; the number of evaluations timed for each size.
+        widths: Optional; the sizes of the adders, in bits.
+
+    Returns:
+        A list of dicts, one for each size and scheme, with the number of
+        "gates" and the time in seconds of yao.evaluate ("evaluate_s").
+    """
+    results = []
+    for bits in widths:
+        circuit = adder(bits)
+        for scheme in yao.SCHEMES:
+            garbled_circuit = yao.GarbledCircuit(circuit, scheme=scheme)
+            pbits = garbled_circuit.get_pbits()
+            pbits_out = {w: pbits[w] for w in circuit["out"]}
+            a_inputs = random_inputs(garbled_circuit, circuit["alice"])
+            b_inputs = random_inputs(garbled_circuit, circuit["bob"])
+            results.append({
+                "bits": bits,
+                "scheme": scheme,
+                "gates": len(circuit["gates"]),
+                "evaluate_s": measure(
+                    lambda: yao.evaluate(garbled_circuit.circuit,
+                                         garbled_circuit.get_garbled_tables(),
+                                         pbits_out, a_inputs, b_inputs,
+                                         scheme=scheme), repeat),
+            })
+    return results
+
+
+def bench_serialization(repeat=1, widths=WIDTHS):
+    """Time the pickle serialization of the garbled tables of adders.
+
+    Args:
+        repeat: Optional; the number of serializations timed for each size.
+        widths: Optional; the sizes of the adders, in bits.
+
+    Returns:
+        A list of dicts, one for each size and scheme, with the size of the
+        pickled tables ("bytes") and the times in seconds of pickling
+        ("dumps_s") and unpickling them ("loads_s").
+    """
+    results = []
+    for bits in widths:
+        circuit = adder(bits)
+        for scheme in yao.SCHEMES:
+            tables = yao.GarbledCircuit(circuit,
+                                        scheme=scheme).get_garbled_tables()
+            data = pickle.dumps(tables)
+            results.append({
+                "bits": bits,
+                "scheme": scheme,
+                "bytes": len(data),
+                "dumps_s": measure(lambda: pickle.dumps(tables), repeat),
+                "loads_s": measure(lambda: pickle.loads(data), repeat),
+            })
+    return results
+
+
+async def time_ot(mode, num_wires, repeat, backend="prime"):
+    """Time the transfer of keys between two local parties in an OT mode.
+
+    Args:
+        mode: The OT mode, one of ot.OT_MODES.
+        num_wires: The number of Bob's wires, whose keys are transferred.
+        repeat: The number of transfers timed.
+        backend: Optional; the kind of group of the public-key OTs.
+
+    Returns:
+        A pair with the mean times in seconds of the transfers and, in
+        "pool" mode, of the refills of the pools before them (else None).
+    """
+    garbler_socket, evaluator_socket = local_sockets()
+    garbler, evaluator = (
+        ot.ObliviousTransfer(socket, mode=mode, backend=backend,
+                             pool_capacity=num_wires)
+        for socket in (garbler_socket, evaluator_socket))
+    b_keys = {
+        w: ((secrets.randbits(yao.LABEL_BITS), 0),
+            (secrets.randbits(yao.LABEL_BITS), 1))
+        for w in range(num_wires)
+    }
+    b_inputs = {w: secrets.randbits(1) for w in b_keys}
+
+    async def fill_pool_evaluator():
+        await evaluator.fill_pool_evaluator(await evaluator_socket.receive())
+
+    ot_time = fill_time = 0.0
+    try:
+        for _ in range(repeat):
+            if garbler.pool is not None:
+                start = time.perf_counter()
+                await asyncio.gather(garbler.fill_pool_garbler(num_wires),
+                                     fill_pool_evaluator())
+                fill_time += time.perf_counter() - start
+            start = time.perf_counter()
+            await asyncio.gather(garbler.send_inputs({}, b_keys),
+                                 evaluator.receive_inputs(b_inputs))
+            ot_time += time.perf_counter() - start
+    finally:
+        garbler_socket.socket.close(linger=0)
+        evaluator_socket.socket.close(linger=0)
+    return ot_time / repeat, (fill_time / repeat
+                              if garbler.pool is not None else None)
+
+
+def bench_ot_modes(repeat=1, widths=WIDTHS, backend="prime"):
+    """Time the transfer of Bob's keys in each OT mode.
+
+    Args:
+        repeat: Optional; the number of transfers timed for each size.
+        widths: Optional; the numbers of Bob's wires.
+        backend: Optional; the kind of group of the public-key OTs, one of
+            ot.GROUP_BACKENDS.
+
+    Returns:
+        A list of dicts, one for each number of wires ("bits") and OT mode,
+        with the time in seconds of the transfer ("ot_s") and, in "pool"
+        mode, of the refill of the pools beforehand ("fill_s").
+    """
+    results = []
+    for bits in widths:
+        for mode in ot.OT_MODES:
+            ot_s, fill_s = asyncio.run(time_ot(mode, bits, repeat, backend))
+            results.append({
+                "bits": bits,
+                "mode": mode,
+                "backend": backend,
+                "ot_s": ot_s,
+                "fill_s": fill_s,
+            })
+    return results
+
+
+async def local_run(directory, bits, scheme, ot_mode):
+    """Run the whole protocol between an Alice and a Bob of this process.
+
+    Args:
+        directory: The directory of the circuit, input and output files.
+        bits: The size of the adder, in bits.
+        scheme: The garbling scheme, one of yao.SCHEMES.
+        ot_mode: The OT mode, one of ot.OT_MODES.
+
+    Returns:
+        A pair with the time in seconds of Alice's garbling and session
+        (Bob is set up beforehand), and whether the result is correct.
+    """
+    paths = {
+        name: os.path.join(directory, name)
+        for name in ("circuit.json", "alice.txt", "bob.txt", "output.txt")
+    }
+    util.generate_and_save_circuit(paths["circuit.json"], bits)
+    for name in ("alice.txt", "bob.txt"):
+        with open(paths[name], "w") as f:
+            f.write(str(secrets.randbelow(2**(bits - 2))))
+
+    garbler_socket, evaluator_socket = local_sockets()
+    bob = parties.Bob(paths["bob.txt"], bits, socket=evaluator_socket,
+                      ot_mode=ot_mode, pool_path=None)
+    listening = asyncio.create_task(bob.listen())
+    try:
+        start = time.perf_counter()
+        alice = parties.Alice(paths["circuit.json"], paths["alice.txt"],
+                              paths["output.txt"], bits, socket=garbler_socket,
+                              scheme=scheme, ot_mode=ot_mode, pool_path=None)
+        await alice.start()
+        elapsed = time.perf_counter() - start
+    finally:
+        listening.cancel()
+        await listening
+        garbler_socket.socket.close(linger=0)
+        evaluator_socket.socket.close(linger=0)
+    return elapsed, util.verify(paths["alice.txt"], paths["bob.txt"],
+                                paths["output.txt"])
+
+
+def bench_end_to_end(repeat=1, widths=WIDTHS, scheme="half-gates",
+                     ot_mode="iknp"):
+    """Time whole runs of the protocol over an in-process transport.
+
+    Args:
+        repeat: Optional; the number of runs timed for each size.
+        widths: Optional; the sizes of the adders, in bits.
+        scheme: Optional; the garbling scheme, one of yao.SCHEMES.
+        ot_mode: Optional; the OT mode, one of ot.OT_MODES.
+
+    Returns:
+        A list of dicts, one for each size, with the mean time in seconds
+        of a run ("run_s") and whether all the results were "correct".
+    """
+    results = []
+    for bits in widths:
+        total, correct = 0.0, True
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory() as directory, \
+                    contextlib.redirect_stdout(io.StringIO()):
+                elapsed, ok = asyncio.run(
+                    local_run(directory, bits, scheme, ot_mode))
+            total += elapsed
+            correct = correct and ok
+        results.append({
+            "bits": bits,
+            "scheme": scheme,
+            "mode": ot_mode,
+            "run_s": total / repeat,
+            "correct": correct,
+        })
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE, min_time=MIN_TIME):
+    """Return the regressions of benchmark results against a baseline.
+
+    Results are matched with the ones of the baseline of the same benchmark
+    by their KEY_FIELDS. Their timings (fields ending in "_s" or "_ms")
+    slower than in the baseline by more than 'tolerance' are regressions,
+    unless they are under 'min_time' seconds in both.
+
+    Args:
+        results: A dict mapping benchmark names to their list of results.
+        baseline: The results of an earlier run, in the same format.
+        tolerance: Optional; the relative slowdown tolerated.
+        min_time: Optional; the time in seconds under which timings are
+            not compared.
+
+    Returns:
+        A list of dicts, one for each regression, with the "benchmark", the
+        "key" fields of the result, the timing ("metric"), its "baseline"
+        and "current" values and the "slowdown" (ratio of the two).
+    """
+    regressions = []
+    for name, rows in results.items():
+        baseline_rows = {
+            _key(row): row for row in baseline.get(name, [])
+        }
+        for row in rows:
+            old = baseline_rows.get(_key(row))
+            if old is None:
+                continue
+            for metric, value in row.items():
+                unit = 1000 if metric.endswith("_ms") else 1
+                if not metric.endswith(("_s", "_ms")) or value is None or \
+                        old.get(metric) is None:
+                    continue
+                if max(value, old[metric]) / unit < min_time:
+                    continue
+                if value > old[metric] * (1 + tolerance):
+                    regressions.append({
+                        "benchmark": name,
+                        "key": dict(_key(row)),
+                        "metric": metric,
+                        "baseline": old[metric],
+                        "current": value,
+                        "slowdown": value / old[metric],
+                    })
+    return regressions
+
+
+def _key(row):
+    """Return the fields of a result telling it apart, as a tuple."""
+    return tuple((field, row[field]) for field in KEY_FIELDS if field in row)
+
+
+def print_results(results):
+    """Print a list of benchmark results as a table."""
+    columns = list(results[0])
+    print("  ".join(f"{column:>12}" for column in columns))
+    for result in results:
+        print("  ".join(
+            f"{value:>12.6f}" if isinstance(value, float) else
+            f"{str(value):>12}" for value in result.values()))
+
+
+if __name__ == '__main__':
+    benchmarks = {
+        "garbling": bench_garbling,
+        "memory": bench_memory,
+        "evaluation": bench_evaluation,
+        "ot-modes": bench_ot_modes,
+        "serialization": bench_serialization,
+        "end-to-end": bench_end_to_end,
+        "ot-groups": bench_ot_groups,
+        "parallel-garbling": bench_parallel_garbling,
+    }
+    parser = argparse.ArgumentParser(description="Run benchmarks.")
+    parser.add_argument("benchmarks",
+                        nargs="+",
+                        choices=list(benchmarks) + ["all"],
+                        help="the benchmarks to run (all: every one)")
+    parser.add_argument("--repeat",
+                        type=int,
+                        help="the number of timed operations")
+    parser.add_argument("--workers",
+                        type=int,
+                        help="the number of worker processes")
+    parser.add_argument("--bits",
+                        type=int,
+                        help="the size of the benchmarked circuits")
+    parser.add_argument("--widths",
+                        type=int,
+                        nargs="+",
+                        help=f"the sizes of the circuits swept, in bits "
+                        f"(default {' '.join(map(str, WIDTHS))})")
+    parser.add_argument("--backend",
+                        choices=ot.GROUP_BACKENDS.keys(),
+                        help="the group backend of the OT modes benchmark")
+    parser.add_argument("--scheme",
+                        choices=yao.SCHEMES,
+                        help="the garbling scheme of the end-to-end runs "
+                        "and of the memory benchmark")
+    parser.add_argument("--ot-mode",
+                        choices=ot.OT_MODES,
+                        help="the OT mode of the end-to-end runs")
+    parser.add_argument("--json",
+                        help="write the results as JSON to this file "
+                        "('-' for the standard output)")
+    parser.add_argument("--baseline",
+                        help="compare the results with the ones of this "
+                        "JSON file, and fail on regressions")
+    parser.add_argument("--tolerance",
+                        type=float,
+                        default=TOLERANCE,
+                        help=f"the relative slowdown over the baseline "
+                        f"flagged as a regression (default {TOLERANCE})")
+    args = parser.parse_args()
+
+    names = list(benchmarks) if "all" in args.benchmarks else args.benchmarks
+    results = {}
+    for name in names:
+        benchmark = benchmarks[name]
+        # Only pass the options given on the command line that it takes
+        options = {
+            option: value
+            for option, value in vars(args).items() if value is not None and
+            option in inspect.signature(benchmark).parameters
+        }
+        results[name] = benchmark(**options)
+        if args.json != "-":
+            print(f"== {name}")
+            print_results(results[name])
+
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=1)
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression['benchmark']} "
+                  f"{regression['key']}: {regression['metric']} "
+                  f"{regression['baseline']:.6f} -> "
+                  f"{regression['current']:.6f} "
+                  f"(x{regression['slowdown']:.2f})", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
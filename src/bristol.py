@@ -0,0 +1,135 @@
+import compiler
+import os
+from array import array
+
+# Type codes of the 2-input gates, by Bristol Fashion name
+BRISTOL_GATES = {
+    name: compiler.GATE_CODES[name]
+    for name in ("XOR", "AND")
+}
+
+
+def is_bristol(path):
+    """Return whether the file at 'path' holds a Bristol Fashion circuit.
+
+    Bristol Fashion files start with the number of gates and of wires,
+    while circuit spec files are JSON objects.
+    """
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                return line.split()[0].isdigit()
+    return False
+
+
+def load(path, alice_values=None):
+    """Load a Bristol Fashion circuit, compiled as it is parsed.
+
+    The file is read line by line, and each gate is appended to the arrays
+    of the CompiledCircuit: no dict is built per gate, so that circuits of
+    hundreds of thousands of gates, such as AES or SHA-256, load quickly and
+    take little memory. INV gates are NOT gates; EQW gates copy a wire and
+    become no gate at all; EQ gates, which set a wire to a constant, become
+    an XOR or XNOR of the first input wire with itself, and MAND gates one
+    AND gate per pair of inputs.
+
+    Bits of the input and output values are numbered from the least
+    significant one, while the wire lists of circuits start with the most
+    significant bit: Alice's wires are those of her values, from the last
+    value to the first one and from the last wire of each value, and so on.
+    The original ID of a wire is its Bristol Fashion number.
+
+    Args:
+        path: A string containing the path to the Bristol Fashion file.
+        alice_values: Optional; the number of input values of Alice, the
+            first ones, the others being Bob's. (by default, the first half
+            of the values, rounded up)
+
+    Returns:
+        The CompiledCircuit, whose id is the name of the file.
+
+    Raises:
+        ValueError: The file is not a valid Bristol Fashion circuit.
+    """
+    with open(path) as f:
+        lines = (line.split() for line in f)
+        lines = (line for line in lines if line)
+        try:
+            num_gates, num_wires = map(int, next(lines))
+            input_sizes = [int(n) for n in next(lines)[1:]]
+            output_sizes = [int(n) for n in next(lines)[1:]]
+        except (StopIteration, ValueError):
+            raise ValueError(f"{path} has no valid Bristol Fashion header")
+
+        num_inputs = sum(input_sizes)
+        if alice_values is None:
+            alice_values = (len(input_sizes) + 1) // 2
+        num_alice = sum(input_sizes[:alice_values])
+
+        # Dense index of each Bristol wire, -1 until it is driven
+        index = array("i", range(num_inputs)) + array(
+            "i", [-1]) * (num_wires - num_inputs)
+        wire_ids = array("i", range(num_inputs))
+        types, in0, in1 = array("B"), array("i"), array("i")
+
+        def read(wire):
+            if index[wire] < 0:
+                raise ValueError(f"{path}: wire {wire} is read before it is "
+                                 f"driven")
+            return index[wire]
+
+        def drive(out, wire):
+            if index[out] >= 0:
+                raise ValueError(f"{path}: wire {out} is driven more than "
+                                 f"once")
+            index[out] = wire
+
+        def add(code, out, a, b=compiler.NO_WIRE):
+            drive(out, len(wire_ids))
+            types.append(code)
+            in0.append(a)
+            in1.append(b)
+            wire_ids.append(out)
+
+        num_read = 0
+        for line in lines:
+            num_read += 1
+            code = BRISTOL_GATES.get(line[-1])
+            if code is not None and len(line) == 6:  # the bulk of the gates
+                a, b = index[int(line[2])], index[int(line[3])]
+                if a < 0 or b < 0:
+                    raise ValueError(f"{path}: gate {' '.join(line)} reads "
+                                     f"a wire before it is driven")
+                add(code, int(line[4]), a, b)
+                continue
+            try:
+                num_in, num_out = int(line[0]), int(line[1])
+                wires = [int(w) for w in line[2:2 + num_in + num_out]]
+                name = line[2 + num_in + num_out]
+            except (IndexError, ValueError):
+                raise ValueError(f"{path}: invalid gate {' '.join(line)}")
+            ins, outs = wires[:num_in], wires[num_in:]
+            if name == "INV":
+                add(compiler.NOT, outs[0], read(ins[0]))
+            elif name == "EQW":
+                drive(outs[0], read(ins[0]))
+            elif name == "EQ":
+                if not num_inputs:
+                    raise ValueError(f"{path}: EQ gate without input wires")
+                add(compiler.GATE_CODES["XNOR" if ins[0] else "XOR"], outs[0],
+                    0, 0)
+            elif name == "MAND":
+                for a, b, out in zip(ins, ins[num_out:], outs):
+                    add(compiler.GATE_CODES["AND"], out, read(a), read(b))
+            else:
+                raise ValueError(f"{path}: unknown gate {name}")
+        if num_read != num_gates:
+            raise ValueError(f"{path}: {num_read} gates instead of "
+                             f"{num_gates}")
+
+    out = [read(w) for w in range(num_wires - sum(output_sizes), num_wires)]
+    return compiler.CompiledCircuit(os.path.basename(path), wire_ids,
+                                    num_inputs,
+                                    list(range(num_alice))[::-1],
+                                    list(range(num_alice, num_inputs))[::-1],
+                                    out[::-1], types, in0, in1)
@@ -0,0 +1,200 @@
+import bristol
+import compiler
+import hashlib
+import json
+import logging
+import mmap
+import optimizer
+import os
+import pickle
+import struct
+import sys
+import util
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "yao",
+                         "circuits")
+CACHE_VERSION = 1  # version of the format of the cached circuits
+MAGIC = b"YAOC"
+PREFIX = struct.Struct("<4sIQ")  # magic, version, length of the header
+ALIGNMENT = 8  # arrays start at multiples of this offset
+
+# Type code of each array of a CompiledCircuit
+ARRAYS = (("wire_ids", "q"), ("types", "B"), ("in0", "i"), ("in1", "i"))
+
+
+def read_circuits(path):
+    """Read a circuits file: a JSON file of specs or a Bristol Fashion circuit.
+
+    Args:
+        path: A string containing the path of the circuits file.
+
+    Returns:
+        A dict with the "name" of the circuits and the list of "circuits",
+        specs or, for Bristol Fashion, a CompiledCircuit.
+    """
+    if bristol.is_bristol(path):
+        return {"name": os.path.basename(path),
+                "circuits": [bristol.load(path)]}
+    return util.parse_json(path)
+
+
+def circuits_key(path, **params):
+    """Return the cache key of a circuits file: the SHA-256 of its content
+    and of the parameters it was generated and prepared with.
+
+    Args:
+        path: A string containing the path of the circuits file.
+        **params: The parameters, which must be JSON serializable.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    digest.update(json.dumps({"version": CACHE_VERSION, **params},
+                             sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def save(key, circuits, cache_dir=CACHE_DIR):
+    """Save compiled circuits to the cache.
+
+    The file starts with a pickled header describing each circuit, followed
+    by the arrays of the circuits (see compiler.CompiledCircuit) as raw
+    native values, so that load maps them in place.
+
+    Args:
+        key: The cache key, as returned by circuits_key.
+        circuits: A dict with the "name" of the circuits and the list of
+            "circuits", specs or CompiledCircuits.
+        cache_dir: Optional; the directory of the cache.
+    """
+    compiled = [compiler.compile_circuit(c) for c in circuits["circuits"]]
+    buffers = [[compiler.as_array(typecode, getattr(circuit, name))
+                for name, typecode in ARRAYS] for circuit in compiled]
+
+    entries = []
+    offset = 0  # relative to the end of the header
+    for circuit, arrays in zip(compiled, buffers):
+        extents = []
+        for values in arrays:
+            size = len(values) * values.itemsize
+            extents.append((offset, size))
+            offset += -(-size // ALIGNMENT) * ALIGNMENT
+        entries.append({
+            "id": circuit.id,
+            "num_inputs": circuit.num_inputs,
+            "alice": list(circuit.alice),
+            "bob": list(circuit.bob),
+            "out": list(circuit.out),
+            "extents": extents,
+        })
+    header = pickle.dumps({
+        "byteorder": sys.byteorder,
+        "name": circuits["name"],
+        "circuits": entries,
+    })
+    header += bytes(-(PREFIX.size + len(header)) % ALIGNMENT)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{key}.circuits")
+    with open(f"{path}.tmp", "wb") as f:
+        f.write(PREFIX.pack(MAGIC, CACHE_VERSION, len(header)))
+        f.write(header)
+        for arrays in buffers:
+            for values in arrays:
+                size = len(values) * values.itemsize
+                f.write(values)
+                f.write(bytes(-size % ALIGNMENT))
+    os.replace(f"{path}.tmp", path)  # readers never see a partial file
+
+
+def load(key, cache_dir=CACHE_DIR):
+    """Load compiled circuits from the cache.
+
+    The file is memory-mapped and the arrays of the circuits are read in
+    place through memoryviews: pages are only read when used.
+
+    Args:
+        key: The cache key, as returned by circuits_key.
+        cache_dir: Optional; the directory of the cache.
+
+    Returns:
+        A dict with the "name" of the circuits and the list of "circuits",
+        as CompiledCircuits, or None if they are not in the cache.
+    """
+    path = os.path.join(cache_dir, f"{key}.circuits")
+    try:
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):  # missing, or empty
+        return None
+    if len(buffer) < PREFIX.size:
+        return None
+    magic, version, header_size = PREFIX.unpack_from(buffer)
+    if magic != MAGIC or version != CACHE_VERSION:
+        return None
+    start = PREFIX.size + header_size
+    header = pickle.loads(buffer[PREFIX.size:start])
+    if header["byteorder"] != sys.byteorder:
+        return None
+
+    view = memoryview(buffer)
+    circuits = []
+    for entry in header["circuits"]:
+        arrays = [
+            view[start + offset:start + offset + size].cast(typecode)
+            for (_, typecode), (offset, size) in zip(ARRAYS,
+                                                     entry["extents"])
+        ]
+        circuits.append(compiler.CompiledCircuit(
+            entry["id"], arrays[0], entry["num_inputs"], entry["alice"],
+            entry["bob"], entry["out"], *arrays[1:]))
+    return {"name": header["name"], "circuits": circuits}
+
+
+def lookup(path, cache_dir=CACHE_DIR, **params):
+    """Return the cached circuits of a circuits file, or None if not cached.
+
+    Args:
+        path: A string containing the path of the circuits file.
+        cache_dir: Optional; the directory of the cache.
+        **params: The parameters the circuits were prepared with, as given
+            to compile_circuits, including 'optimize'.
+    """
+    if not os.path.exists(path):
+        return None
+    circuits = load(circuits_key(path, **params), cache_dir)
+    if circuits is not None:
+        logging.info(f"Loaded the circuits of {path} from the cache")
+    return circuits
+
+
+def compile_circuits(path, optimize=False, cache_dir=CACHE_DIR, **params):
+    """Read and compile the circuits of a file, and save them to the cache.
+
+    The circuits are saved under the key of the file content and of the
+    parameters, including 'optimize', so that lookup finds them next time.
+
+    Args:
+        path: A string containing the path of the circuits file.
+        optimize: Optional; optimize the circuits (see optimizer). Only the
+            circuits of JSON files can be optimized. (False by default)
+        cache_dir: Optional; the directory of the cache, or None not to
+            use it.
+        **params: The parameters the file was generated with.
+
+    Returns:
+        A dict with the "name" of the circuits and the list of "circuits",
+        as CompiledCircuits.
+    """
+    circuits = read_circuits(path)
+    compiled = []
+    for circuit in circuits["circuits"]:
+        if optimize and not isinstance(circuit, compiler.CompiledCircuit):
+            circuit = optimizer.optimize_checked(circuit)
+        compiled.append(compiler.compile_circuit(circuit))
+    circuits = {"name": circuits["name"], "circuits": compiled}
+    if cache_dir is not None:
+        save(circuits_key(path, optimize=optimize, **params), circuits,
+             cache_dir)
+    return circuits
@@ -0,0 +1,275 @@
+import compiler
+import pickle
+import sys
+from array import array
+
+FORMAT_VERSION = 1  # version of the binary garbled circuit format
+
+
+class GarbledTablesView:
+    """A read-only sequence of garbled tables over one contiguous buffer.
+
+    Tables are stored back to back in gate order; the size of each one only
+    depends on the gate type. Iterating yields a memoryview slice of the
+    buffer for each gate, or None for free gates.
+
+    Args:
+        types: The gate type codes of the circuit.
+        sizes: A list mapping each gate type code to its table size.
+        buffer: The buffer containing all the tables.
+    """
+    def __init__(self, types, sizes, buffer):
+        self.types = types
+        self.sizes = sizes
+        self.buffer = memoryview(buffer)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __iter__(self):
+        sizes, buffer = self.sizes, self.buffer
+        offset = 0
+        for code in self.types:
+            size = sizes[code]
+            if size:
+                yield buffer[offset:offset + size]
+                offset += size
+            else:
+                yield None
+
+
+def table_sizes(types, g_tables):
+    """Return a list mapping each gate type code to its table size.
+
+    Args:
+        types: The gate type codes of the gates.
+        g_tables: The garbled tables of the same gates.
+
+    Raises:
+        ValueError: Two tables of gates of the same type differ in size.
+    """
+    if isinstance(g_tables, GarbledTablesView):
+        return list(g_tables.sizes)
+    sizes = [None] * len(compiler.GATE_TYPES)
+    for code, table in zip(types, g_tables):
+        size = len(table) if table is not None else 0
+        if sizes[code] is None:
+            sizes[code] = size
+        elif sizes[code] != size:
+            raise ValueError(f"Garbled tables of "
+                             f"{compiler.GATE_TYPES[code]} gates differ "
+                             f"in size")
+    return [size or 0 for size in sizes]
+
+
+def join_tables(g_tables):
+    """Return the garbled tables of gates as one buffer, back to back.
+
+    Tables already stored in one buffer (see GarbledTablesView) are not
+    copied.
+
+    Args:
+        g_tables: The garbled tables, in compiled gate order.
+    """
+    if isinstance(g_tables, GarbledTablesView):
+        return g_tables.buffer
+    return b"".join(table for table in g_tables if table is not None)
+
+
+def encode(circuit, g_tables, pbits_out, scheme):
+    """Encode a garbled circuit into a list of frames.
+
+    The first frame is a small pickled header; the others are the raw
+    buffers of the compiled circuit arrays and of all the garbled tables,
+    which can be sent without copy.
+
+    Args:
+        circuit: The CompiledCircuit.
+        g_tables: The garbled tables, in compiled gate order.
+        pbits_out: A dict mapping output wires to their p-bits.
+        scheme: The scheme the circuit was garbled with.
+
+    Returns:
+        A list of frames (bytes-like objects).
+    """
+    header = _circuit_header(circuit, scheme)
+    header["pbits_out"] = pbits_out
+    header["sizes"] = table_sizes(circuit.types, g_tables)
+    return [pickle.dumps(header)] + _circuit_frames(circuit) + [
+        join_tables(g_tables)
+    ]
+
+
+def encode_batch(circuit, tables_list, pbits_out_list, scheme):
+    """Encode many garblings of the same circuit into a list of frames.
+
+    The circuit arrays are sent once, followed by the tables of each
+    garbled instance, one frame per instance.
+
+    Args:
+        circuit: The CompiledCircuit.
+        tables_list: The garbled tables of each instance, in compiled gate
+            order.
+        pbits_out_list: A dict mapping output wires to their p-bits, for
+            each instance.
+        scheme: The scheme the circuit was garbled with.
+
+    Returns:
+        A list of frames (bytes-like objects).
+    """
+    header = _circuit_header(circuit, scheme)
+    header["batch"] = len(tables_list)
+    header["pbits_out"] = pbits_out_list
+    header["sizes"] = table_sizes(circuit.types, tables_list[0])
+    tables = [join_tables(g_tables) for g_tables in tables_list]
+    return [pickle.dumps(header)] + _circuit_frames(circuit) + tables
+
+
+def encode_stream(circuit, scheme):
+    """Encode the circuit of a streamed garbled circuit into frames.
+
+    The garbled tables follow in chunks (see encode_chunk), the last of
+    which carries the p-bits of the outputs.
+
+    Args:
+        circuit: The CompiledCircuit.
+        scheme: The scheme the circuit is garbled with.
+
+    Returns:
+        A list of frames (bytes-like objects).
+    """
+    header = _circuit_header(circuit, scheme)
+    header["stream"] = True
+    return [pickle.dumps(header)] + _circuit_frames(circuit)
+
+
+def decode(frames):
+    """Decode a list of frames built by encode or encode_stream.
+
+    Arrays and tables are read in place through memoryviews.
+
+    Args:
+        frames: A list of bytes-like objects.
+
+    Returns:
+        A dict with the "circuit" (a CompiledCircuit), its "garbled_tables"
+        (a GarbledTablesView), "pbits_out", "scheme" and whether tables are
+        streamed ("stream"), in which case there are no tables nor p-bits.
+        For a batch (see encode_batch), "batch" is the number of instances,
+        and "garbled_tables" and "pbits_out" are lists, one item per
+        instance.
+
+    Raises:
+        ValueError: The frames are not a garbled circuit of this version.
+    """
+    header = pickle.loads(frames[0])
+    if header.get("version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported garbled circuit format "
+                         f"{header.get('version')}")
+    stream = header.get("stream", False)
+    batch = header.get("batch")
+    if len(frames) != (5 if stream else 5 + (batch or 1)):
+        raise ValueError(f"Unexpected number of frames: {len(frames)}")
+    swap = header["byteorder"] != sys.byteorder
+    wire_ids, types, in0, in1 = (
+        _view(typecode, frame, swap)
+        for typecode, frame in zip("qBii", frames[1:5]))
+
+    circuit = compiler.CompiledCircuit(header["id"], wire_ids,
+                                       header["num_inputs"], header["alice"],
+                                       header["bob"], header["out"], types,
+                                       in0, in1)
+    tables = [GarbledTablesView(types, header["sizes"], frame)
+              for frame in frames[5:]]
+    return {
+        "circuit": circuit,
+        "garbled_tables": tables if batch else None if stream else tables[0],
+        "pbits_out": header.get("pbits_out"),
+        "scheme": header["scheme"],
+        "stream": stream,
+        "batch": batch,
+    }
+
+
+def encode_chunk(types, g_tables, pbits_out=None):
+    """Encode a chunk of garbled tables of a streamed circuit into frames.
+
+    Args:
+        types: The gate type codes of the gates of the chunk.
+        g_tables: The garbled tables of the chunk.
+        pbits_out: Optional; the dict of output p-bits, only given with the
+            last chunk.
+
+    Returns:
+        A list of frames (bytes-like objects).
+    """
+    header = {
+        "num_gates": len(g_tables),
+        "sizes": table_sizes(types, g_tables),
+        "pbits_out": pbits_out,
+    }
+    return [pickle.dumps(header), join_tables(g_tables)]
+
+
+def decode_chunk(frames, circuit, start):
+    """Decode a chunk of garbled tables built by encode_chunk.
+
+    Args:
+        frames: A list of bytes-like objects.
+        circuit: The CompiledCircuit the chunk belongs to.
+        start: The index of the first gate of the chunk.
+
+    Returns:
+        A dict with the "garbled_tables" (a GarbledTablesView) of the chunk,
+        its number of gates ("num_gates") and "pbits_out" (None but for the
+        last chunk).
+    """
+    header = pickle.loads(frames[0])
+    num_gates = header["num_gates"]
+    types = circuit.types[start:start + num_gates]
+    return {
+        "garbled_tables": GarbledTablesView(types, header["sizes"],
+                                            frames[1]),
+        "num_gates": num_gates,
+        "pbits_out": header["pbits_out"],
+    }
+
+
+def _circuit_header(circuit, scheme):
+    """Return the header fields describing a compiled circuit."""
+    return {
+        "version": FORMAT_VERSION,
+        "byteorder": sys.byteorder,
+        "id": circuit.id,
+        "scheme": scheme,
+        "num_inputs": circuit.num_inputs,
+        "alice": circuit.alice,
+        "bob": circuit.bob,
+        "out": circuit.out,
+    }
+
+
+def _circuit_frames(circuit):
+    """Return the raw buffers of the arrays of a compiled circuit."""
+    return [
+        compiler.as_array("q", circuit.wire_ids),
+        compiler.as_array("B", circuit.types),
+        compiler.as_array("i", circuit.in0),
+        compiler.as_array("i", circuit.in1),
+    ]
+
+
+def _view(typecode, buffer, swap):
+    """Return a typed read-only view over a buffer of native values.
+
+    If the sender had another byte order, the values are copied and swapped.
+    """
+    if swap:
+        values = array(typecode)
+        values.frombytes(buffer)
+        values.byteswap()
+        return values
+    view = memoryview(buffer)
+    if view.format != "B":
+        view = view.cast("B")
+    return view.cast(typecode)
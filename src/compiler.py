@@ -0,0 +1,221 @@
+from array import array
+from itertools import chain
+
+# Gate type codes, in the order of their index
+GATE_TYPES = ("AND", "OR", "XOR", "NAND", "NOR", "XNOR", "NOT")
+GATE_CODES = {gate_type: code for code, gate_type in enumerate(GATE_TYPES)}
+NOT = GATE_CODES["NOT"]
+NO_WIRE = -1  # second input of 1-input gates
+
+
+class CompiledCircuit:
+    """A circuit compiled into dense, topologically sorted arrays.
+
+    Wires are renumbered contiguously: Alice's input wires first, then Bob's,
+    then the output wire of each gate in evaluation order, so that gate i
+    drives wire num_inputs + i. Gate attributes are stored in parallel
+    arrays indexed by gate position.
+
+    Args:
+        id: A string containing the id of the circuit.
+        wire_ids: A list mapping each dense wire index to its original ID.
+        num_inputs: The number of input wires.
+        alice: A list of Alice's input wires (dense indices).
+        bob: A list of Bob's input wires (dense indices).
+        out: A list of output wires (dense indices).
+        types: An array of gate type codes (see GATE_TYPES).
+        in0: An array of first input wires.
+        in1: An array of second input wires (NO_WIRE for NOT gates).
+    """
+    def __init__(self, id, wire_ids, num_inputs, alice, bob, out, types, in0,
+                 in1):
+        self.id = id
+        self.wire_ids = wire_ids
+        self.num_inputs = num_inputs
+        self.alice = alice
+        self.bob = bob
+        self.out = out
+        self.types = types
+        self.in0 = in0
+        self.in1 = in1
+        self._wire_index = None
+
+    @property
+    def num_gates(self):
+        """Return the number of gates."""
+        return len(self.types)
+
+    @property
+    def num_wires(self):
+        """Return the number of wires."""
+        return self.num_inputs + len(self.types)
+
+    def wire_index(self):
+        """Return dict mapping each original wire ID to its dense index."""
+        if self._wire_index is None:
+            self._wire_index = {w: i for i, w in enumerate(self.wire_ids)}
+        return self._wire_index
+
+    def input_index(self):
+        """Return dict mapping each original input wire ID to its index."""
+        return {w: i for i, w in enumerate(self.wire_ids[:self.num_inputs])}
+
+    def last_uses(self):
+        """Return array mapping each wire to the last gate reading it.
+
+        Output wires map to num_gates, so that they are never released.
+        Gate outputs read by no gate map to their own gate, and unread
+        inputs to -1.
+        """
+        num_gates = self.num_gates
+        last_uses = array("i", [-1]) * self.num_inputs + array(
+            "i", range(num_gates))
+        for i, (in_a, in_b) in enumerate(zip(self.in0, self.in1)):
+            last_uses[in_a] = i
+            if in_b != NO_WIRE:
+                last_uses[in_b] = i
+        for wire in self.out:
+            last_uses[wire] = num_gates
+        return last_uses
+
+    def levels(self):
+        """Return array mapping each gate to its depth in the circuit.
+
+        Gates reading only input wires are at level 0; any other gate is one
+        level above the highest of its inputs, so that gates of the same
+        level never depend on each other.
+        """
+        num_inputs = self.num_inputs
+        levels = array("i", [0]) * self.num_gates
+        for i, (in_a, in_b) in enumerate(zip(self.in0, self.in1)):
+            level = 0
+            for wire in (in_a, in_b):
+                if wire >= num_inputs:
+                    level = max(level, levels[wire - num_inputs] + 1)
+            levels[i] = level
+        return levels
+
+    def __getstate__(self):
+        # Arrays read in place from a buffer (see codec and cache) are
+        # copied, since memoryviews cannot be pickled
+        state = dict(self.__dict__)
+        for name, typecode in (("wire_ids", "q"), ("types", "B"),
+                               ("in0", "i"), ("in1", "i")):
+            if isinstance(state[name], memoryview):
+                state[name] = as_array(typecode, state[name])
+        return state
+
+    def gate(self, i):
+        """Return the spec of gate i as a dict, with dense wire indices."""
+        gate_in = [self.in0[i]]
+        if self.types[i] != NOT:
+            gate_in.append(self.in1[i])
+        return {
+            "id": self.num_inputs + i,
+            "type": GATE_TYPES[self.types[i]],
+            "in": gate_in
+        }
+
+
+def as_array(typecode, values):
+    """Return 'values' as an array, without copy if it already is one.
+
+    Values read in place from a buffer, as a memoryview of the same type,
+    are copied as a whole.
+    """
+    if isinstance(values, array) and values.typecode == typecode:
+        return values
+    if isinstance(values, memoryview) and values.format == typecode:
+        result = array(typecode)
+        result.frombytes(values.cast("B"))
+        return result
+    return array(typecode, values)
+
+
+def compile_circuit(circuit):
+    """Compile a circuit spec into a CompiledCircuit.
+
+    Gates are evaluated by increasing ID, so every gate must only read input
+    wires or the outputs of gates with a lower ID.
+
+    Args:
+        circuit: A dict containing circuit spec, or an already compiled one.
+
+    Returns:
+        The CompiledCircuit.
+
+    Raises:
+        ValueError: The circuit is malformed or its gate IDs are not in
+            topological order.
+    """
+    if isinstance(circuit, CompiledCircuit):
+        return circuit
+
+    alice, bob = circuit.get("alice", []), circuit.get("bob", [])
+    wire_ids = []  # original ID of each dense wire
+    index = {}  # map from original wire IDs to dense indices
+
+    for wire in chain(alice, bob):
+        if wire in index:
+            raise ValueError(f"Input wire {wire} is listed twice")
+        index[wire] = len(wire_ids)
+        wire_ids.append(wire)
+    num_inputs = len(wire_ids)
+
+    types, in0, in1 = array("B"), array("i"), array("i")
+    for gate in sorted(circuit["gates"], key=lambda g: g["id"]):
+        gate_id, gate_in = gate["id"], gate["in"]
+        code = GATE_CODES.get(gate["type"])
+        if code is None:
+            raise ValueError(f"Gate {gate_id} has unknown type "
+                             f"'{gate['type']}'")
+        if len(gate_in) != (1 if code == NOT else 2):
+            raise ValueError(f"Gate {gate_id} has {len(gate_in)} inputs")
+        for wire in gate_in:
+            if wire not in index:
+                raise ValueError(f"Gate {gate_id} reads wire {wire}, which "
+                                 f"is neither an input nor the output of a "
+                                 f"gate with a lower ID")
+        if gate_id in index:
+            raise ValueError(f"Wire {gate_id} is driven more than once")
+
+        types.append(code)
+        in0.append(index[gate_in[0]])
+        in1.append(index[gate_in[1]] if code != NOT else NO_WIRE)
+        index[gate_id] = len(wire_ids)
+        wire_ids.append(gate_id)
+
+    out = []
+    for wire in circuit["out"]:
+        if wire not in index:
+            raise ValueError(f"Output wire {wire} is not in the circuit")
+        out.append(index[wire])
+
+    compiled = CompiledCircuit(circuit["id"], wire_ids, num_inputs,
+                               list(range(len(alice))),
+                               list(range(len(alice), num_inputs)), out,
+                               types, in0, in1)
+    compiled._wire_index = index
+    return compiled
+
+
+def header(circuit):
+    """Return the id, input and output wires of a circuit, as in its spec.
+
+    Args:
+        circuit: A dict containing circuit spec, or a CompiledCircuit.
+
+    Returns:
+        A dict with the "id", "alice", "bob" and "out" of the circuit spec,
+        with original wire IDs; the spec itself if the circuit is not
+        compiled.
+    """
+    if not isinstance(circuit, CompiledCircuit):
+        return circuit
+    wire_ids = circuit.wire_ids
+    return {
+        "id": circuit.id,
+        "alice": [wire_ids[w] for w in circuit.alice],
+        "bob": [wire_ids[w] for w in circuit.bob],
+        "out": [wire_ids[w] for w in circuit.out],
+    }
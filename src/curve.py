@@ -0,0 +1,127 @@
+import secrets
+from cryptography.hazmat.primitives.asymmetric.x25519 import (X25519PrivateKey,
+                                                              X25519PublicKey)
+
+# EDWARDS25519 (RFC 8032)
+PRIME = 2**255 - 19  # prime of the base field
+ORDER = 2**252 + 27742317777372353535851937790883648493  # order of the base
+D = -121665 * pow(121666, PRIME - 2, PRIME) % PRIME  # curve constant
+BASE = (  # base point, in affine coordinates (x, y)
+    15112221349535400772501151409588531511454012693041857206046113283949847762202,
+    46316835694926478169428394003475163141307993866256225615783033603165251855960,
+)
+FIXED_BASE_WINDOW = 8  # bits of scalar per row of the fixed-base table
+
+_fixed_base_table = None  # fixed-base table of the base point, built once
+
+
+def to_extended(point):
+    """Return extended coordinates (X, Y, Z, T) of an affine point."""
+    x, y = point
+    return x, y, 1, x * y % PRIME
+
+
+def to_affine(point):
+    """Return affine coordinates (x, y) of a point in extended ones."""
+    x, y, z, _ = point
+    z_inv = pow(z, PRIME - 2, PRIME)
+    return x * z_inv % PRIME, y * z_inv % PRIME
+
+
+def add(p1, p2):
+    """Add two points in extended coordinates."""
+    x1, y1, z1, t1 = p1
+    x2, y2, z2, t2 = p2
+    a = (y1 - x1) * (y2 - x2) % PRIME
+    b = (y1 + x1) * (y2 + x2) % PRIME
+    c = 2 * D * t1 * t2 % PRIME
+    d = 2 * z1 * z2 % PRIME
+    e, f, g, h = b - a, d - c, d + c, b + a
+    return e * f % PRIME, g * h % PRIME, f * g % PRIME, e * h % PRIME
+
+
+def fixed_base_table():
+    """Return the fixed-base table of the base point.
+
+    Row i holds d * 2^(i * FIXED_BASE_WINDOW) * BASE for every digit d, in
+    extended coordinates.
+    """
+    global _fixed_base_table
+    if _fixed_base_table is None:
+        table = []
+        base = to_extended(BASE)
+        for _ in range((ORDER.bit_length() + FIXED_BASE_WINDOW - 1) //
+                       FIXED_BASE_WINDOW):
+            row = [(0, 1, 1, 0), base]  # identity, then the base of the row
+            for _ in range((1 << FIXED_BASE_WINDOW) - 2):
+                row.append(add(row[-1], base))
+            table.append(row)
+            base = add(row[-1], base)
+        _fixed_base_table = table
+    return _fixed_base_table
+
+
+class Ed25519Group:
+    """Prime-order group of the points of edwards25519.
+
+    Implements the group interface used by the oblivious transfer, like
+    util.PrimeGroup, with a multiplicative notation: mul adds two points,
+    gen_pow multiplies the base point by a scalar. Elements are affine
+    points (x, y).
+
+    Exponentiations of other elements (pow) are only ever hashed, so they
+    are computed with X25519 and return the Montgomery u-coordinate of the
+    result as an integer. X25519 clamps its scalars, so rand_int only draws
+    scalars that clamping leaves unchanged.
+    """
+    _instance = None
+
+    @classmethod
+    def load(cls, name=None):
+        """Return the group shared by the whole process.
+
+        Raises:
+            ValueError: A group name is given: there is only edwards25519.
+        """
+        if name is not None:
+            raise ValueError(f"Unknown elliptic curve group '{name}'")
+        if cls._instance is None:
+            cls._instance = cls()
+            fixed_base_table()
+        return cls._instance
+
+    def mul(self, point1, point2):
+        """Add two points."""
+        return to_affine(add(to_extended(point1), to_extended(point2)))
+
+    def pow(self, point, scalar):
+        """Multiply a point by a scalar from rand_int, for hashing only."""
+        x, y = point
+        u = (1 + y) * pow(1 - y, PRIME - 2, PRIME) % PRIME
+        private_key = X25519PrivateKey.from_private_bytes(
+            scalar.to_bytes(32, "little"))
+        public_key = X25519PublicKey.from_public_bytes(u.to_bytes(32, "little"))
+        return int.from_bytes(private_key.exchange(public_key), "little")
+
+    def gen_pow(self, scalar):
+        """Multiply the base point by a scalar."""
+        scalar %= ORDER
+        mask = (1 << FIXED_BASE_WINDOW) - 1
+        result = (0, 1, 1, 0)
+        for row in fixed_base_table():
+            if not scalar:
+                break
+            digit = scalar & mask
+            if digit:
+                result = add(result, row[digit])
+            scalar >>= FIXED_BASE_WINDOW
+        return to_affine(result)
+
+    def inv(self, point):
+        """Negate a point."""
+        x, y = point
+        return -x % PRIME, y
+
+    def rand_int(self):
+        """Return a random scalar, as clamped by X25519."""
+        return (1 << 254) | secrets.randbits(251) << 3
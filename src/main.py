@@ -1,12 +1,35 @@
 #!/usr/bin/env python3
+import asyncio
 import logging
 import argparse
+import arithmetic
+import bristol
+import cache
+import json
+import metrics
+import os
+import ot
+import server
 import util
+import yao
 from parties import Alice, Bob
 
 logging.basicConfig(format="[%(levelname)s] %(message)s",
                     level=logging.WARNING)
 
+def dump_stats(path):
+    """Dump the metrics of the run as JSON.
+
+    Args:
+        path: The path of the file to write them to, "-" for the standard
+            output, or None not to dump them.
+    """
+    if path == "-":
+        print(json.dumps(metrics.report(), indent=1))
+    elif path:
+        with open(path, "w") as f:
+            json.dump(metrics.report(), f, indent=1)
+
 def main(
     party,
     circuit_path="./circuit.json",
@@ -14,29 +37,93 @@ def main(
     bob_input_path="./bob_input.txt",
     output_path='./output.txt',
     number_of_bits='8',
+    function="add",
     oblivious_transfer=True,
+    scheme="classic",
+    chunk_size=None,
+    ot_mode="simple",
+    ot_group=None,
+    ot_backend="prime",
+    pool_size=0,
+    sessions=1,
+    workers=1,
+    vectorized=False,
+    optimize=False,
+    batch=False,
+    lean=False,
+    max_sessions=4,
+    queue_depth=server.QUEUE_DEPTH,
+    session_timeout=server.SESSION_TIMEOUT,
+    max_gates=None,
+    stats=None,
     loglevel=logging.WARNING,
 ):
     logging.getLogger().setLevel(loglevel)
     
     if party == "alice":
-        util.generate_and_save_circuit(path=circuit_path, number_of_bits=int(number_of_bits))
-        alice = Alice(circuit_path,
+        # Bristol Fashion circuits are run as they are, with no known result
+        standard = os.path.exists(circuit_path) and bristol.is_bristol(circuit_path)
+        # Warm runs take the compiled circuits of the file from the cache
+        params = {"function": function, "number_of_bits": number_of_bits, "optimize": optimize}
+        circuits = cache.lookup(circuit_path, **params)
+        if circuits is None:
+            # Only write the circuit of the function if it is not there yet
+            if not standard and not util.has_circuit(circuit_path, f"{number_of_bits}-bit {function}"):
+                circuit = arithmetic.generate_and_save_circuit(circuit_path, function, int(number_of_bits))
+                logging.info(f"Generated {circuit['id']}: {arithmetic.cost(circuit)}")
+            circuits = cache.compile_circuits(circuit_path, **params)
+        alice = Alice(circuits,
                       input_data_path=alice_input_path,
                       output_path=output_path,
                       number_of_bits=int(number_of_bits),
-                      oblivious_transfer=oblivious_transfer)
-        alice.start()
-        result = util.verify(alice_data=alice_input_path, bob_data=bob_input_path, output_data=output_path)
+                      oblivious_transfer=oblivious_transfer,
+                      scheme=scheme,
+                      chunk_size=chunk_size,
+                      ot_mode=ot_mode,
+                      ot_group=ot_group,
+                      ot_backend=ot_backend,
+                      pool_size=pool_size,
+                      sessions=sessions,
+                      workers=workers,
+                      batch=batch,
+                      lean=lean)
+        asyncio.run(alice.start())
+        if standard:
+            print("Protocol executed; the result of a Bristol Fashion circuit is not verified")
+            dump_stats(stats)
+            return
+        result = util.verify(alice_data=alice_input_path, bob_data=bob_input_path, output_data=output_path, operation=arithmetic.FUNCTIONS[function].reference, batch=batch)
         if result :
             print("Protocol successfully executed!")
         else :
             print("Unsuccessful Execution. Check input and output files to better understand what happened")
+        dump_stats(stats)
     elif party == "bob":
         bob = Bob(input_data_path=bob_input_path,
                   number_of_bits=int(number_of_bits),
-                  oblivious_transfer=oblivious_transfer)
-        bob.listen()
+                  oblivious_transfer=oblivious_transfer,
+                  ot_mode=ot_mode,
+                  ot_group=ot_group,
+                  ot_backend=ot_backend,
+                  vectorized=vectorized,
+                  max_gates=max_gates)
+        asyncio.run(bob.listen())
+        dump_stats(stats)
+    elif party == "server":
+        evaluator_server = server.EvaluatorServer(
+            input_data_path=bob_input_path,
+            number_of_bits=int(number_of_bits),
+            workers=max_sessions,
+            queue_depth=queue_depth,
+            session_timeout=session_timeout,
+            max_gates=max_gates,
+            oblivious_transfer=oblivious_transfer,
+            ot_mode=ot_mode,
+            ot_group=ot_group,
+            ot_backend=ot_backend,
+            vectorized=vectorized)
+        asyncio.run(evaluator_server.serve())
+        dump_stats(stats)
     else:
         logging.error(f"Unknown party '{party}'")
 
@@ -50,14 +137,80 @@ if __name__ == '__main__':
     }
     parser = argparse.ArgumentParser(description="Run Yao protocol.")
     parser.add_argument("party",
-                        choices=["alice", "bob",],
-                        help="the yao party to run")
+                        choices=["alice", "bob", "server"],
+                        help="the yao party to run (server: a bob serving many alices at once)")
     parser.add_argument("--circuit",
                         default="./circuit.json",
                         help="the JSON circuit file for alice and local tests")
     parser.add_argument("--no-oblivious-transfer",
                         action="store_true",
                         help="disable oblivious transfer")
+    parser.add_argument("--scheme",
+                        choices=yao.SCHEMES,
+                        default="classic",
+                        help="the garbling scheme used by alice (default 'classic')")
+    parser.add_argument("--chunk-size",
+                        type=int,
+                        default=None,
+                        help="stream the garbled tables by chunks of this number of gates (alice only)")
+    parser.add_argument("--ot-mode",
+                        choices=ot.OT_MODES,
+                        default="simple",
+                        help="the oblivious transfer mode, same for both parties (default 'simple')")
+    parser.add_argument("--ot-group",
+                        choices=util.STANDARD_GROUPS.keys(),
+                        default=None,
+                        help="a standard group for oblivious transfer (default: a random group cached on disk)")
+    parser.add_argument("--ot-backend",
+                        choices=ot.GROUP_BACKENDS.keys(),
+                        default="prime",
+                        help="the kind of group for oblivious transfer: prime field or elliptic curve (default 'prime')")
+    parser.add_argument("--pool-size",
+                        type=int,
+                        default=0,
+                        help="the number of circuits garbled ahead by background workers (alice only, default 0)")
+    parser.add_argument("--sessions",
+                        type=int,
+                        default=1,
+                        help="the number of times each circuit is evaluated (alice only, default 1)")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=1,
+                        help="the number of processes garbling each circuit (alice only, default 1)")
+    parser.add_argument("--vectorized",
+                        action="store_true",
+                        help="evaluate circuits a level of gates at a time with NumPy (bob only)")
+    parser.add_argument("--optimize",
+                        action="store_true",
+                        help="rewrite circuits with fewer gates before garbling them (alice only)")
+    parser.add_argument("--batch",
+                        action="store_true",
+                        help="compute the function on each pair of values of Alice and Bob, in one session, instead of on their sums (alice only)")
+    parser.add_argument("--lean",
+                        action="store_true",
+                        help="garble circuits with as little memory as possible, with the half-gates or fixed-key scheme (alice only)")
+    parser.add_argument("--max-sessions",
+                        type=int,
+                        default=4,
+                        help="the number of sessions run concurrently (server only, default 4)")
+    parser.add_argument("--queue-depth",
+                        type=int,
+                        default=server.QUEUE_DEPTH,
+                        help=f"the number of sessions waiting to run before new ones are refused (server only, default {server.QUEUE_DEPTH})")
+    parser.add_argument("--session-timeout",
+                        type=float,
+                        default=server.SESSION_TIMEOUT,
+                        help=f"the number of seconds after which an idle session ends (server only, default {server.SESSION_TIMEOUT})")
+    parser.add_argument("--max-gates",
+                        type=int,
+                        default=None,
+                        help="the maximum number of gates of the circuits evaluated (bob and server only)")
+    parser.add_argument("--stats",
+                        metavar="file",
+                        nargs="?",
+                        const="-",
+                        default=None,
+                        help="dump counters and timers of each phase as JSON, to the given file or else to the standard output (bob and server: when stopped)")
     parser.add_argument("--alice",
                         default="./alice_input.txt",
                         help="the input path to Alice's set of numbers")
@@ -70,6 +223,10 @@ if __name__ == '__main__':
     parser.add_argument("--bits",
                         default="8",
                         help="the size of the circuit and the representation of its inputs")
+    parser.add_argument("--function",
+                        choices=arithmetic.FUNCTIONS.keys(),
+                        default="add",
+                        help="the function of Alice's and Bob's values to compute (alice only, default 'add')")
     parser.add_argument("--loglevel",
                         metavar="level",
                         choices=loglevels.keys(),
@@ -83,5 +240,23 @@ if __name__ == '__main__':
         output_path=parser.parse_args().output,
         oblivious_transfer=not parser.parse_args().no_oblivious_transfer,
         number_of_bits=parser.parse_args().bits,
+        function=parser.parse_args().function,
+        scheme=parser.parse_args().scheme,
+        chunk_size=parser.parse_args().chunk_size,
+        ot_mode=parser.parse_args().ot_mode,
+        ot_group=parser.parse_args().ot_group,
+        ot_backend=parser.parse_args().ot_backend,
+        pool_size=parser.parse_args().pool_size,
+        sessions=parser.parse_args().sessions,
+        workers=parser.parse_args().workers,
+        vectorized=parser.parse_args().vectorized,
+        optimize=parser.parse_args().optimize,
+        batch=parser.parse_args().batch,
+        lean=parser.parse_args().lean,
+        max_sessions=parser.parse_args().max_sessions,
+        queue_depth=parser.parse_args().queue_depth,
+        session_timeout=parser.parse_args().session_timeout,
+        max_gates=parser.parse_args().max_gates,
+        stats=parser.parse_args().stats,
         loglevel=loglevels[parser.parse_args().loglevel],
     )
\ No newline at end of file
@@ -0,0 +1,113 @@
+import contextlib
+import contextvars
+import threading
+import time
+from collections import defaultdict
+
+# Phase of the protocol the messages sent belong to (see phase)
+_phase = contextvars.ContextVar("phase", default="other")
+
+
+class Metrics:
+    """Counters and timers of the protocol, by dotted name.
+
+    Timers are counters of seconds, whose name ends in "_s". Values are
+    updated once per message, transfer or batch of gates, never per gate,
+    and may be updated from several threads.
+    """
+    def __init__(self):
+        self.values = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def count(self, name, value=1):
+        """Add 'value' to the counter 'name'."""
+        with self.lock:
+            self.values[name] += value
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """Add the time spent in the block to the timer 'name'."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.count(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        """Return a copy of the values, as a flat dict."""
+        with self.lock:
+            return dict(self.values)
+
+    def merge(self, values):
+        """Add values of another process, as returned by snapshot."""
+        with self.lock:
+            for name, value in values.items():
+                self.values[name] += value
+
+    def report(self):
+        """Return the values as nested dicts, one level per name part.
+
+        For instance, "socket.ot.sent.bytes" is report["socket"]["ot"]
+        ["sent"]["bytes"].
+        """
+        with self.lock:
+            values = sorted(self.values.items())
+        report = {}
+        for name, value in values:
+            *path, leaf = name.split(".")
+            node = report
+            for part in path:
+                node = node.setdefault(part, {})
+            node[leaf] = value
+        return report
+
+    def reset(self):
+        """Set all the values back to zero."""
+        with self.lock:
+            self.values.clear()
+
+
+registry = Metrics()  # metrics of this process
+count = registry.count
+timer = registry.timer
+report = registry.report
+reset = registry.reset
+snapshot = registry.snapshot
+merge = registry.merge
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Attribute the messages sent within the block to a protocol phase.
+
+    The phase is set for the current thread or asyncio task only.
+    """
+    token = _phase.set(name)
+    try:
+        yield
+    finally:
+        _phase.reset(token)
+
+
+def current_phase():
+    """Return the protocol phase of the messages sent now."""
+    return _phase.get()
+
+
+def count_message(direction, kind, frames):
+    """Count a message and its bytes under its kind (its sender's phase).
+
+    Args:
+        direction: "sent" or "received".
+        kind: The phase of the protocol the message belongs to.
+        frames: The bytes-like frames of the message.
+    """
+    count(f"socket.{kind}.{direction}.messages")
+    count(f"socket.{kind}.{direction}.bytes",
+          sum(memoryview(frame).nbytes for frame in frames))
+
+
+def count_round_trip(kind, seconds):
+    """Count a reply of kind 'kind', waited for 'seconds' after a send."""
+    count(f"socket.{kind}.round_trips")
+    count(f"socket.{kind}.wait_s", seconds)
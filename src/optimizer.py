@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+import argparse
+import compiler
+import json
+import logging
+import secrets
+import util
+import yao
+from collections import Counter
+
+CHECK_TRIALS = 1024  # random inputs on which optimized circuits are checked
+MAX_PASSES = 4  # passes of rewriting, as long as the circuit shrinks
+
+# Literals are pairs (node, negated); node 0 is the constant false
+FALSE = (0, False)
+
+# Logical function of each gate type on bit-sliced values (see simulate)
+SLICED_OPERATORS = {
+    "AND": lambda x, y, mask: x & y,
+    "OR": lambda x, y, mask: x | y,
+    "XOR": lambda x, y, mask: x ^ y,
+    "NAND": lambda x, y, mask: ~(x & y) & mask,
+    "NOR": lambda x, y, mask: ~(x | y) & mask,
+    "XNOR": lambda x, y, mask: ~(x ^ y) & mask,
+    "NOT": lambda x, y, mask: ~x & mask,
+}
+
+
+def negate(literal):
+    """Return the negation of a literal."""
+    return (literal[0], not literal[1])
+
+
+class Graph:
+    """A circuit as a graph of AND and XOR nodes with negated edges.
+
+    Every gate type is expressed with AND, XOR and negations, which are
+    carried by the literals instead of NOT gates. Nodes are hash-consed, so
+    that duplicate subexpressions are a single node, and simplified as they
+    are created: constants are propagated, and the (x & y) | (z & (x ^ y))
+    carry of full adders becomes ((x ^ z) & (y ^ z)) ^ z, with one AND.
+    Nodes are created after their inputs: their indices are in topological
+    order.
+    """
+    def __init__(self):
+        self.nodes = [None]  # ("in", wire) or (op, literal_a, literal_b)
+        self.index = {}  # map from node specs to their index
+
+    def node(self, spec):
+        """Return the index of the node 'spec', created if needed."""
+        index = self.index.get(spec)
+        if index is None:
+            index = self.index[spec] = len(self.nodes)
+            self.nodes.append(spec)
+        return index
+
+    def input(self, wire):
+        """Return the literal of an input wire."""
+        return (self.node(("in", wire)), False)
+
+    def xor(self, a, b):
+        """Return the literal of a ^ b."""
+        negated = a[1] ^ b[1]  # negations are moved to the output
+        a, b = sorted((a[0], b[0]))
+        if a == b:
+            return (0, negated)
+        if a == 0:
+            return (b, negated)
+        return (self.node(("XOR", (a, False), (b, False))), negated)
+
+    def and_(self, a, b):
+        """Return the literal of a & b."""
+        a, b = sorted((a, b))
+        if a[0] == 0:
+            return b if a[1] else FALSE
+        if a[0] == b[0]:
+            return a if a[1] == b[1] else FALSE
+        return (self.node(("AND", a, b)), False)
+
+    def or_(self, a, b):
+        """Return the literal of a | b."""
+        majority = self.majority(a, b)
+        if majority is not None:
+            return majority
+        return negate(self.and_(negate(a), negate(b)))
+
+    def majority(self, a, b):
+        """Return the literal of a | b if it is a majority, else None.
+
+        a | b is the majority of x, y and z if one of them is x & y and the
+        other z & (x ^ y).
+        """
+        for g, t in ((a, b), (b, a)):
+            g_spec, t_spec = self.nodes[g[0]], self.nodes[t[0]]
+            # The constant node has no spec
+            if g[1] or t[1] or g_spec is None or t_spec is None or \
+                    g_spec[0] != "AND" or t_spec[0] != "AND":
+                continue
+            x, y = g_spec[1:]
+            for p, z in ((t_spec[1], t_spec[2]), (t_spec[2], t_spec[1])):
+                # p must be x ^ y, with the negations of x and y moved out
+                if self.xor(x, y) == p:
+                    return self.xor(
+                        self.and_(self.xor(x, z), self.xor(y, z)), z)
+        return None
+
+    def gate(self, gate_type, a, b=None):
+        """Return the literal of the output of a gate."""
+        if gate_type == "NOT":
+            return negate(a)
+        if gate_type in ("XOR", "XNOR"):
+            result = self.xor(a, b)
+        elif gate_type in ("OR", "NOR"):
+            result = self.or_(a, b)
+        else:
+            result = self.and_(a, b)
+        return negate(result) if gate_type in ("XNOR", "NOR", "NAND") else \
+            result
+
+
+def optimize(circuit):
+    """Return an equivalent circuit with fewer gates.
+
+    The circuit is rewritten until it stops shrinking (at most MAX_PASSES
+    times): constants are propagated, duplicate gates merged, NOT gates
+    absorbed into the gates around them (e.g. NOT of AND into NAND, XOR of
+    NOT into XNOR), carries of full adders rewritten with a single AND
+    gate, and gates that no output depends on are dropped. Input wires keep
+    their ID; gate IDs are renumbered, and the output list follows them.
+
+    Args:
+        circuit: A dict containing circuit spec.
+
+    Returns:
+        A dict containing the spec of the optimized circuit.
+
+    Raises:
+        ValueError: The circuit is malformed.
+    """
+    best = circuit
+    for _ in range(MAX_PASSES):
+        optimized = _rewrite(best)
+        if _cost(optimized) >= _cost(best):
+            break
+        best = optimized
+    return best
+
+
+def _cost(circuit):
+    """Return the number of non-free gates, then of gates, of a circuit."""
+    counts = gate_counts(circuit)
+    return counts["non_free"], counts["total"]
+
+
+def _rewrite(circuit):
+    """Run one pass of rewriting of a circuit (see optimize)."""
+    compiled = compiler.compile_circuit(circuit)
+    graph = Graph()
+    inputs = compiled.wire_ids[:compiled.num_inputs]
+    literals = [graph.input(wire) for wire in inputs]
+    for code, in_a, in_b in zip(compiled.types, compiled.in0, compiled.in1):
+        literals.append(
+            graph.gate(compiler.GATE_TYPES[code], literals[in_a],
+                       literals[in_b] if in_b != compiler.NO_WIRE else None))
+    outputs = [literals[wire] for wire in compiled.out]
+
+    # Nodes some output depends on, found backwards in topological order
+    nodes = graph.nodes
+    live = [False] * len(nodes)
+    for node, _ in outputs:
+        live[node] = True
+    for node in range(len(nodes) - 1, 0, -1):
+        if live[node] and nodes[node][0] != "in":
+            live[nodes[node][1][0]] = live[nodes[node][2][0]] = True
+
+    # Emit a node as its negation if it is mostly wanted negated by the
+    # AND nodes and outputs reading it (XOR gates absorb either polarity)
+    demand = Counter()
+    for node, spec in enumerate(nodes):
+        if live[node] and spec is not None and spec[0] == "AND":
+            for child, negated in spec[1:]:
+                demand[child] += -1 if negated else 1
+    for node, negated in outputs:
+        demand[node] += -1 if negated else 1
+    flipped = [
+        demand[node] < 0 and spec is not None and spec[0] != "in"
+        for node, spec in enumerate(nodes)
+    ]
+
+    emitter = _Emitter(inputs)
+    wires = [None] * len(nodes)  # wire of each node, or of its negation
+    for node, spec in enumerate(nodes):
+        if not live[node] or spec is None:
+            continue
+        if spec[0] == "in":
+            wires[node] = spec[1]
+            continue
+        (a, neg_a), (b, neg_b) = spec[1:]
+        neg_a ^= flipped[a]
+        neg_b ^= flipped[b]
+        if spec[0] == "XOR":
+            gate_type = "XNOR" if neg_a ^ neg_b ^ flipped[node] else "XOR"
+            wires[node] = emitter.gate(gate_type, wires[a], wires[b])
+            continue
+        wire_a, wire_b = wires[a], wires[b]
+        if neg_a and neg_b:  # AND(NOT a, NOT b) is NOR(a, b)
+            gate_type = "OR" if flipped[node] else "NOR"
+        else:
+            if neg_a:
+                wire_a = emitter.gate("NOT", wire_a)
+            if neg_b:
+                wire_b = emitter.gate("NOT", wire_b)
+            gate_type = "NAND" if flipped[node] else "AND"
+        wires[node] = emitter.gate(gate_type, wire_a, wire_b)
+
+    out = []
+    for node, negated in outputs:
+        if node == 0:
+            out.append(emitter.constant(negated))
+        elif negated ^ flipped[node]:
+            out.append(emitter.gate("NOT", wires[node]))
+        else:
+            out.append(wires[node])
+    return {**circuit, "out": out, "gates": emitter.gates}
+
+
+class _Emitter:
+    """The gates of a rewritten circuit, with fresh IDs in emission order.
+
+    Args:
+        inputs: The input wires, whose IDs are kept.
+    """
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.next_id = max(inputs, default=0) + 1
+        self.gates = []
+        self.emitted = {}  # map from (type, inputs) to the gate output
+
+    def gate(self, gate_type, *wires):
+        """Return the output wire of a gate, emitted if it is new."""
+        key = (gate_type, wires)
+        if key not in self.emitted:
+            self.emitted[key] = self.next_id
+            self.gates.append({
+                "id": self.next_id,
+                "type": gate_type,
+                "in": list(wires)
+            })
+            self.next_id += 1
+        return self.emitted[key]
+
+    def constant(self, value):
+        """Return a wire of constant value: w ^ w, or its negation.
+
+        Raises:
+            ValueError: The circuit has no input wire to build it from.
+        """
+        if not self.inputs:
+            raise ValueError("Cannot output a constant without inputs")
+        wire = self.inputs[0]
+        return self.gate("XNOR" if value else "XOR", wire, wire)
+
+
+def gate_counts(circuit):
+    """Return the number of gates of a circuit, by type.
+
+    Args:
+        circuit: A dict containing circuit spec.
+
+    Returns:
+        A dict mapping each gate type to its number of gates, plus the
+        "total" and the number of gates that are not free with Free-XOR
+        ("non_free").
+    """
+    counts = Counter(gate["type"] for gate in circuit["gates"])
+    return {
+        **{gate_type: counts[gate_type] for gate_type in compiler.GATE_TYPES},
+        "total": len(circuit["gates"]),
+        "non_free": sum(count for gate_type, count in counts.items()
+                        if gate_type not in yao.FREE_GATES),
+    }
+
+
+def simulate(circuit, inputs, mask):
+    """Evaluate a circuit in the clear, on many inputs at once.
+
+    Values are bit-sliced: bit k of the value of a wire is its value for
+    the k-th inputs.
+
+    Args:
+        circuit: A dict containing circuit spec, or its CompiledCircuit.
+        inputs: A dict mapping each input wire to its value.
+        mask: The int whose bits are those of the values.
+
+    Returns:
+        The list of the values of the output wires.
+    """
+    circuit = compiler.compile_circuit(circuit)
+    values = [inputs[w] for w in circuit.wire_ids[:circuit.num_inputs]]
+    for code, in_a, in_b in zip(circuit.types, circuit.in0, circuit.in1):
+        values.append(SLICED_OPERATORS[compiler.GATE_TYPES[code]](
+            values[in_a], values[in_b] if in_b != compiler.NO_WIRE else 0,
+            mask))
+    return [values[wire] for wire in circuit.out]
+
+
+def equivalent(circuit, other, trials=CHECK_TRIALS):
+    """Return whether two circuits agree on random inputs.
+
+    Args:
+        circuit: A dict containing circuit spec.
+        other: A dict containing the spec of a circuit with the same input
+            wires.
+        trials: Optional; the number of random inputs tried.
+    """
+    wires = circuit.get("alice", []) + circuit.get("bob", [])
+    inputs = {wire: secrets.randbits(trials) for wire in wires}
+    mask = (1 << trials) - 1
+    return simulate(circuit, inputs, mask) == simulate(other, inputs, mask)
+
+
+def optimize_checked(circuit, trials=CHECK_TRIALS):
+    """Optimize a circuit and check the result on random inputs.
+
+    Args:
+        circuit: A dict containing circuit spec.
+        trials: Optional; the number of random inputs tried.
+
+    Returns:
+        A dict containing the spec of the optimized circuit.
+
+    Raises:
+        RuntimeError: The optimized circuit is not equivalent.
+    """
+    optimized = optimize(circuit)
+    if not equivalent(circuit, optimized, trials):
+        raise RuntimeError(f"The optimized {circuit['id']} differs from "
+                           f"the original")
+    before, after = gate_counts(circuit), gate_counts(optimized)
+    logging.info(f"Optimized {circuit['id']}: {before['total']} -> "
+                 f"{after['total']} gates, {before['non_free']} -> "
+                 f"{after['non_free']} non-free")
+    return optimized
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Optimize circuits.")
+    parser.add_argument("circuits",
+                        help="the JSON file of the circuits to optimize")
+    parser.add_argument("--output",
+                        help="the JSON file to write the optimized circuits to")
+    parser.add_argument("--trials",
+                        type=int,
+                        default=CHECK_TRIALS,
+                        help=f"the number of random inputs the optimized "
+                        f"circuits are checked on (default {CHECK_TRIALS})")
+    args = parser.parse_args()
+
+    circuits = util.parse_json(args.circuits)
+    optimized = []
+    for circuit in circuits["circuits"]:
+        optimized.append(optimize_checked(circuit, args.trials))
+        before, after = gate_counts(circuit), gate_counts(optimized[-1])
+        print(f"======== {circuit['id']} ========")
+        print(" ".join(f"{name:>8}" for name in ["", *before]))
+        for label, counts in (("before", before), ("after", after)):
+            print(" ".join(f"{value:>8}" for value in [label, *counts.values()]))
+        print(f"Equivalent on {args.trials} random inputs")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({**circuits, "circuits": optimized}, f, indent=1)
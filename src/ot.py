@@ -1,16 +1,235 @@
+import asyncio
+import curve
 import hashlib
 import logging
+import metrics
+import os
 import pickle
+import secrets
+import time
 import util
 import yao
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+# ways of transferring Bob's keys
+OT_MODES = ("simple", "batch", "iknp", "pool")
+SECURITY_PARAM = 128  # number of base OTs of the OT extension
+SEED_BYTES = 16  # size of the PRG seeds exchanged by the base OTs
+# Groups of the public-key OTs; each has a load(name) class method and the
+# group operations mul, inv, pow, gen_pow and rand_int
+GROUP_BACKENDS = {
+    "prime": util.PrimeGroup,
+    "ec": curve.Ed25519Group,
+}
+POOL_CAPACITY = 1024  # number of random OTs a pool is refilled up to
+POOL_LOW_WATER = 256  # number of random OTs under which a pool is refilled
+POOL_DIR = os.path.join(os.path.expanduser("~"), ".cache", "yao")
+POOL_VERSION = 2  # version of the format of the saved pools
+
+
+def prg(seed, num_bits):
+    """Expand a seed into a 'num_bits'-bit integer with AES-128 in CTR mode."""
+    encryptor = Cipher(algorithms.AES(seed), modes.CTR(bytes(16))).encryptor()
+    stream = encryptor.update(bytes((num_bits + 7) // 8))
+    return int.from_bytes(stream, "big") & ((1 << num_bits) - 1)
+
+
+def transpose(columns, num_rows):
+    """Transpose a bit matrix given as a list of integer columns.
+
+    Args:
+        columns: A list of integers; bit j of column i is the entry (j, i).
+        num_rows: The number of rows of the matrix.
+
+    Returns:
+        The list of rows as integers; bit i of row j is the entry (j, i).
+    """
+    if not num_rows:
+        return []
+    # Bit strings with bit j of each column at position j
+    bit_strings = [format(column, f"0{num_rows}b")[::-1] for column in columns]
+    return [int("".join(bits)[::-1], 2) for bits in zip(*bit_strings)]
+
+
+class RandomOTPool:
+    """A bounded, persistent pool of random OT correlations.
+
+    Each correlation has an ID shared by both parties. Alice (the sender)
+    holds a pair of random seeds (r0, r1) for it, and Bob (the receiver) a
+    random bit c and the seed r_c. Correlations are consumed at most once:
+    the pool is saved after every change.
+
+    Args:
+        capacity: Optional; the number of correlations the pool is refilled
+            up to. (POOL_CAPACITY by default)
+        path: Optional; the file the pool is saved to and loaded from.
+            (None by default: the pool is kept in memory only)
+        low_water: Optional; the number of correlations under which the
+            pool is refilled. (POOL_LOW_WATER by default)
+    """
+    def __init__(self, capacity=POOL_CAPACITY, path=None,
+                 low_water=POOL_LOW_WATER):
+        self.capacity = capacity
+        self.low_water = min(low_water, capacity)
+        self.path = path
+        self.correlations = {}  # map from IDs to correlations, oldest first
+        self.generated = 0  # number of correlations added by this process
+        self.consumed = 0  # number of correlations used by this process
+        self.fill_time = 0.0  # time spent filling the pool, in seconds
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.correlations)
+
+    def needs_refill(self, needed=0):
+        """Return whether the pool is under its low-water mark.
+
+        Args:
+            needed: Optional; the number of correlations about to be
+                consumed, which the pool must hold.
+        """
+        return len(self.correlations) < max(self.low_water, needed)
+
+    def new_ids(self, count):
+        """Return 'count' fresh correlation IDs.
+
+        IDs are random, so that they never clash with the ones of a pool
+        the other party kept from a run in which this one was not saved.
+        """
+        return [secrets.randbits(64) for _ in range(count)]
+
+    def add(self, correlations, elapsed):
+        """Add correlations generated in 'elapsed' seconds to the pool."""
+        self.correlations.update(correlations)
+        self.generated += len(correlations)
+        self.fill_time += elapsed
+        self.save()
+
+    def keep(self, ids):
+        """Drop the correlations whose ID is not in 'ids'."""
+        ids = set(ids)
+        self.correlations = {
+            i: correlation
+            for i, correlation in self.correlations.items() if i in ids
+        }
+
+    def take(self, count):
+        """Remove the 'count' oldest correlations and return their IDs."""
+        if count > len(self.correlations):
+            raise RuntimeError(f"Only {len(self.correlations)} random OTs "
+                               f"in the pool, {count} needed")
+        return list(self.correlations)[:count]
+
+    def pop(self, ids):
+        """Remove the correlations of the given IDs and return them."""
+        correlations = [self.correlations.pop(i) for i in ids]
+        self.consumed += len(correlations)
+        self.save()
+        return correlations
+
+    def load(self):
+        """Load the pool from its file.
+
+        A file that cannot be read, or that holds a pool of another version
+        of the format, is dropped: the pool starts empty and is rebuilt by
+        the next refill.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                saved = pickle.load(f)
+        except Exception as e:  # truncated, or not a pickle
+            logging.warning(f"Dropping the OT pool {self.path}, which cannot "
+                            f"be read: {e!r}")
+            return
+        version = saved.get("version") if isinstance(saved, dict) else None
+        if version != POOL_VERSION:
+            logging.warning(f"Dropping the OT pool {self.path} of format "
+                            f"version {version}, not {POOL_VERSION}")
+            return
+        self.correlations = saved["correlations"]
+
+    def save(self):
+        """Save the pool to its file, if any."""
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + ".tmp", "wb") as f:
+            pickle.dump({"version": POOL_VERSION,
+                         "correlations": self.correlations}, f)
+        os.replace(self.path + ".tmp", self.path)
+
+    def stats(self):
+        """Return the fill level and refill rate metrics of the pool.
+
+        Returns:
+            A dict with the number of correlations ("size"), the "capacity",
+            the "fill_level" (size over capacity), the numbers of
+            correlations "generated" and "consumed" by this process, and the
+            "refill_rate" in correlations per second.
+        """
+        return {
+            "size": len(self),
+            "capacity": self.capacity,
+            "fill_level": len(self) / self.capacity,
+            "generated": self.generated,
+            "consumed": self.consumed,
+            "refill_rate": (self.generated / self.fill_time
+                            if self.fill_time else None),
+        }
 
 
 class ObliviousTransfer:
-    def __init__(self, socket, enabled=True):
+    """Transfer of Bob's input keys from Alice.
+
+    In "simple" mode, every key pair goes through its own public-key OT. In
+    "batch" mode, the same OTs are run for all of Bob's wires at once, in a
+    constant number of messages carrying vectors of values. In "iknp" mode,
+    a fixed number of base OTs (SECURITY_PARAM) is run once per session,
+    with reversed roles, and all the key pairs are derived from them with
+    symmetric crypto only (OT extension of Ishai, Kilian, Nissim and
+    Petrank). In "pool" mode, random OTs are precomputed before Alice sends
+    each circuit (see fill_pool_garbler), and the online phase only consumes
+    them, with a one-bit correction per wire and two masked keys.
+
+    The methods exchanging messages with the other party are coroutines.
+    A party never waits for an acknowledgement: it only receives when it
+    needs the content of the reply.
+
+    Args:
+        socket: The socket connected to the other party.
+        enabled: Optional; enable the Oblivious Transfer protocol.
+            (True by default).
+        mode: Optional; the OT mode, one of OT_MODES.
+            ("simple" by default)
+        group: Optional; for the "prime" backend, the name of the group of
+            the public-key OTs, one of util.STANDARD_GROUPS, or None for a
+            random group generated once and cached (see util.PrimeGroup.load).
+        backend: Optional; the kind of group of the public-key OTs, one of
+            GROUP_BACKENDS. ("prime" by default)
+        pool_path: Optional; in "pool" mode, the file the random OTs are
+            kept in between runs. (None by default: they are not kept)
+        pool_capacity: Optional; in "pool" mode, the number of random OTs
+            the pool is refilled up to. (POOL_CAPACITY by default)
+    """
+    def __init__(self, socket, enabled=True, mode="simple", group=None,
+                 backend="prime", pool_path=None, pool_capacity=POOL_CAPACITY):
+        if mode not in OT_MODES:
+            raise ValueError(f"Unknown OT mode '{mode}'")
+        if backend not in GROUP_BACKENDS:
+            raise ValueError(f"Unknown OT group backend '{backend}'")
         self.socket = socket
         self.enabled = enabled
+        self.mode = mode
+        # Group setup (and its fixed-base table) is out of the OT latency
+        with metrics.timer("ot.group_setup_s"):
+            self.group = (GROUP_BACKENDS[backend].load(group)
+                          if enabled else None)
+        self.pool = None
+        if enabled and mode == "pool":
+            self.pool = RandomOTPool(pool_capacity, pool_path)
 
-    def get_result(self, a_inputs, b_keys):
+    async def get_result(self, a_inputs, b_keys):
         """Send Alice's inputs and retrieve Bob's result of evaluation.
 
         Args:
@@ -20,78 +239,144 @@ class ObliviousTransfer:
         Returns:
             The result of the yao circuit evaluation.
         """
+        await self.send_inputs(a_inputs, b_keys)
+        return await self.socket.receive()
+
+    async def send_inputs(self, a_inputs, b_keys):
+        """Send Alice's inputs and Bob's keys through oblivious transfer.
+
+        Args:
+            a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
+            b_keys: A dict mapping each Bob's wire to a pair (key, encr_bit).
+        """
         logging.debug("Sending inputs to Bob")
-        self.socket.send(a_inputs)
+        with metrics.phase("inputs"):
+            await self.socket.send(a_inputs)
+        with metrics.phase("ot"), metrics.timer("ot.time_s"):
+            await self.send_keys(b_keys)
+        metrics.count("ot.transfers", len(b_keys))
+
+    async def send_keys(self, b_keys):
+        """Send Bob's keys, through oblivious transfer if enabled.
+
+        Args:
+            b_keys: A dict mapping each Bob's wire to a pair (key, encr_bit).
+        """
+        if self.enabled and self.mode == "iknp":
+            await self.ot_extension_garbler(b_keys)
+            return
+        if self.enabled and self.mode == "batch":
+            await self.ot_batch_garbler(b_keys)
+            return
+        if self.pool is not None:
+            await self.pool_garbler(b_keys)
+            return
 
         for _ in range(len(b_keys)):
-            w = self.socket.receive()  # receive gate ID where to perform OT
+            w = await self.socket.receive()  # receive gate ID where to perform OT
             logging.debug(f"Received gate ID {w}")
 
             if self.enabled:  # perform oblivious transfer
                 pair = (pickle.dumps(b_keys[w][0]), pickle.dumps(b_keys[w][1]))
-                self.ot_garbler(pair)
+                await self.ot_garbler(pair)
             else:
                 to_send = (b_keys[w][0], b_keys[w][1])
-                self.socket.send(to_send)
-
-        return self.socket.receive()
+                await self.socket.send(to_send)
 
-    def send_result(self, circuit, g_tables, pbits_out, b_inputs):
+    async def send_result(self, circuit, g_tables, pbits_out, b_inputs,
+                    scheme="classic"):
         """Evaluate circuit and send the result to Alice.
 
+        The evaluation runs in a worker thread, leaving the event loop free
+        for I/O meanwhile.
+
         Args:
             circuit: A dict containing circuit spec.
             g_tables: Garbled tables of yao circuit.
             pbits_out: p-bits of outputs.
             b_inputs: A dict mapping Bob's wires to (clear) input bits.
+            scheme: Optional; the scheme the circuit was garbled with.
+                ("classic" by default)
+        """
+        a_inputs, b_inputs_encr = await self.receive_inputs(b_inputs)
+        result = await asyncio.to_thread(yao.evaluate, circuit, g_tables,
+                                         pbits_out, a_inputs, b_inputs_encr,
+                                         scheme=scheme)
+
+        logging.debug("Sending circuit evaluation")
+        with metrics.phase("result"):
+            await self.socket.send(result)
+
+    async def receive_inputs(self, b_inputs):
+        """Receive Alice's inputs and Bob's keys through oblivious transfer.
+
+        Args:
+            b_inputs: A dict mapping Bob's wires to (clear) input bits.
+
+        Returns:
+            A pair of dicts mapping Alice's and Bob's wires to their
+            (key, encr_bit) inputs.
         """
         # map from Alice's wires to (key, encr_bit) inputs
-        a_inputs = self.socket.receive()
+        a_inputs = await self.socket.receive()
+        logging.debug("Received Alice's inputs")
+        with metrics.phase("ot"), metrics.timer("ot.time_s"):
+            b_inputs_encr = await self.receive_keys(b_inputs)
+        metrics.count("ot.transfers", len(b_inputs))
+        return a_inputs, b_inputs_encr
+
+    async def receive_keys(self, b_inputs):
+        """Receive Bob's keys, through oblivious transfer if enabled.
+
+        Args:
+            b_inputs: A dict mapping Bob's wires to (clear) input bits.
+
+        Returns:
+            A dict mapping Bob's wires to their (key, encr_bit) inputs.
+        """
+        if self.enabled and self.mode == "iknp":
+            msgs = await self.ot_extension_evaluator(b_inputs)
+            return {w: pickle.loads(msg) for w, msg in msgs.items()}
+        if self.enabled and self.mode == "batch":
+            msgs = await self.ot_batch_evaluator(b_inputs)
+            return {w: pickle.loads(msg) for w, msg in msgs.items()}
+        if self.pool is not None:
+            msgs = await self.pool_evaluator(b_inputs)
+            return {w: pickle.loads(msg) for w, msg in msgs.items()}
         # map from Bob's wires to (key, encr_bit) inputs
         b_inputs_encr = {}
 
-        logging.debug("Received Alice's inputs")
-
         for w, b_input in b_inputs.items():
             logging.debug(f"Sending gate ID {w}")
-            self.socket.send(w)
+            await self.socket.send(w)
 
             if self.enabled:
-                b_inputs_encr[w] = pickle.loads(self.ot_evaluator(b_input))
+                b_inputs_encr[w] = pickle.loads(
+                    await self.ot_evaluator(b_input))
             else:
-                pair = self.socket.receive()
+                pair = await self.socket.receive()
                 logging.debug(f"Received key pair, key {b_input} selected")
                 b_inputs_encr[w] = pair[b_input]
 
-        result = yao.evaluate(circuit, g_tables, pbits_out, a_inputs,
-                              b_inputs_encr)
+        return b_inputs_encr
 
-        logging.debug("Sending circuit evaluation")
-        self.socket.send(result)
-
-    def ot_garbler(self, msgs):
+    async def ot_garbler(self, msgs):
         """Oblivious transfer, Alice's side.
 
         Args:
             msgs: A pair (msg1, msg2) to suggest to Bob.
         """
         logging.debug("OT protocol started")
-        G = util.PrimeGroup()
-        self.socket.send_wait(G)
+        G = self.group
 
         # OT protocol based on Nigel Smart’s "Cryptography Made Simple"
         c = G.gen_pow(G.rand_int())
-        h0 = self.socket.send_wait(c)
-        h1 = G.mul(c, G.inv(h0))
-        k = G.rand_int()
-        c1 = G.gen_pow(k)
-        e0 = util.xor_bytes(msgs[0], self.ot_hash(G.pow(h0, k), len(msgs[0])))
-        e1 = util.xor_bytes(msgs[1], self.ot_hash(G.pow(h1, k), len(msgs[1])))
-
-        self.socket.send((c1, e0, e1))
+        h0 = await self.socket.send_wait((G, c))
+        await self.socket.send(self.ot_encrypt(G, c, h0, msgs))
+        metrics.count("ot.public_key_transfers")
         logging.debug("OT protocol ended")
 
-    def ot_evaluator(self, b):
+    async def ot_evaluator(self, b):
         """Oblivious transfer, Bob's side.
 
         Args:
@@ -101,21 +386,298 @@ class ObliviousTransfer:
             The message selected by Bob.
         """
         logging.debug("OT protocol started")
-        G = self.socket.receive()
-        self.socket.send(True)
 
         # OT protocol based on Nigel Smart’s "Cryptography Made Simple"
-        c = self.socket.receive()
+        G, c = await self.socket.receive()
+        x, h = self.ot_choose(G, c, b)
+        c1, e0, e1 = await self.socket.send_wait(h)
+        mb = self.ot_decrypt(G, x, c1, (e0, e1)[b])
+        metrics.count("ot.public_key_transfers")
+
+        logging.debug("OT protocol ended")
+        return mb
+
+    async def ot_batch_garbler(self, b_keys):
+        """Oblivious transfers of all Bob's keys at once, Alice's side.
+
+        Bob first sends the list of his wires; then one message carries the
+        group and a vector of c's, Bob answers with the vector of h's and a
+        last message carries the vector of encrypted pairs.
+
+        Args:
+            b_keys: A dict mapping each Bob's wire to a pair (key, encr_bit).
+        """
+        logging.debug("Batched OT protocol started")
+        wires = await self.socket.receive()
+        G = self.group
+        cs = [G.gen_pow(G.rand_int()) for _ in wires]
+        hs = await self.socket.send_wait((G, cs))
+        await self.socket.send([
+            self.ot_encrypt(G, c, h0, (pickle.dumps(b_keys[w][0]),
+                                       pickle.dumps(b_keys[w][1])))
+            for w, c, h0 in zip(wires, cs, hs)
+        ])
+        metrics.count("ot.public_key_transfers", len(wires))
+        logging.debug("Batched OT protocol ended")
+
+    async def ot_batch_evaluator(self, b_inputs):
+        """Oblivious transfers of all Bob's keys at once, Bob's side.
+
+        Args:
+            b_inputs: A dict mapping Bob's wires to (clear) input bits.
+
+        Returns:
+            A dict mapping Bob's wires to the messages he selected.
+        """
+        logging.debug("Batched OT protocol started")
+        wires = list(b_inputs)
+        G, cs = await self.socket.send_wait(wires)
+        choices = [self.ot_choose(G, c, b_inputs[w]) for w, c in zip(wires, cs)]
+        encr_pairs = await self.socket.send_wait([h for _, h in choices])
+        msgs = {
+            w: self.ot_decrypt(G, x, c1, (e0, e1)[b_inputs[w]])
+            for w, (x, _), (c1, e0, e1) in zip(wires, choices, encr_pairs)
+        }
+        metrics.count("ot.public_key_transfers", len(wires))
+        logging.debug("Batched OT protocol ended")
+        return msgs
+
+    async def fill_pool_garbler(self, needed=0):
+        """Refill the pools of random OTs of both parties, Alice's side.
+
+        Alice sends the IDs of her correlations, the size under which the
+        pools are refilled and the size to reach; Bob drops the ones she
+        lacks and answers with the IDs he kept. If fewer are left than
+        the low-water mark or than 'needed', the pools are refilled in one
+        batch, up to their capacity: Bob also answers with the IDs of the
+        new ones, which are generated by OT extension of random seeds with
+        random choice bits. Otherwise, the refill only costs a round trip.
+        Bob must be waiting for a message (see fill_pool_evaluator).
+
+        Args:
+            needed: Optional; the number of correlations the next online
+                phase consumes.
+        """
+        start = time.perf_counter()
+        minimum = max(self.pool.low_water, needed)
+        target = max(self.pool.capacity, needed)
+        kept, ids = await self.socket.send_wait(
+            ("fill_pool", list(self.pool.correlations), minimum, target))
+        self.pool.keep(kept)
+        if ids:
+            seeds = {
+                i: (os.urandom(SEED_BYTES), os.urandom(SEED_BYTES))
+                for i in ids
+            }
+            await self.ot_extension_garbler(seeds)
+            self.pool.add(seeds, time.perf_counter() - start)
+        metrics.count("ot.pool_fill_s", time.perf_counter() - start)
+        logging.debug(f"OT pool refilled: {self.pool.stats()}")
+
+    async def fill_pool_evaluator(self, request):
+        """Refill the pools of random OTs of both parties, Bob's side.
+
+        Args:
+            request: The request received from Alice.
+        """
+        start = time.perf_counter()
+        _, alice_ids, minimum, target = request
+        self.pool.keep(alice_ids)
+        ids = []
+        if len(self.pool) < minimum:
+            ids = self.pool.new_ids(target - len(self.pool))
+        await self.socket.send((list(self.pool.correlations), ids))
+        if ids:
+            choices = {i: secrets.randbits(1) for i in ids}
+            seeds = await self.ot_extension_evaluator(choices)
+            self.pool.add({i: (choices[i], pickle.loads(seeds[i]))
+                           for i in ids}, time.perf_counter() - start)
+        metrics.count("ot.pool_fill_s", time.perf_counter() - start)
+        logging.debug(f"OT pool refilled: {self.pool.stats()}")
+
+    async def pool_garbler(self, b_keys):
+        """Transfer Bob's keys with precomputed random OTs, Alice's side.
+
+        For a correction bit d = b ^ c, Alice sends (x0 ^ H(r_d),
+        x1 ^ H(r_(1-d))), of which Bob can only unmask x_b, with r_c.
+
+        Args:
+            b_keys: A dict mapping each Bob's wire to a pair (key, encr_bit).
+        """
+        wires, ids, corrections = await self.socket.receive()
+        encr_pairs = []
+        for w, seeds, d in zip(wires, self.pool.pop(ids), corrections):
+            msg0, msg1 = pickle.dumps(b_keys[w][0]), pickle.dumps(b_keys[w][1])
+            encr_pairs.append(
+                (util.xor_bytes(msg0, self.ot_pad(seeds[d], len(msg0))),
+                 util.xor_bytes(msg1, self.ot_pad(seeds[1 - d], len(msg1)))))
+        await self.socket.send(encr_pairs)
+
+    async def pool_evaluator(self, b_inputs):
+        """Transfer Bob's keys with precomputed random OTs, Bob's side.
+
+        Args:
+            b_inputs: A dict mapping Bob's wires to (clear) input bits.
+
+        Returns:
+            A dict mapping Bob's wires to the messages he selected.
+        """
+        wires = list(b_inputs)
+        ids = self.pool.take(len(wires))
+        correlations = self.pool.pop(ids)
+        corrections = [
+            b_inputs[w] ^ c for w, (c, _) in zip(wires, correlations)
+        ]
+        encr_pairs = await self.socket.send_wait((wires, ids, corrections))
+
+        msgs = {}
+        for w, (_, r_c), pair in zip(wires, correlations, encr_pairs):
+            e = pair[b_inputs[w]]
+            msgs[w] = util.xor_bytes(e, self.ot_pad(r_c, len(e)))
+        return msgs
+
+    async def ot_extension_garbler(self, b_keys):
+        """OT extension, Alice's side.
+
+        Alice is the receiver of the base OTs, with a random choice vector s,
+        and gets from Bob one PRG seed of each pair. Bob then sends
+        u_i = G(k0_i) ^ G(k1_i) ^ r, so that the rows of the matrix
+        Q = [G(k_si) ^ s_i * u_i] are q_j = t_j ^ r_j * s, where t_j are the
+        rows of Bob's matrix [G(k0_i)] and r his choice bits. Each key pair
+        j is sent masked with H(j, q_j) and H(j, q_j ^ s).
+
+        Args:
+            b_keys: A dict mapping each Bob's wire to a pair (key, encr_bit).
+        """
+        logging.debug("OT extension started")
+        wires, G, cs = await self.socket.receive()
+        num_ots = len(wires)
+
+        # Base OTs, as receiver
+        s_bits = [secrets.randbits(1) for _ in range(SECURITY_PARAM)]
+        choices = [self.ot_choose(G, c, s_i) for c, s_i in zip(cs, s_bits)]
+        c1s, e0s, e1s, u = await self.socket.send_wait(
+            [h for _, h in choices])
+        seeds = [
+            self.ot_decrypt(G, x, c1, (e0, e1)[s_i])
+            for (x, _), c1, e0, e1, s_i in zip(choices, c1s, e0s, e1s, s_bits)
+        ]
+
+        # Extension
+        s = sum(s_i << i for i, s_i in enumerate(s_bits))
+        q_columns = [
+            prg(seed, num_ots) ^ (u_i if s_i else 0)
+            for seed, u_i, s_i in zip(seeds, u, s_bits)
+        ]
+        encr_pairs = []
+        for j, (w, q_j) in enumerate(zip(wires, transpose(q_columns,
+                                                          num_ots))):
+            msg0, msg1 = pickle.dumps(b_keys[w][0]), pickle.dumps(b_keys[w][1])
+            encr_pairs.append(
+                (util.xor_bytes(msg0, self.ot_ext_hash(j, q_j, len(msg0))),
+                 util.xor_bytes(msg1, self.ot_ext_hash(j, q_j ^ s,
+                                                       len(msg1)))))
+        await self.socket.send(encr_pairs)
+        metrics.count("ot.public_key_transfers", SECURITY_PARAM)
+        metrics.count("ot.extended_transfers", num_ots)
+        logging.debug("OT extension ended")
+
+    async def ot_extension_evaluator(self, b_inputs):
+        """OT extension, Bob's side (see ot_extension_garbler).
+
+        Args:
+            b_inputs: A dict mapping Bob's wires to (clear) input bits.
+
+        Returns:
+            A dict mapping Bob's wires to the messages he selected.
+        """
+        logging.debug("OT extension started")
+        wires = list(b_inputs)
+        num_ots = len(wires)
+        G = self.group
+
+        # Base OTs, as sender of pairs of PRG seeds
+        seeds = [(os.urandom(SEED_BYTES), os.urandom(SEED_BYTES))
+                 for _ in range(SECURITY_PARAM)]
+        cs = [G.gen_pow(G.rand_int()) for _ in range(SECURITY_PARAM)]
+        hs = await self.socket.send_wait((wires, G, cs))
+        encr_seeds = [
+            self.ot_encrypt(G, c, h0, pair)
+            for c, h0, pair in zip(cs, hs, seeds)
+        ]
+
+        # Extension
+        r = sum(b_inputs[w] << j for j, w in enumerate(wires))
+        t_columns = [prg(k0, num_ots) for k0, _ in seeds]
+        u = [
+            t_i ^ prg(k1, num_ots) ^ r
+            for t_i, (_, k1) in zip(t_columns, seeds)
+        ]
+        c1s, e0s, e1s = zip(*encr_seeds) if encr_seeds else ((), (), ())
+        encr_pairs = await self.socket.send_wait((c1s, e0s, e1s, u))
+
+        msgs = {}
+        for j, (w, t_j) in enumerate(zip(wires, transpose(t_columns,
+                                                          num_ots))):
+            e = encr_pairs[j][b_inputs[w]]
+            msgs[w] = util.xor_bytes(e, self.ot_ext_hash(j, t_j, len(e)))
+        metrics.count("ot.public_key_transfers", SECURITY_PARAM)
+        metrics.count("ot.extended_transfers", num_ots)
+        logging.debug("OT extension ended")
+        return msgs
+
+    @classmethod
+    def ot_encrypt(cls, G, c, h0, msgs):
+        """Encrypt both messages of an OT, sender's side.
+
+        Args:
+            G: The group of the OT.
+            c: The random group element sent to the receiver.
+            h0: The receiver's answer.
+            msgs: A pair (msg1, msg2) to suggest to the receiver.
+
+        Returns:
+            A triple (c1, e0, e1) to send to the receiver.
+        """
+        h1 = G.mul(c, G.inv(h0))
+        k = G.rand_int()
+        c1 = G.gen_pow(k)
+        e0 = util.xor_bytes(msgs[0], cls.ot_hash(G.pow(h0, k), len(msgs[0])))
+        e1 = util.xor_bytes(msgs[1], cls.ot_hash(G.pow(h1, k), len(msgs[1])))
+        return c1, e0, e1
+
+    @staticmethod
+    def ot_choose(G, c, b):
+        """Choose one of the messages of an OT, receiver's side.
+
+        Args:
+            G: The group of the OT.
+            c: The random group element received from the sender.
+            b: The receiver's choice bit.
+
+        Returns:
+            A pair (x, h): the receiver's secret exponent and the group
+            element h0 to answer the sender with.
+        """
         x = G.rand_int()
         x_pow = G.gen_pow(x)
         h = (x_pow, G.mul(c, G.inv(x_pow)))
-        c1, e0, e1 = self.socket.send_wait(h[b])
-        e = (e0, e1)
-        ot_hash = self.ot_hash(G.pow(c1, x), len(e[b]))
-        mb = util.xor_bytes(e[b], ot_hash)
+        return x, h[b]
 
-        logging.debug("OT protocol ended")
-        return mb
+    @classmethod
+    def ot_decrypt(cls, G, x, c1, e):
+        """Decrypt the chosen message of an OT, receiver's side.
+
+        Args:
+            G: The group of the OT.
+            x: The receiver's secret exponent.
+            c1: The group element received from the sender.
+            e: The encryption of the chosen message.
+
+        Returns:
+            The chosen message.
+        """
+        return util.xor_bytes(e, cls.ot_hash(G.pow(c1, x), len(e)))
 
     @staticmethod
     def ot_hash(pub_key, msg_length):
@@ -123,3 +685,15 @@ class ObliviousTransfer:
         key_length = (pub_key.bit_length() + 7) // 8  # key length in bytes
         bytes = pub_key.to_bytes(key_length, byteorder="big")
         return hashlib.shake_256(bytes).digest(msg_length)
+
+    @staticmethod
+    def ot_pad(seed, msg_length):
+        """Expand the seed of a random OT into a mask of 'msg_length' bytes."""
+        return hashlib.shake_256(seed).digest(msg_length)
+
+    @staticmethod
+    def ot_ext_hash(index, row, msg_length):
+        """Hash function masking the messages of the OT extension."""
+        data = index.to_bytes(8, "big") + row.to_bytes(SECURITY_PARAM // 8,
+                                                        "big")
+        return hashlib.shake_256(data).digest(msg_length)
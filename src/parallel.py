@@ -0,0 +1,128 @@
+import compiler
+import os
+import yao
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, repeat
+
+MIN_PARALLEL_GATES = 256  # fewer gates are garbled in the main process
+CHUNKS_PER_WORKER = 4  # number of jobs each worker gets per batch of gates
+
+
+def garble_gates(scheme, offset, jobs):
+    """Garble independent gates; run by the worker processes.
+
+    Args:
+        scheme: The garbling scheme, one of yao.SCHEMES.
+        offset: The global offset R, None with "classic".
+        jobs: A list of gates to garble, as built by
+            ParallelGarbledCircuit._job.
+
+    Returns:
+        The list of garbled tables of the gates; with half-gates, pairs
+        (table, label0).
+    """
+    tables = []
+    for job in jobs:
+        if scheme == "half-gates":
+            tables.append(yao.garble_half_gate(*job, offset))
+        elif scheme == "fixed-key":
+            tables.append(yao.garble_fixed_key_gate(*job))
+        else:
+            table = yao.GarbledGate(*job).get_garbled_table()
+            tables.append(b"".join(table[encr_bits]
+                                   for encr_bits in sorted(table)))
+    return tables
+
+
+class ParallelGarbledCircuit(yao.GarbledCircuit):
+    """A garbled circuit whose tables are garbled across worker processes.
+
+    Except with half-gates, the keys of every wire are chosen up front, in
+    gate order, which leaves all the tables independent of each other:
+    they are garbled in a single batch. With half-gates, output labels
+    depend on the tables, so gates are garbled level by level (see
+    CompiledCircuit.levels), each level in a batch. Tables end up in the
+    same layout as with GarbledCircuit.
+
+    Args:
+        circuit: A dict containing circuit spec, or its CompiledCircuit.
+        pbits: Optional; a dict of p-bits for the given circuit.
+        scheme: Optional; the garbling scheme, one of yao.SCHEMES.
+            ("classic" by default)
+        workers: Optional; the number of worker processes.
+            (by default, the number of CPUs)
+    """
+    def __init__(self, circuit, pbits={}, scheme="classic", workers=None):
+        self.workers = workers or os.cpu_count()
+        super().__init__(circuit, pbits=pbits, scheme=scheme)
+
+    def _gen_garbled_tables(self):
+        """Create the garbled table of each gate, in parallel."""
+        circuit = self.circuit
+        self.garbled_tables = [None] * circuit.num_gates
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            if self.scheme != "half-gates":
+                batch = []
+                for i, code in enumerate(circuit.types):
+                    if self._is_free(compiler.GATE_TYPES[code]):
+                        self._derive_free_gate(i)
+                    else:
+                        self._set_new_key(circuit.num_inputs + i)
+                        batch.append(i)
+                self._garble_batch(executor, batch)
+                return
+
+            levels = circuit.levels()
+            gates_by_level = [[] for _ in range(max(levels, default=-1) + 1)]
+            for i, level in enumerate(levels):
+                gates_by_level[level].append(i)
+            for gates in gates_by_level:
+                self._garble_batch(executor, [
+                    i for i in gates
+                    if not self._is_free(compiler.GATE_TYPES[circuit.types[i]])
+                ])
+                for i in gates:
+                    if self.garbled_tables[i] is None:
+                        self._derive_free_gate(i)
+
+    def _garble_batch(self, executor, gates):
+        """Garble independent gates, across the workers if there are many.
+
+        Args:
+            executor: The pool of worker processes.
+            gates: The list of the indices of the gates.
+        """
+        jobs = [self._job(i) for i in gates]
+        if self.workers == 1 or len(jobs) < MIN_PARALLEL_GATES:
+            results = garble_gates(self.scheme, self.offset, jobs)
+        else:
+            size = -(-len(jobs) // (self.workers * CHUNKS_PER_WORKER))
+            chunks = [jobs[j:j + size] for j in range(0, len(jobs), size)]
+            results = chain.from_iterable(
+                executor.map(garble_gates, repeat(self.scheme),
+                             repeat(self.offset), chunks))
+
+        for i, result in zip(gates, results):
+            if self.scheme == "half-gates":
+                result, label0 = result
+                out = self.circuit.num_inputs + i
+                self.keys[out] = (label0, label0 ^ self.offset)
+                self.pbits[out] = label0 & 1
+            self.garbled_tables[i] = result
+
+    def _job(self, i):
+        """Return the arguments needed to garble gate i, for garble_gates."""
+        circuit, keys = self.circuit, self.keys
+        gate_type = compiler.GATE_TYPES[circuit.types[i]]
+        out = circuit.num_inputs + i
+        if self.scheme == "half-gates":
+            return (out, gate_type, keys[circuit.in0[i]][0],
+                    keys[circuit.in1[i]][0])
+        if self.scheme == "fixed-key":
+            return (out, gate_type, keys[circuit.in0[i]], keys[circuit.in1[i]],
+                    keys[out])
+        gate = circuit.gate(i)
+        wires = gate["in"] + [out]
+        return (gate, {w: keys[w] for w in wires},
+                {w: self.pbits[w] for w in wires})
@@ -1,6 +1,17 @@
+import asyncio
+import cache
+import codec
+import compiler
 import logging
+import metrics
+import optimizer
+import os
 import ot
+import parallel
+import pickle
+import pregarble
 import util
+import vector
 import yao
 from abc import ABC, abstractmethod
 
@@ -8,28 +19,137 @@ logging.basicConfig(format="[%(levelname)s] %(message)s",
                     level=logging.WARNING)
 
 class YaoGarbler(ABC):
-    """An abstract class for Yao garblers (e.g. Alice)."""
-    def __init__(self, circuits):
-        circuits = util.parse_json(circuits)
+    """An abstract class for Yao garblers (e.g. Alice).
+
+    If a chunk size is given, circuits are not garbled up front: only the
+    keys of their inputs are created, and tables are garbled while streaming.
+    Otherwise, if a pool size is given, circuits are garbled in the
+    background by worker processes, ahead of the sessions that use them;
+    else, with more than one worker, each circuit is garbled across
+    worker processes. With 'optimize', circuits are first rewritten with
+    fewer gates by the optimizer module. With 'lean', circuits garbled in a
+    single process, up front or in the pool, are yao.LeanGarbledCircuits.
+
+    Garbled tables are dropped as soon as they are sent, and the rest of a
+    garbled circuit once its session is over (see release).
+
+    The circuits file is either a JSON file of circuit specs, or a Bristol
+    Fashion circuit, loaded by the bristol module straight into a
+    CompiledCircuit. Circuits already loaded can be given instead of a file
+    (see cache.compile_circuits).
+    """
+    def __init__(self, circuits, scheme="classic", chunk_size=None,
+                 pool_size=0, workers=1, optimize=False, lean=False):
+        if lean and scheme not in yao.LABEL_SCHEMES:
+            raise ValueError(f"Lean garbling needs 128-bit labels, which the "
+                             f"'{scheme}' scheme has not")
+        if lean and workers > 1 and not chunk_size and not pool_size:
+            raise ValueError("Circuits garbled across workers cannot be lean")
+        if isinstance(circuits, str):
+            circuits = cache.read_circuits(circuits)
         self.name = circuits["name"]
+        self.scheme = scheme
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.lean = lean
         self.circuits = []
+        self.pools = {}  # map from circuit IDs to pools of garbled circuits
 
         for circuit in circuits["circuits"]:
-            garbled_circuit = yao.GarbledCircuit(circuit)
-            pbits = garbled_circuit.get_pbits()
-            entry = {
-                "circuit": circuit,
-                "garbled_circuit": garbled_circuit,
-                "garbled_tables": garbled_circuit.get_garbled_tables(),
-                "keys": garbled_circuit.get_keys(),
-                "pbits": pbits,
-                "pbits_out": {w: pbits[w]
-                              for w in circuit["out"]},
-            }
-            self.circuits.append(entry)
+            if optimize and isinstance(circuit, compiler.CompiledCircuit):
+                logging.warning(f"Not optimizing {circuit.id}: only circuit "
+                                f"specs can be optimized")
+            elif optimize:
+                circuit = optimizer.optimize_checked(circuit)
+            if pool_size and not chunk_size:
+                circuit_id = compiler.header(circuit)["id"]
+                self.pools[circuit_id] = pregarble.GarblingPool(
+                    circuit, scheme=scheme, size=pool_size, lean=lean)
+                self.circuits.append({"circuit": circuit})
+            else:
+                self.circuits.append(self.garble(circuit))
+
+    def garble(self, circuit, garbled_circuit=None):
+        """Return the entry of a garbled circuit.
+
+        Args:
+            circuit: A dict containing circuit spec, or a CompiledCircuit.
+            garbled_circuit: Optional; the circuit already garbled.
+                (None by default: it is garbled here)
+
+        Returns:
+            A dict representing the circuit to evaluate.
+        """
+        if garbled_circuit is None and self.chunk_size:
+            garbled_circuit = yao.StreamingGarbledCircuit(circuit,
+                                                          scheme=self.scheme)
+        elif garbled_circuit is None and self.workers > 1:
+            garbled_circuit = parallel.ParallelGarbledCircuit(
+                circuit, scheme=self.scheme, workers=self.workers)
+        elif garbled_circuit is None and self.lean:
+            garbled_circuit = yao.LeanGarbledCircuit(circuit,
+                                                     scheme=self.scheme)
+        elif garbled_circuit is None:
+            garbled_circuit = yao.GarbledCircuit(circuit, scheme=self.scheme)
+        pbits = garbled_circuit.get_pbits()
+        return {
+            "circuit": circuit,
+            "garbled_circuit": garbled_circuit,
+            "garbled_tables": garbled_circuit.get_garbled_tables(),
+            "keys": garbled_circuit.get_keys(),
+            "pbits": pbits,
+            "pbits_out": {
+                w: pbits[w]
+                for w in compiler.header(circuit)["out"] if w in pbits
+            },
+        }
+
+    def take(self, entry):
+        """Return a garbled circuit used by no previous session.
+
+        Garbled circuits are single-use: they are popped from the pool of
+        the circuit if any, else the one garbled up front is used by the
+        first session only and the circuit is garbled again for the others.
+
+        Args:
+            entry: A dict representing the circuit to evaluate.
+        """
+        circuit = entry["circuit"]
+        pool = self.pools.get(compiler.header(circuit)["id"])
+        if pool is not None:
+            return self.garble(circuit, pool.pop())
+        if entry.get("used"):
+            return self.garble(circuit)
+        entry["used"] = True
+        return entry
+
+    def release(self, entry, tables_only=False):
+        """Drop the garbled state of a circuit that is no longer needed.
+
+        Garbled circuits are single-use (see take): their tables are not
+        needed once sent, and the rest once the session is over, so that
+        only the garbled circuits of the session under way are held.
+
+        Args:
+            entry: A dict representing the circuit to evaluate.
+            tables_only: Optional; only drop the garbled tables.
+                (False by default)
+        """
+        garbled_circuit = entry.get("garbled_circuit")
+        if garbled_circuit is not None:
+            garbled_circuit.release_tables()
+        entry["garbled_tables"] = None
+        if not tables_only:
+            for name in ("garbled_circuit", "keys", "pbits", "pbits_out"):
+                entry.pop(name, None)
+
+    def close(self):
+        """Stop the background garbling of circuits."""
+        for pool in self.pools.values():
+            pool.close()
 
     @abstractmethod
-    def start(self):
+    async def start(self):
         pass
 
 
@@ -45,61 +165,246 @@ class Alice(YaoGarbler):
     a specific order.
 
     Attributes:
-        circuits: the JSON file containing circuits.
+        circuits: the JSON file containing circuits, or the dict of the
+            circuits already loaded.
         input_data_path: A string containing the path to the file containing Alice's values.
         output_path: A string containing the path to the file to write the results to.
         oblivious_transfer: Optional; enable the Oblivious Transfer protocol.
             (True by default).
+        scheme: Optional; the garbling scheme, one of yao.SCHEMES.
+            ("classic" by default).
+        chunk_size: Optional; stream the garbled tables by chunks of this
+            number of gates, garbled while Bob evaluates the previous ones.
+            (None by default: the whole circuit is garbled and sent at once).
+        ot_mode: Optional; the OT mode, one of ot.OT_MODES, which must be
+            the same as Bob's. ("simple" by default).
+        ot_group: Optional; the group of the public-key OTs, one of
+            util.STANDARD_GROUPS, or None for a cached random group.
+        ot_backend: Optional; the kind of group of the public-key OTs, one
+            of ot.GROUP_BACKENDS. ("prime" by default).
+        pool_size: Optional; the number of garbled instances of each circuit
+            kept ready by background workers. (0 by default: no workers).
+        sessions: Optional; the number of times each circuit is evaluated,
+            with a fresh garbling each time. (1 by default).
+        workers: Optional; the number of processes garbling each circuit.
+            (1 by default).
+        socket: Optional; the socket connected to Bob.
+            (by default, a new util.GarblerSocket).
+        pool_path: Optional; the file of the random OTs of the "pool" OT
+            mode. (by default, alice_pool.pickle in ot.POOL_DIR).
+        optimize: Optional; optimize circuits before garbling them.
+            (False by default).
+        batch: Optional; compute the circuit on each of Alice's values,
+            paired with Bob's values in order, instead of on their sum
+            (see run_batch). (False by default).
+        lean: Optional; garble circuits into yao.LeanGarbledCircuits, with
+            the "half-gates" or "fixed-key" scheme. (False by default).
+
+    Raises:
+        ValueError: Batches are asked with a chunk size or with no input
+            values, or lean garbling with a scheme without 128-bit labels or
+            across workers.
     """
-    def __init__(self, circuits, input_data_path, output_path, number_of_bits, oblivious_transfer=True):
-        super().__init__(circuits)
-        self.socket = util.GarblerSocket()
-        self.ot = ot.ObliviousTransfer(self.socket, enabled=oblivious_transfer)
-        self.data = util.read_input_data(input_data_path)
+    def __init__(self, circuits, input_data_path, output_path, number_of_bits, oblivious_transfer=True, scheme="classic", chunk_size=None, ot_mode="simple", ot_group=None, ot_backend="prime", pool_size=0, sessions=1, workers=1, socket=None, pool_path=os.path.join(ot.POOL_DIR, "alice_pool.pickle"), optimize=False, batch=False, lean=False):
+        if batch and chunk_size:
+            raise ValueError("Batches of circuits cannot be streamed")
+        super().__init__(circuits, scheme=scheme, chunk_size=chunk_size,
+                         pool_size=pool_size, workers=workers,
+                         optimize=optimize, lean=lean)
+        self.socket = socket or util.GarblerSocket()
+        self.ot = ot.ObliviousTransfer(
+            self.socket, enabled=oblivious_transfer, mode=ot_mode,
+            group=ot_group, backend=ot_backend, pool_path=pool_path)
+        self.data = util.read_input_data(
+            input_data_path, aggregator_func=list if batch else sum)
+        if batch and not self.data:
+            raise ValueError(f"{input_data_path} holds no values to batch")
         self.output_path = output_path
         self.num = number_of_bits
+        self.sessions = sessions
+        self.batch = batch
+
+    async def start(self):
+        """Start Yao protocol.
+
+        The pools of random OTs of the "pool" OT mode are refilled between
+        sessions once they run low or cannot cover the next circuit, rather
+        than before sending it.
+        """
+        try:
+            steps = [entry for _ in range(self.sessions)
+                     for entry in self.circuits]
+            for i, entry in enumerate(steps):
+                if self.batch:
+                    await self.run_batch(entry)
+                else:
+                    await self.run(self.take(entry))
+                if i + 1 == len(steps) or self.ot.pool is None:
+                    continue
+                needed = len(compiler.header(steps[i + 1]["circuit"])["bob"])
+                if self.batch:
+                    needed *= len(self.data)
+                if self.ot.pool.needs_refill(needed):
+                    with metrics.phase("ot-pool"):
+                        await self.ot.fill_pool_garbler(needed=needed)
+        finally:
+            self.close()
+
+    async def run(self, circuit):
+        """Run one session of Yao protocol on a garbled circuit.
+
+        Alice's inputs and the OT messages follow the circuit without
+        waiting for Bob to acknowledge it.
+
+        Args:
+            circuit: A dict representing the circuit to evaluate.
+        """
+        compiled = circuit["garbled_circuit"].circuit
+        if self.ot.pool is not None:  # sync, and refill if short, the OTs
+            with metrics.phase("ot-pool"):
+                await self.ot.fill_pool_garbler(needed=len(compiled.bob))
+        if self.chunk_size:
+            frames = codec.encode_stream(compiled, self.scheme)
+        else:
+            frames = codec.encode(compiled, circuit["garbled_tables"],
+                                  circuit["pbits_out"], self.scheme)
+        logging.debug(f"Sending {compiled.id}")
+        with metrics.phase("circuit"):
+            await self.socket.send_frames(frames)
+        del frames
+        self.release(circuit, tables_only=True)
+        await self.print(circuit)
+        self.release(circuit)
 
-    def start(self):
-        """Start Yao protocol."""
-        for circuit in self.circuits:
-            to_send = {
-                "circuit": circuit["circuit"],
-                "garbled_tables": circuit["garbled_tables"],
-                "pbits_out": circuit["pbits_out"],
-            }
-            logging.debug(f"Sending {circuit['circuit']['id']}")
-            self.socket.send_wait(to_send)
-            self.print(circuit)
-
-    def print(self, entry):
+    async def print(self, entry):
         """Print circuit evaluation for all Bob and Alice inputs.
 
         Args:
             entry: A dict representing the circuit to evaluate.
         """
-        circuit, pbits, keys = entry["circuit"], entry["pbits"], entry["keys"]
+        circuit = compiler.header(entry["circuit"])
         outputs = circuit["out"]
+
+        print(f"======== {circuit['id']} ========")
+        a_inputs, b_keys = self._get_inputs(entry, self.data)
+        # Send Alice's encrypted inputs and keys to Bob
+        if self.chunk_size:
+            await self.ot.send_inputs(a_inputs, b_keys)
+            result = await self.stream(entry)
+        else:
+            result = await self.ot.get_result(a_inputs, b_keys)
+        # Format output
+        int_result = util.convert_to_decimal([result[w] for w in outputs])
+        util.save_results(int_result, output_path=self.output_path)
+        print(f'Alice\'s input aggregated value is {self.data}\n')
+        print(f'Computation completed, all the information are in the output file {self.output_path}.')
+
+    async def stream(self, entry):
+        """Garble and send the tables of a circuit chunk by chunk.
+
+        Chunks are sent without waiting for Bob, so that the next chunk is
+        garbled while the previous ones are on the wire or evaluated. The
+        last chunk carries the output p-bits and Bob answers it with the
+        result.
+
+        Args:
+            entry: A dict representing the circuit to evaluate.
+
+        Returns:
+            The result of the yao circuit evaluation.
+        """
+        garbled_circuit = entry["garbled_circuit"]
+        compiled = garbled_circuit.circuit
+        outputs = compiler.header(entry["circuit"])["out"]
+        num_gates, start = compiled.num_gates, 0
+
+        for g_tables in garbled_circuit.garble_chunks(self.chunk_size):
+            end = start + len(g_tables)
+            pbits_out = None
+            if end == num_gates:
+                pbits = garbled_circuit.get_pbits()
+                pbits_out = {w: pbits[w] for w in outputs}
+            logging.debug(f"Sending gates {start} to {end}")
+            with metrics.phase("chunk"):
+                await self.socket.send_frames(codec.encode_chunk(
+                    compiled.types[start:end], g_tables, pbits_out))
+            start = end
+        return await self.socket.receive()
+
+    async def run_batch(self, entry):
+        """Run one session of Yao protocol on a batch of instances.
+
+        The circuit is garbled afresh for each of Alice's values, and all
+        the instances are sent in one message, the circuit arrays only once
+        (see codec.encode_batch). The keys of Bob's wires of every instance
+        then go through a single round of oblivious transfers, and Bob
+        sends back the results of all the instances at once, which are
+        saved one per line.
+
+        Args:
+            entry: A dict representing the circuit to evaluate.
+        """
+        circuit = compiler.header(entry["circuit"])
+        instances = [self.take(entry) for _ in self.data]
+        compiled = instances[0]["garbled_circuit"].circuit
+        if self.ot.pool is not None:  # sync, and refill if short, the OTs
+            with metrics.phase("ot-pool"):
+                await self.ot.fill_pool_garbler(
+                    needed=len(compiled.bob) * len(instances))
+        frames = codec.encode_batch(
+            compiled, [instance["garbled_tables"] for instance in instances],
+            [instance["pbits_out"] for instance in instances], self.scheme)
+        logging.debug(f"Sending {len(instances)} instances of {compiled.id}")
+        with metrics.phase("circuit"):
+            await self.socket.send_frames(frames)
+        del frames
+        for instance in instances:
+            self.release(instance, tables_only=True)
+
+        print(f"======== {len(instances)} x {circuit['id']} ========")
+        # Wires of each instance are told apart by the instance index
+        a_inputs, b_keys = {}, {}
+        for i, (instance, value) in enumerate(zip(instances, self.data)):
+            a_instance, b_instance = self._get_inputs(instance, value)
+            a_inputs.update(((i, w), inputs) for w, inputs in a_instance.items())
+            b_keys.update(((i, w), keys) for w, keys in b_instance.items())
+        for instance in instances:
+            self.release(instance)
+        results = await self.ot.get_result(a_inputs, b_keys)
+        int_results = [
+            util.convert_to_decimal([result[w] for w in circuit["out"]])
+            for result in results
+        ]
+        util.save_results(int_results, output_path=self.output_path)
+        print(f'Alice\'s input is a batch of {len(self.data)} values\n')
+        print(f'Computation completed, all the information are in the output file {self.output_path}.')
+
+    def _get_inputs(self, entry, value):
+        """Return Alice's inputs and the key pairs of Bob's wires.
+
+        Args:
+            entry: A dict representing the circuit to evaluate.
+            value: Alice's input value.
+
+        Returns:
+            A dict mapping Alice's wires to their (key, encr_bit) input, and
+            a dict mapping Bob's wires to a pair of (key, encr_bit).
+        """
+        circuit = compiler.header(entry["circuit"])
+        pbits, keys = entry["pbits"], entry["keys"]
         a_wires = circuit.get("alice", [])  # Alice's wires
         a_inputs = {}  # map from Alice's wires to (key, encr_bit) inputs
         b_wires = circuit.get("bob", [])  # Bob's wires
         b_keys = {  # map from Bob's wires to a pair (key, encr_bit)
-            w: self._get_encr_bits(pbits[w], key0, key1)
-            for w, (key0, key1) in keys.items() if w in b_wires
+            w: self._get_encr_bits(pbits[w], *keys[w])
+            for w in b_wires
         }
-
-        print(f"======== {circuit['id']} ========")
-        bits_a = util.convert_to_binary_list(self.data, number_of_bits=self.num)  # Alice's inputs
+        bits_a = util.convert_to_binary_list(value, number_of_bits=self.num)  # Alice's inputs
         # Map Alice's wires to (key, encr_bit)
         for i in range(len(a_wires)):
             a_inputs[a_wires[i]] = (keys[a_wires[i]][bits_a[i]],
                                     pbits[a_wires[i]] ^ bits_a[i])
-        # Send Alice's encrypted inputs and keys to Bob
-        result = self.ot.get_result(a_inputs, b_keys)
-        # Format output
-        int_result = util.convert_to_decimal([result[w] for w in outputs])
-        util.save_results(int_result, output_path=self.output_path)
-        print(f'Alice\'s input aggregated value is {self.data}\n')
-        print(f'Computation completed, all the information are in the output file {self.output_path}.')
+        return a_inputs, b_keys
 
     def _get_encr_bits(self, pbit, key0, key1):
         return ((key0, 0 ^ pbit), (key1, 1 ^ pbit))
@@ -115,42 +420,227 @@ class Bob:
         input_data_path: A string containing the path to the file containing Bob's values.
         oblivious_transfer: Optional; enable the Oblivious Transfer protocol.
             (True by default).
+        ot_mode: Optional; the OT mode, one of ot.OT_MODES, which must be
+            the same as Alice's. ("simple" by default).
+        ot_group: Optional; the group of the public-key OTs, one of
+            util.STANDARD_GROUPS, or None for a cached random group.
+        ot_backend: Optional; the kind of group of the public-key OTs, one
+            of ot.GROUP_BACKENDS. ("prime" by default).
+        vectorized: Optional; evaluate circuits garbled with 128-bit labels
+            a level of gates at a time (see vector.VectorEvaluator), which
+            pays off for wide circuits. (False by default).
+        socket: Optional; the socket connected to Alice.
+            (by default, a new util.EvaluatorSocket).
+        pool_path: Optional; the file of the random OTs of the "pool" OT
+            mode. (by default, bob_pool.pickle in ot.POOL_DIR).
+        max_gates: Optional; the maximum number of gates of the circuits
+            Bob accepts to evaluate. (None by default: no limit).
     """
-    def __init__(self, input_data_path, number_of_bits, oblivious_transfer=True):
-        self.socket = util.EvaluatorSocket()
-        self.ot = ot.ObliviousTransfer(self.socket, enabled=oblivious_transfer)
+    def __init__(self, input_data_path, number_of_bits, oblivious_transfer=True, ot_mode="simple", ot_group=None, ot_backend="prime", vectorized=False, socket=None, pool_path=os.path.join(ot.POOL_DIR, "bob_pool.pickle"), max_gates=None):
+        self.socket = socket or util.EvaluatorSocket()
+        self.ot = ot.ObliviousTransfer(
+            self.socket, enabled=oblivious_transfer, mode=ot_mode,
+            group=ot_group, backend=ot_backend, pool_path=pool_path)
         self.data_path = input_data_path
         self.num = number_of_bits
+        self.vectorized = vectorized
+        self.max_gates = max_gates
 
-    def listen(self):
+    async def listen(self):
         """Start listening for Alice messages."""
         logging.info("Start listening")
         try:
-            for entry in self.socket.poll_socket():
-                self.socket.send(True)
-                self.send_evaluation(entry)
-        except KeyboardInterrupt:
+            while True:
+                await self.handle(await self.socket.receive_frames())
+        except asyncio.CancelledError:
             logging.info("Stop listening")
 
-    def send_evaluation(self, entry):
+    async def handle(self, frames):
+        """Handle a message of Alice starting a step of the protocol.
+
+        Args:
+            frames: The frames of the message: a garbled circuit (see
+                codec.encode), or a single frame requesting a refill of the
+                pools of random OTs.
+
+        Other messages are left over from a refused circuit, which Alice
+        sent without waiting for Bob: they are dropped.
+        """
+        if len(frames) == 1:
+            request = pickle.loads(frames[0])
+            if isinstance(request, tuple) and request[0] == "fill_pool":
+                # refill of the OT pool, between circuits
+                with metrics.phase("ot-pool"):
+                    await self.ot.fill_pool_evaluator(request)
+            else:
+                logging.debug("Dropping a message of a refused circuit")
+            return
+        try:
+            entry = codec.decode(frames)
+        except (KeyError, ValueError):
+            logging.debug("Dropping a message of a refused circuit")
+            return
+        num_gates = entry["circuit"].num_gates * (entry["batch"] or 1)
+        if self.max_gates is not None and num_gates > self.max_gates:
+            logging.warning(f"Refusing a circuit of {num_gates} gates")
+            with metrics.phase("error"):
+                await self.socket.send(util.SessionError(
+                    f"Circuits of more than {self.max_gates} gates are "
+                    f"refused"))
+            return
+        if entry["stream"]:
+            await self.send_stream_evaluation(entry)
+        elif entry["batch"]:
+            await self.send_batch_evaluation(entry)
+        else:
+            await self.send_evaluation(entry)
+
+    async def send_evaluation(self, entry):
         """Evaluate yao circuit for all Bob and Alice's inputs and
         send back the results.
 
         Args:
-            entry: A dict representing the circuit to evaluate.
+            entry: A dict representing the circuit to evaluate, as decoded
+                by codec.decode.
         """
         circuit, pbits_out = entry["circuit"], entry["pbits_out"]
         garbled_tables = entry["garbled_tables"]
-        b_wires = circuit.get("bob", [])  # list of Bob's wires
+        scheme = entry["scheme"]
+        b_inputs_clear = self._get_inputs(circuit)
+        if self._vectorize(scheme):
+            a_inputs, b_inputs = await self.ot.receive_inputs(b_inputs_clear)
+            evaluator = vector.VectorEvaluator(circuit, a_inputs, b_inputs,
+                                               scheme=scheme)
+            await asyncio.to_thread(evaluator.evaluate_gates, garbled_tables)
+            logging.debug("Sending circuit evaluation")
+            with metrics.phase("result"):
+                await self.socket.send(evaluator.get_result(pbits_out))
+            return
+        await self.ot.send_result(circuit, garbled_tables, pbits_out, b_inputs_clear,
+                            scheme=scheme)
+
+    async def send_stream_evaluation(self, entry):
+        """Evaluate a streamed yao circuit chunk by chunk and send back the
+        results.
+
+        Only the values of the wires still to be read are kept in memory.
+
+        Args:
+            entry: A dict representing the circuit to evaluate, as decoded
+                by codec.decode.
+        """
+        circuit = entry["circuit"]
+        b_inputs_clear = self._get_inputs(circuit)
+        a_inputs, b_inputs = await self.ot.receive_inputs(b_inputs_clear)
+        if self._vectorize(entry["scheme"]):
+            evaluator = vector.VectorEvaluator(circuit, a_inputs, b_inputs,
+                                               scheme=entry["scheme"])
+        else:
+            evaluator = yao.Evaluator(circuit, a_inputs, b_inputs,
+                                      scheme=entry["scheme"], live_only=True)
+
+        start, pbits_out = 0, None
+        while pbits_out is None:
+            chunk = codec.decode_chunk(await self.socket.receive_frames(),
+                                       circuit, start)
+            pbits_out = chunk["pbits_out"]
+            # Next chunks keep arriving while this one is evaluated
+            await asyncio.to_thread(evaluator.evaluate_gates,
+                                    chunk["garbled_tables"], start)
+            start += chunk["num_gates"]
+
+        logging.debug("Sending circuit evaluation")
+        with metrics.phase("result"):
+            await self.socket.send(evaluator.get_result(pbits_out))
+
+    async def send_batch_evaluation(self, entry):
+        """Evaluate a batch of instances of a yao circuit, one for each of
+        Bob's values, and send back all the results at once.
+
+        Args:
+            entry: A dict representing the batch to evaluate, as decoded by
+                codec.decode.
+        """
+        circuit, batch = entry["circuit"], entry["batch"]
+        values = util.read_input_data(self.data_path, aggregator_func=list)
+        if len(values) != batch:
+            logging.warning(f"Refusing a batch of {batch} instances for "
+                            f"{len(values)} values")
+            with metrics.phase("error"):
+                await self.socket.send(util.SessionError(
+                    f"Bob has {len(values)} values, not {batch}"))
+            return
+        print(f"Received {batch} x {circuit.id}")
+        print(f'Bob\'s input is a batch of {batch} values\n')
+        b_inputs_clear = {}  # wires of each instance are told apart by index
+        for i, value in enumerate(values):
+            b_inputs_clear.update(((i, w), bit) for w, bit in
+                                  self._get_bits(circuit, value).items())
+        a_inputs, b_inputs = await self.ot.receive_inputs(b_inputs_clear)
+        results = await asyncio.to_thread(self._evaluate_batch, entry,
+                                          a_inputs, b_inputs)
+        logging.debug("Sending batch evaluation")
+        with metrics.phase("result"):
+            await self.socket.send(results)
+
+    def _evaluate_batch(self, entry, a_inputs, b_inputs):
+        """Evaluate each instance of a batch; return the list of results.
+
+        Args:
+            entry: A dict representing the batch to evaluate.
+            a_inputs: A dict mapping (instance, wire) pairs of Alice's wires
+                to their (key, encr_bit) input.
+            b_inputs: The same for Bob's wires.
+        """
+        circuit, scheme = entry["circuit"], entry["scheme"]
+        inputs = [({}, {}) for _ in range(entry["batch"])]
+        for side, side_inputs in enumerate((a_inputs, b_inputs)):
+            for (i, w), value in side_inputs.items():
+                inputs[i][side][w] = value
+        results = []
+        for g_tables, pbits_out, (a_instance, b_instance) in zip(
+                entry["garbled_tables"], entry["pbits_out"], inputs):
+            if self._vectorize(scheme):
+                evaluator = vector.VectorEvaluator(circuit, a_instance,
+                                                   b_instance, scheme=scheme)
+                evaluator.evaluate_gates(g_tables)
+                results.append(evaluator.get_result(pbits_out))
+            else:
+                results.append(yao.evaluate(circuit, g_tables, pbits_out,
+                                            a_instance, b_instance,
+                                            scheme=scheme))
+        return results
+
+    def _vectorize(self, scheme):
+        """Return True if circuits of this scheme are evaluated by level."""
+        if self.vectorized and scheme not in yao.LABEL_SCHEMES:
+            logging.info(f"The '{scheme}' scheme is evaluated gate by gate")
+        return self.vectorized and scheme in yao.LABEL_SCHEMES
+
+    def _get_inputs(self, circuit):
+        """Read Bob's input and map each of his wires to its clear bit.
+
+        Args:
+            circuit: The CompiledCircuit to evaluate.
+        """
         data = util.read_input_data(self.data_path)
 
-        print(f"Received {circuit['id']}")
+        print(f"Received {circuit.id}")
+        print(f'Bob\'s input aggregated value is {data}\n')
+        return self._get_bits(circuit, data)
+
+    def _get_bits(self, circuit, value):
+        """Map each of Bob's wires to its clear bit for an input value.
 
-        bits_b = util.convert_to_binary_list(data, number_of_bits=self.num)
+        Args:
+            circuit: The CompiledCircuit to evaluate.
+            value: Bob's input value.
+        """
+        # list of Bob's wires
+        b_wires = [circuit.wire_ids[w] for w in circuit.bob]
+        bits_b = util.convert_to_binary_list(value, number_of_bits=self.num)
         # Create dict mapping each wire of Bob to Bob's input
-        b_inputs_clear = {
+        return {
             b_wires[i]: bits_b[i]
             for i in range(len(b_wires))
-        }
-        print(f'Bob\'s input aggregated value is {data}\n')
-        self.ot.send_result(circuit, garbled_tables, pbits_out, b_inputs_clear)
\ No newline at end of file
+        }
\ No newline at end of file
@@ -0,0 +1,91 @@
+import compiler
+import logging
+import metrics
+import yao
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+def garble(circuit, scheme, lean=False):
+    """Garble a circuit; run by the worker processes of a GarblingPool.
+
+    With 'lean', it is a yao.LeanGarbledCircuit, also much smaller to send
+    back to the main process.
+
+    Returns:
+        The GarbledCircuit, and the metrics of its garbling (see
+        metrics.snapshot).
+    """
+    metrics.reset()
+    if lean:
+        garbled_circuit = yao.LeanGarbledCircuit(circuit, scheme=scheme)
+    else:
+        garbled_circuit = yao.GarbledCircuit(circuit, scheme=scheme)
+    return garbled_circuit, metrics.snapshot()
+
+
+class GarblingPool:
+    """A bounded pool of freshly garbled, single-use circuits.
+
+    Worker processes garble instances of the same circuit in the background,
+    so that 'size' of them are always ready or being garbled. Each instance
+    is handed out once by pop, which immediately schedules its replacement.
+
+    Args:
+        circuit: A dict containing circuit spec, or a CompiledCircuit.
+        scheme: Optional; the garbling scheme, one of yao.SCHEMES.
+            ("classic" by default).
+        size: Optional; the number of garbled circuits kept in the pool.
+            (2 by default).
+        workers: Optional; the number of worker processes.
+            (by default, as many as the size of the pool).
+        lean: Optional; garble yao.LeanGarbledCircuits. (False by default).
+    """
+    def __init__(self, circuit, scheme="classic", size=2, workers=None,
+                 lean=False):
+        if size < 1:
+            raise ValueError(f"Invalid pool size {size}")
+        self.circuit = compiler.compile_circuit(circuit)
+        self.scheme = scheme
+        self.size = size
+        self.lean = lean
+        self.executor = ProcessPoolExecutor(max_workers=workers or size)
+        self.pending = deque(self._submit() for _ in range(size))
+        self.popped = 0  # number of garbled circuits handed out
+
+    def __len__(self):
+        """Return the number of garbled circuits ready to be popped."""
+        return sum(future.done() for future in self.pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _submit(self):
+        """Schedule the garbling of a new instance of the circuit."""
+        return self.executor.submit(garble, self.circuit, self.scheme,
+                                    self.lean)
+
+    def pop(self):
+        """Remove the oldest garbled circuit from the pool and return it.
+
+        Waits for it if it is not ready yet.
+
+        Returns:
+            A GarbledCircuit, never returned again.
+        """
+        future = self.pending.popleft()
+        if not future.done():
+            logging.debug(f"Waiting for a garbled {self.circuit.id}")
+        self.pending.append(self._submit())
+        self.popped += 1
+        garbled_circuit, values = future.result()
+        metrics.merge(values)
+        return garbled_circuit
+
+    def close(self):
+        """Stop the worker processes and drop the unused circuits."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.pending.clear()
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import metrics
+import pickle
+import time
+import util
+import zmq
+import zmq.asyncio
+from concurrent.futures import ThreadPoolExecutor
+from parties import Bob
+
+SESSION_TIMEOUT = 60  # seconds a session waits for a message of its Alice
+QUEUE_DEPTH = 16  # number of sessions waiting for a worker
+# Kinds of the messages of Alice that start a session: the circuit, or the
+# refill of the OT pools which precedes it
+SESSION_KINDS = ("circuit", "ot-pool")
+
+
+class SessionSocket:
+    """The socket of one session of an EvaluatorServer.
+
+    Offers the interface of util.Socket to the Bob of the session: incoming
+    messages are queued by the server, outgoing ones are sent to the
+    session's Alice through the ROUTER socket of the server.
+
+    Args:
+        server: The EvaluatorServer.
+        identity: The routing ID of Alice's socket, which is the session ID.
+        timeout: The number of seconds to wait for a message.
+    """
+    def __init__(self, server, identity, timeout):
+        self.server = server
+        self.identity = identity
+        self.timeout = timeout
+        self.inbox = asyncio.Queue()
+        self.closed = False
+        self.waiting = False  # whether messages were sent since the last receive
+
+    def deliver(self, frames):
+        """Queue a message of Alice; return False if the session is over."""
+        if not self.closed:
+            self.inbox.put_nowait(frames)
+        return not self.closed
+
+    def close(self):
+        """Close the session: later messages of Alice start a new one."""
+        self.closed = True
+
+    def close_if_idle(self):
+        """Close the session unless a message is waiting; return if closed."""
+        self.closed = self.inbox.empty()
+        return self.closed
+
+    async def send(self, msg):
+        await self.send_frames([pickle.dumps(msg)])
+
+    async def receive(self):
+        msg = pickle.loads((await self.receive_frames())[0])
+        if isinstance(msg, util.SessionError):
+            raise msg
+        return msg
+
+    async def send_frames(self, frames):
+        """Send a multipart message of bytes-like frames to Alice."""
+        kind = metrics.current_phase()
+        metrics.count_message("sent", kind, frames)
+        self.waiting = True
+        await self.server.router.send_multipart(
+            [self.identity, b"", kind.encode()] + list(frames), copy=False)
+
+    async def receive_frames(self):
+        """Receive a multipart message of Alice.
+
+        Raises:
+            TimeoutError: No message arrived in time.
+        """
+        start = time.perf_counter()
+        try:
+            kind, *frames = await asyncio.wait_for(self.inbox.get(),
+                                                   self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Session {self.identity.hex()} timed out")
+        kind = bytes(kind).decode()
+        metrics.count_message("received", kind, frames)
+        if self.waiting:  # a reply to the messages sent
+            metrics.count_round_trip(kind, time.perf_counter() - start)
+            self.waiting = False
+        return frames
+
+    async def send_wait(self, msg):
+        await self.send(msg)
+        return await self.receive()
+
+
+class EvaluatorServer:
+    """A Bob serving many Alices at once, each in its own session.
+
+    A single ROUTER socket receives the messages of all the Alices and
+    routes them to their session, identified by the routing ID of Alice's
+    socket. Each session holds its own Bob, and so its own protocol state,
+    and runs as a task of the event loop; evaluations run in a pool of
+    'workers' threads, so that the loop keeps serving the other sessions.
+
+    Sessions end when their Alice is idle for 'session_timeout' seconds.
+    When 'workers' sessions are running, new ones wait for one to end, up to
+    'queue_depth' of them: further Alices are refused with a
+    util.SessionError.
+
+    Args:
+        input_data_path: A string containing the path to the file containing Bob's values.
+        number_of_bits: The number of bits of Bob's input.
+        endpoint: Optional; the endpoint the server binds to.
+        workers: Optional; the number of sessions run concurrently.
+            (4 by default).
+        queue_depth: Optional; the number of sessions waiting for a worker.
+            (QUEUE_DEPTH by default).
+        session_timeout: Optional; the number of seconds after which an
+            idle session ends. (SESSION_TIMEOUT by default).
+        max_gates: Optional; the maximum number of gates of the circuits
+            evaluated. (None by default: no limit).
+        **bob_options: Options of the Bob of each session (see Bob).
+    """
+    def __init__(self, input_data_path, number_of_bits,
+                 endpoint=f"tcp://*:{util.LOCAL_PORT}", workers=4,
+                 queue_depth=QUEUE_DEPTH, session_timeout=SESSION_TIMEOUT,
+                 max_gates=None, **bob_options):
+        self.input_data_path = input_data_path
+        self.number_of_bits = number_of_bits
+        self.endpoint = endpoint
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.session_timeout = session_timeout
+        self.max_gates = max_gates
+        self.bob_options = bob_options
+        self.router = None
+        self.slots = None  # semaphore of the running sessions
+        self.sessions = {}  # map from session IDs to their socket
+        self.tasks = set()  # tasks of the sessions and of the refusals
+
+    async def serve(self):
+        """Serve Alices until cancelled."""
+        self.router = zmq.asyncio.Context.instance().socket(zmq.ROUTER)
+        self.router.bind(self.endpoint)
+        self.slots = asyncio.Semaphore(self.workers)
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=self.workers))
+
+        logging.info(f"Serving on {self.endpoint}")
+        try:
+            while True:
+                identity, _, *frames = await self.router.recv_multipart(
+                    copy=False)
+                self.dispatch(bytes(identity),
+                              [frame.buffer for frame in frames])
+        except asyncio.CancelledError:
+            logging.info("Stop serving")
+
+    def dispatch(self, identity, frames):
+        """Hand a message over to its session, starting it if needed.
+
+        Messages of Alices without a session that cannot start one are
+        dropped: they follow a circuit that was refused, or sent to a
+        session that is over, without waiting for Bob.
+        """
+        session = self.sessions.get(identity)
+        if session is not None and session.deliver(frames):
+            return
+        kind = bytes(frames[0]).decode()
+        if kind not in SESSION_KINDS:
+            logging.debug(f"Dropping a message '{kind}' of {identity.hex()}, "
+                          f"which has no session")
+            return
+        self.sessions = {
+            i: s for i, s in self.sessions.items() if not s.closed
+        }
+        if len(self.sessions) >= self.workers + self.queue_depth:
+            logging.warning(f"Refusing session {identity.hex()}: too many "
+                            f"sessions")
+            with metrics.phase("error"):
+                self.spawn(SessionSocket(self, identity, 0).send(
+                    util.SessionError("Too many sessions, retry later")))
+            return
+
+        session = SessionSocket(self, identity, self.session_timeout)
+        session.deliver(frames)
+        self.sessions[identity] = session
+        self.spawn(self.run_session(session))
+
+    def spawn(self, coroutine):
+        """Run a coroutine as a task, kept until it is done."""
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run_session(self, session):
+        """Run the Bob of a session until its Alice is idle for too long."""
+        async with self.slots:
+            logging.info(f"Session {session.identity.hex()} started")
+            bob = Bob(self.input_data_path, self.number_of_bits,
+                      socket=session, pool_path=None,
+                      max_gates=self.max_gates, **self.bob_options)
+            try:
+                while True:
+                    try:
+                        frames = await session.receive_frames()
+                    except TimeoutError:
+                        if session.close_if_idle():
+                            break
+                        continue
+                    await bob.handle(frames)
+            except Exception as e:  # the session dies, not the server
+                session.close()
+                logging.error(f"Session {session.identity.hex()} failed: "
+                              f"{e!r}")
+                return
+            logging.info(f"Session {session.identity.hex()} ended")
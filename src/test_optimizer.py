@@ -0,0 +1,43 @@
+import optimizer
+import pytest
+
+
+def constant_circuit(constant, gate_type, other, inputs):
+    """Return a circuit whose OR or NOR gate reads a constant-folded wire.
+
+    The constant is made of an input wire, XOR-ed or XNOR-ed with itself,
+    and read by the gate along with an input wire or a full adder carry,
+    which the optimizer tries to rewrite.
+
+    Args:
+        constant: The type of the gate folded into a constant.
+        gate_type: The type of the gate reading it, "OR" or "NOR".
+        other: The other input of the gate, "input" or "carry".
+        inputs: The input wires of the gate, in order.
+
+    Returns:
+        A dict containing circuit spec.
+    """
+    gates = [{"id": 4, "type": constant, "in": [1, 1]}]
+    if other == "input":
+        gates.append({"id": 5, "type": "NOT", "in": [2]})
+    else:
+        gates.append({"id": 5, "type": "AND", "in": [1, 2]})
+    gates.append({"id": 6, "type": gate_type, "in": list(inputs)})
+    return {
+        "id": f"{constant} constant {gate_type} {other}",
+        "alice": [1, 2],
+        "bob": [3],
+        "out": [6],
+        "gates": gates,
+    }
+
+
+@pytest.mark.parametrize("inputs", [(4, 5), (5, 4)])
+@pytest.mark.parametrize("other", ["input", "carry"])
+@pytest.mark.parametrize("gate_type", ["OR", "NOR"])
+@pytest.mark.parametrize("constant", ["XOR", "XNOR"])
+def test_constant_wires(constant, gate_type, other, inputs):
+    circuit = constant_circuit(constant, gate_type, other, inputs)
+    optimized = optimizer.optimize(circuit)
+    assert optimizer.equivalent(circuit, optimized)
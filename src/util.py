@@ -1,9 +1,14 @@
 import json
+import metrics
 import operator
+import os
+import pickle
 import random
 import secrets
 import sympy
+import time
 import zmq
+import zmq.asyncio
 from itertools import chain
 import json
 
@@ -13,45 +18,71 @@ SERVER_HOST = "localhost"
 SERVER_PORT = 987654
 
 
-class Socket:
-    def __init__(self, socket_type):
-        self.socket = zmq.Context().socket(socket_type)
-        self.poller = zmq.Poller()
-        self.poller.register(self.socket, zmq.POLLIN)
-
-    def send(self, msg):
-        self.socket.send_pyobj(msg)
+class SessionError(Exception):
+    """An error of a session, sent to the other party in place of a reply."""
 
-    def receive(self):
-        return self.socket.recv_pyobj()
 
-    def send_wait(self, msg):
-        self.send(msg)
-        return self.receive()
-
-    """
-    From https://stackoverflow.com/questions/17174001/stop-pyzmq-receiver-by-keyboardinterrupt
+class Socket:
+    """An asyncio socket exchanging messages with the other party.
+
+    Messages are not bound to replies: either party may send several of
+    them in a row, without waiting for the other, and they are received in
+    order. Each message is preceded on the wire by a routing envelope, as
+    with REQ/REP sockets: the routing ID of the peer (ROUTER sockets only)
+    and an empty delimiter frame, then by its kind: the protocol phase of
+    the sender (see metrics.phase), under which both parties count it.
     """
-
-    def poll_socket(self, timetick=100):
-        try:
-            while True:
-                obj = dict(self.poller.poll(timetick))
-                if self.socket in obj and obj[self.socket] == zmq.POLLIN:
-                    yield self.socket.recv_pyobj()
-        except KeyboardInterrupt:
-            pass
+    def __init__(self, socket_type, envelope):
+        self.socket = zmq.asyncio.Context.instance().socket(socket_type)
+        self.envelope = envelope
+        self.waiting = False  # whether messages were sent since the last receive
+
+    async def send(self, msg):
+        await self.send_frames([pickle.dumps(msg)])
+
+    async def receive(self):
+        msg = pickle.loads((await self.receive_frames())[0])
+        if isinstance(msg, SessionError):
+            raise msg
+        return msg
+
+    async def send_frames(self, frames):
+        """Send a multipart message of bytes-like frames without copy."""
+        kind = metrics.current_phase()
+        metrics.count_message("sent", kind, frames)
+        self.waiting = True
+        await self.socket.send_multipart(
+            self.envelope + [kind.encode()] + list(frames), copy=False)
+
+    async def receive_frames(self):
+        """Receive a multipart message as a list of memoryviews."""
+        start = time.perf_counter()
+        frames = await self.socket.recv_multipart(copy=False)
+        size = len(self.envelope)
+        self.envelope = [frame.bytes for frame in frames[:size]]
+        kind = frames[size].bytes.decode()
+        frames = [frame.buffer for frame in frames[size + 1:]]
+        metrics.count_message("received", kind, frames)
+        if self.waiting:  # a reply to the messages sent
+            metrics.count_round_trip(kind, time.perf_counter() - start)
+            self.waiting = False
+        return frames
+
+    async def send_wait(self, msg):
+        await self.send(msg)
+        return await self.receive()
 
 
 class EvaluatorSocket(Socket):
+    """The socket of Bob: replies go to the Alice of the last message."""
     def __init__(self, endpoint=f"tcp://*:{LOCAL_PORT}"):
-        super().__init__(zmq.REP)
+        super().__init__(zmq.ROUTER, [b"", b""])
         self.socket.bind(endpoint)
 
 
 class GarblerSocket(Socket):
     def __init__(self, endpoint=f"tcp://{SERVER_HOST}:{SERVER_PORT}"):
-        super().__init__(zmq.REQ)
+        super().__init__(zmq.DEALER, [b""])
         self.socket.connect(endpoint)
 
 
@@ -71,8 +102,12 @@ def gen_prime(num_bits):
 
 
 def xor_bytes(seq1, seq2):
-    """XOR two byte sequence."""
-    return bytes(map(operator.xor, seq1, seq2))
+    """XOR two byte sequences, truncated to the length of the shortest."""
+    length = min(len(seq1), len(seq2))
+    # XOR the whole sequences at once as big integers
+    xor = (int.from_bytes(seq1[:length], "little")
+           ^ int.from_bytes(seq2[:length], "little"))
+    return xor.to_bytes(length, "little")
 
 
 def bits(num, width):
@@ -80,13 +115,108 @@ def bits(num, width):
     return [int(k) for k in f'{num:0{width}b}']
 
 
+# Precomputed parameters of groups from the standards, as (prime, generator)
+STANDARD_GROUPS = {
+    # 2048-bit MODP group of RFC 3526
+    "modp2048": (int(
+        "FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74"
+        "020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F1437"
+        "4FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED"
+        "EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF05"
+        "98DA48361C55D39A69163FA8FD24CF5F83655D23DCA3AD961C62F356208552BB"
+        "9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B"
+        "E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF695581718"
+        "3995497CEA956AE515D2261898FA051015728E5A8AACAA68FFFFFFFFFFFFFFFF",
+        16), 2),
+}
+GROUP_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "yao",
+                                "groups.json")
+FIXED_BASE_WINDOW = 8  # bits of exponent per row of fixed-base tables
+
+_groups = {}  # groups loaded by this process, by name
+_fixed_base_tables = {}  # fixed-base tables, by (prime, generator)
+
+
 class PrimeGroup:
-    """Cyclic abelian group of prime order 'prime'."""
-    def __init__(self, prime=None):
+    """Cyclic abelian group of prime order 'prime'.
+
+    Args:
+        prime: Optional; the prime, random of PRIME_BITS bits by default.
+        generator: Optional; a generator of the group, found if not given.
+    """
+    def __init__(self, prime=None, generator=None):
         self.prime = prime or gen_prime(num_bits=PRIME_BITS)
         self.prime_m1 = self.prime - 1
         self.prime_m2 = self.prime - 2
-        self.generator = self.find_generator()
+        self.generator = generator or self.find_generator()
+        self.table = None
+
+    @classmethod
+    def load(cls, name=None, cache_path=GROUP_CACHE_PATH):
+        """Return a group whose parameters are computed once and reused.
+
+        Groups are shared by the whole process, and random groups are also
+        saved to a cache file so that later runs skip their generation.
+
+        Args:
+            name: Optional; the name of one of STANDARD_GROUPS, or None for
+                a random group of PRIME_BITS bits.
+            cache_path: Optional; the path of the cache file of random groups.
+
+        Returns:
+            The PrimeGroup, with its fixed-base table.
+        """
+        if name in _groups:
+            return _groups[name]
+        if name is not None:
+            group = cls(*STANDARD_GROUPS[name])
+        else:
+            key = str(PRIME_BITS)
+            cache = {}
+            if cache_path and os.path.exists(cache_path):
+                with open(cache_path) as f:
+                    cache = json.load(f)
+            if key in cache:
+                group = cls(*cache[key])
+            else:
+                group = cls()
+                cache[key] = (group.prime, group.generator)
+                if cache_path:
+                    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                    with open(cache_path, "w") as f:
+                        json.dump(cache, f)
+        group.precompute()
+        _groups[name] = group
+        return group
+
+    def precompute(self, window=FIXED_BASE_WINDOW):
+        """Build the fixed-base table of the generator.
+
+        Row i holds generator^(d * 2^(i * window)) for every digit d of
+        'window' bits, so that gen_pow takes one multiplication per digit of
+        the exponent. Tables are shared between equal groups of a process.
+        """
+        key = (self.prime, self.generator)
+        if key not in _fixed_base_tables:
+            table = []
+            base = self.generator
+            for _ in range((self.prime.bit_length() + window - 1) // window):
+                row = [1]
+                for _ in range((1 << window) - 1):
+                    row.append(row[-1] * base % self.prime)
+                table.append(row)
+                base = row[-1] * base % self.prime
+            _fixed_base_tables[key] = (window, table)
+        self.table = _fixed_base_tables[key]
+
+    def __getstate__(self):
+        # Tables are never pickled: the receiver reuses or rebuilds its own
+        return {"prime": self.prime, "generator": self.generator}
+
+    def __setstate__(self, state):
+        self.__init__(state["prime"], state["generator"])
+        if (self.prime, self.generator) in _fixed_base_tables:
+            self.precompute()
 
     def mul(self, num1, num2):
         "Multiply two elements." ""
@@ -98,7 +228,21 @@ class PrimeGroup:
 
     def gen_pow(self, exponent):  # generator exponentiation
         "Compute nth power of a generator." ""
-        return pow(self.generator, exponent, self.prime)
+        if self.table is None:
+            return pow(self.generator, exponent, self.prime)
+        window, table = self.table
+        if exponent < 0 or exponent.bit_length() > window * len(table):
+            exponent %= self.prime_m1
+        mask = (1 << window) - 1
+        result = 1
+        for row in table:
+            if not exponent:
+                break
+            digit = exponent & mask
+            if digit:
+                result = result * row[digit] % self.prime
+            exponent >>= window
+        return result
 
     def inv(self, num):
         "Multiplicative inverse of an element." ""
@@ -119,13 +263,18 @@ class PrimeGroup:
                     break
             else:
                 return candidate
-            
+
+# INPUT DATA
+INPUT_CHUNK_SIZE = 1 << 20  # characters of input data files read at a time
+BYTE_BITS = [tuple((byte >> (7 - i)) & 1 for i in range(8)) for byte in range(256)]  # bits of each byte, most significant first
+BIT_BINARY_DIGITS = bytes.maketrans(b"\0\1", b"01")  # bytes 0/1 to b"0"/b"1"
+
 def read_input_data(input_data_path, aggregator_func=sum, separator=' ') :
     """Read the input data file and convert into an aggregate value.
 
     Args:
-        input_data_path: A string containing the path to the file to read to. The file must contain a sequence of integers separated by separator and written on a single line.
-        aggregator_func: The function used to aggregate the values read from the data. It must be a function that takes as input an array of integers and returns an integer.
+        input_data_path: A string containing the path to the file to read to. The file must contain a sequence of integers separated by separator, possibly over several lines.
+        aggregator_func: The function used to aggregate the values read from the data. It must be a function that takes as input an iterable of integers and returns an integer, or list to get all the values.
             (optional; sum by default)
         separator: A string containing the characters that separate the input numbers in the given file.
             (optional; ' ' by default)
@@ -133,13 +282,34 @@ def read_input_data(input_data_path, aggregator_func=sum, separator=' ') :
     Returns:
         An integer containing the aggregated value of the input data file.
     """
-    with open(input_data_path) as f:
-        input_data = f.readlines()[0]
-    return aggregator_func(map(int, input_data.split(separator)))
-            
+    return aggregator_func(iter_input_data(input_data_path, separator=separator))
+
+def iter_input_data(input_data_path, separator=' ', chunk_size=INPUT_CHUNK_SIZE) :
+    """Iterate over the integers of the input data file, read chunk by chunk so that files holding millions of values are never loaded at once.
+
+    Args:
+        input_data_path: A string containing the path to the file to read to. The file must contain a sequence of integers separated by separator, possibly over several lines.
+        separator: A string containing the characters that separate the input numbers in the given file.
+            (optional; ' ' by default)
+        chunk_size: An integer containing the number of characters read at a time.
+            (optional; INPUT_CHUNK_SIZE by default)
+
+    Yields:
+        The integers of the file, in order.
+    """
+    with open(input_data_path) as f :
+        rest = ""  # the start of a value cut by the end of the last chunk
+        for chunk in iter(lambda: f.read(chunk_size), "") :
+            *values, rest = (rest + chunk).replace("\n", separator).split(separator)
+            yield from map(int, filter(str.strip, values))
+        if rest.strip() :
+            yield int(rest)
+
 def convert_to_binary_list(number, number_of_bits=8) :
     """Convert an integer into a list containing the digits of its number_of_bits binary representation. Negative numbers are converted into 2's complement. Throws an error if the number is >= 2^(number_of_bits-1) or < -(2^(number_of_bits-1)) because of overflow (example: for number_of_bits = 8, available values would be all integers between -128 and 127)
 
+    The number is converted to bytes all at once, and each byte to its 8 digits by table lookup, with no work per bit, so that numbers of hundreds of thousands of bits are converted quickly.
+
     Args:
         number: The integer to convert.
         number_of_bits: An integer containing the padding size.
@@ -147,21 +317,16 @@ def convert_to_binary_list(number, number_of_bits=8) :
 
     Returns:
         A list containing the ordered digits of number's binary representation in two's-complement, as integers
+
+    Raises:
+        OverflowError: The number does not fit in number_of_bits bits.
     """
     if (number < -(2**(number_of_bits-1))) or (number >= 2**(number_of_bits-1)) :
-        raise Exception("Overflow error! Please change the size of the circuit and reload program!")
-    binary_representation = bin(abs(number))[2:].zfill(number_of_bits) # At first, convert the number as it was positive
-    if number < 0 : # If it's negative ...
-        binary_representation = list(map(lambda c : '0' if c == '1' else '1', list(binary_representation))) # ... first of all complement it ...
-        for i in range(number_of_bits) : # ... then increase by 1 its representation to obtain a valid two's complement encoding
-            if binary_representation[~i] == '1' :
-                binary_representation[~i] = '0'
-            else :
-                binary_representation[~i] = '1'
-                break
-        binary_representation = "".join(binary_representation)
-    binary_list = list(map(int, list(binary_representation)))
-    return binary_list
+        raise OverflowError("Overflow error! Please change the size of the circuit and reload program!")
+    # Two's complement of number as an unsigned integer, in bytes
+    data = (number & ((1 << number_of_bits) - 1)).to_bytes((number_of_bits + 7) // 8, "big")
+    binary_list = list(chain.from_iterable(map(BYTE_BITS.__getitem__, data)))
+    return binary_list[-number_of_bits % 8:] # The first byte may hold bits beyond number_of_bits
 
 def convert_to_decimal(result):
     """Convert the circuit's output into a decimal number.
@@ -172,17 +337,17 @@ def convert_to_decimal(result):
     Returns:
         The corrisponding value converted into decimal number.
     """
-    if result[0] == 1 : # In this case we are dealing with a negative number, thus we must firstly complement it and then offset if by -1
-        complemented_result = int("".join(list(map(lambda c : '0' if c == 1 else '1', result))), 2)
-        return -complemented_result - 1
-    else : # In this case we are dealing with a negative number, thus we can convert it straight away
-        return int("".join([str(digit) for digit in result]),2)
+    # The digits are mapped to ASCII bytes all at once and parsed as a single unsigned integer
+    unsigned = int(bytes(result).translate(BIT_BINARY_DIGITS), 2)
+    if result[0] == 1 : # In this case we are dealing with a negative number, thus we must offset it by -2^len(result)
+        return unsigned - (1 << len(result))
+    return unsigned
 
 def save_results(result, output_path='./output.txt'):
     """Save the result of the protocol's execution into a file.
 
     Args:
-        result: A printable parameter containing the value of the computed result.
+        result: A printable parameter containing the value of the computed result, or a list of them (the results of a batch), written one per line.
         output_path: A string containing a path to the file we want to write to.
             (optional; './output.txt' by default)
 
@@ -190,13 +355,18 @@ def save_results(result, output_path='./output.txt'):
         None.
     """
     with open(output_path, 'w') as f:
-        f.writelines([str(result)])
+        if isinstance(result, list):
+            f.write("\n".join(map(str, result)))
+        else:
+            f.writelines([str(result)])
 
 def verify(alice_data='./alice_input.txt',
            bob_data='./bob_input.txt',
            output_data='./output.txt',
            aggregator_func=sum,
-           separator=' ') :
+           separator=' ',
+           operation=operator.add,
+           batch=False) :
     """Evaluate the result of the yao protocol's execution.
 
     Args:
@@ -210,15 +380,26 @@ def verify(alice_data='./alice_input.txt',
             (optional; sum by default)
         separator: A string containing the characters that separate the input numbers in the given file.
             (optional; ' ' by default) 
+        operation: The function computed by the circuit, which takes as input the aggregated values of Alice and Bob.
+            (optional; operator.add by default)
+        batch: Whether the output holds the results of a batch, one per line, each computed on a value of Alice and the value of Bob at the same position.
+            (optional; False by default)
 
     Returns:
         True if the protocol was executed successfully and the result matches, False otherwise.
     """
+    if batch :
+        alice_values = read_input_data(alice_data, aggregator_func=list, separator=separator)
+        bob_values = read_input_data(bob_data, aggregator_func=list, separator=separator)
+        with open(output_data) as f :
+            outputs = [int(line) for line in f]
+        return len(outputs) == len(alice_values) == len(bob_values) and all(
+            output == operation(a, b) for output, a, b in zip(outputs, alice_values, bob_values))
     alice_aggregated_data = read_input_data(alice_data, aggregator_func=aggregator_func, separator=separator)
     bob_aggregated_data = read_input_data(bob_data, aggregator_func=aggregator_func, separator=separator)
     with open(output_data) as f :
         output = int(f.readlines()[0])
-    return output == alice_aggregated_data + bob_aggregated_data
+    return output == operation(alice_aggregated_data, bob_aggregated_data)
 
 def generate_circuit(n, name, id) :
     """Generate a dictionary containing an adder circuit.
@@ -276,6 +457,20 @@ def generate_and_save_circuit(path='./circuit.json', number_of_bits=8, name='add
     with open(path, 'w') as f :
         json.dump(circuit, f, indent=1)
 
+def has_circuit(path, circuit_id):
+    """Return whether the circuits file at 'path' contains a circuit.
+
+    Args:
+        path: A string containing the path of the circuits file.
+        circuit_id: A string containing the id of the circuit to look for.
+    """
+    try:
+        circuits = parse_json(path)
+    except (OSError, ValueError):
+        return False
+    return any(circuit.get("id") == circuit_id
+               for circuit in circuits.get("circuits", []))
+
 # HELPER FUNCTIONS
 def parse_json(json_path):
     with open(json_path) as json_file:
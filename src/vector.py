@@ -0,0 +1,184 @@
+import codec
+import compiler
+import metrics
+import time
+import yao
+from itertools import chain
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is only needed by the vectorized evaluator
+    np = None
+
+XOR_CODES = (compiler.GATE_CODES["XOR"], compiler.GATE_CODES["XNOR"])
+
+
+class VectorEvaluator:
+    """An evaluator of garbled circuits working a level of gates at a time.
+
+    Only for the schemes with 128-bit labels (yao.LABEL_SCHEMES). Labels are
+    kept in a NumPy array of (high, low) 64-bit halves, whose big-endian
+    bytes are the raw blocks hashed by the fixed-key AES permutation. Gates
+    of the same level (see CompiledCircuit.levels) do not depend on each
+    other: their labels are gathered into contiguous arrays, hashed with one
+    multi-block ECB call on the reused permutation, and combined with their
+    table rows by array XORs.
+
+    Args:
+        circuit: A dict containing circuit spec, or its CompiledCircuit.
+        a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
+        b_inputs: A dict mapping Bob's wires to (key, encr_bit) inputs.
+        scheme: Optional; the scheme the circuit was garbled with, one of
+            yao.LABEL_SCHEMES. ("half-gates" by default)
+
+    Raises:
+        ImportError: NumPy is not installed.
+        ValueError: The scheme has no 128-bit labels.
+    """
+    def __init__(self, circuit, a_inputs, b_inputs, scheme="half-gates"):
+        if np is None:
+            raise ImportError("The vectorized evaluator requires NumPy")
+        if scheme not in yao.LABEL_SCHEMES:
+            raise ValueError(f"Cannot vectorize the '{scheme}' scheme")
+        self.circuit = compiler.compile_circuit(circuit)
+        self.scheme = scheme
+        self.labels = np.zeros((self.circuit.num_wires, 2), dtype=np.uint64)
+
+        index = self.circuit.input_index()
+        for wire, (label, _) in chain(a_inputs.items(), b_inputs.items()):
+            self.labels[index[wire]] = (label >> 64, label & (2**64 - 1))
+
+    def evaluate_gates(self, g_tables, start=0):
+        """Evaluate consecutive gates, level by level.
+
+        Args:
+            g_tables: The garbled tables of the gates to evaluate.
+            start: Optional; the index of the first gate to evaluate.
+                (0 by default)
+        """
+        begin = time.perf_counter()
+        circuit = self.circuit
+        end = start + len(g_tables)
+        types = np.frombuffer(circuit.types, dtype=np.uint8)[start:end]
+        in0 = np.asarray(circuit.in0[start:end], dtype=np.int64)
+        in1 = np.asarray(circuit.in1[start:end], dtype=np.int64)
+        outs = np.arange(circuit.num_inputs + start, circuit.num_inputs + end)
+        levels = np.asarray(self._levels(start, end))
+
+        # All the tables, one row of 64-bit halves per gate with a table
+        has_table = np.array([table is not None for table in g_tables],
+                             dtype=bool)
+        if isinstance(g_tables, codec.GarbledTablesView):
+            buffer = g_tables.buffer
+        else:
+            buffer = b"".join(table for table in g_tables if table is not None)
+        tables = np.frombuffer(buffer, dtype=">u8").astype(np.uint64)
+        tables = tables.reshape(max(int(has_table.sum()), 1), -1)
+        table_index = np.cumsum(has_table) - 1
+
+        order = np.argsort(levels, kind="stable")
+        bounds = np.searchsorted(levels[order],
+                                 np.arange(int(levels.max(initial=-1)) + 2))
+        for level_start, level_end in zip(bounds[:-1], bounds[1:]):
+            gates = order[level_start:level_end]
+            garbled = gates[has_table[gates]]
+            free = gates[~has_table[gates]]
+            if len(garbled):
+                self._evaluate_garbled(garbled, in0, in1, outs,
+                                       tables[table_index[garbled]])
+            if len(free):
+                self._evaluate_free(free, types, in0, in1, outs)
+        metrics.count("evaluation.gates", end - start)
+        metrics.count("evaluation.decryptions", int(has_table.sum()))
+        metrics.count("evaluation.time_s", time.perf_counter() - begin)
+
+    def _levels(self, start, end):
+        """Return the level of each gate from start to end - 1.
+
+        Wires computed before 'start' are treated as inputs.
+        """
+        circuit = self.circuit
+        first = circuit.num_inputs + start  # first wire computed here
+        levels = []
+        for in_a, in_b in zip(circuit.in0[start:end], circuit.in1[start:end]):
+            level = 0
+            for wire in (in_a, in_b):
+                if wire >= first:
+                    level = max(level, levels[wire - first] + 1)
+            levels.append(level)
+        return levels
+
+    def _evaluate_free(self, gates, types, in0, in1, outs):
+        """Evaluate Free-XOR gates: XOR the labels of the inputs."""
+        labels = self.labels
+        result = labels[in0[gates]]
+        xor_gates = np.isin(types[gates], XOR_CODES)
+        result[xor_gates] ^= labels[in1[gates[xor_gates]]]
+        labels[outs[gates]] = result
+
+    def _evaluate_garbled(self, gates, in0, in1, outs, tables):
+        """Evaluate garbled gates, hashing all their labels at once.
+
+        Args:
+            gates: The indices of the gates, relative to the evaluated range.
+            in0: The first input wires of the evaluated range.
+            in1: The second input wires of the evaluated range.
+            outs: The output wires of the evaluated range.
+            tables: The table of each gate, as rows of 64-bit halves.
+        """
+        labels = self.labels
+        label_a, label_b = labels[in0[gates]], labels[in1[gates]]
+        out = outs[gates].astype(np.uint64)
+        lsb_a = (label_a[:, 1] & np.uint64(1)).astype(bool)
+        lsb_b = (label_b[:, 1] & np.uint64(1)).astype(bool)
+
+        if self.scheme == "half-gates":
+            # Garbler half-gate: H(Wa, 2 id), evaluator's: H(Wb, 2 id + 1)
+            key_g = double(label_a)
+            key_g[:, 1] ^= 2 * out
+            key_e = double(label_b)
+            key_e[:, 1] ^= 2 * out + np.uint64(1)
+            hashes = label_hash(np.concatenate((key_g, key_e)))
+            result = hashes[:len(gates)] ^ hashes[len(gates):]
+            result[lsb_a] ^= tables[lsb_a, 0:2]
+            result[lsb_b] ^= tables[lsb_b, 2:4] ^ label_a[lsb_b]
+        else:
+            # Row 2 * lsb(Wa) + lsb(Wb) is masked with H(2 Wa ^ Wb, id)
+            key = double(double(label_a) ^ label_b)
+            key[:, 1] ^= out
+            row = 2 * lsb_a + lsb_b
+            result = label_hash(key)
+            result ^= tables.reshape(len(gates), 4, 2)[np.arange(len(gates)),
+                                                       row]
+        labels[outs[gates]] = result
+
+    def get_result(self, pbits_out):
+        """Return a dict mapping output wires with their result bit.
+
+        Args:
+            pbits_out: The pbits of outputs.
+        """
+        wire_ids = self.circuit.wire_ids
+        return {
+            wire_ids[out]:
+            int(self.labels[out, 1] & np.uint64(1)) ^ pbits_out[wire_ids[out]]
+            for out in self.circuit.out
+        }
+
+
+def double(labels):
+    """Multiply an array of labels by 2 in GF(2^128)."""
+    high, low = labels[:, 0], labels[:, 1]
+    result = np.empty_like(labels)
+    result[:, 0] = (high << np.uint64(1)) | (low >> np.uint64(63))
+    result[:, 1] = (low << np.uint64(1)) ^ (
+        (high >> np.uint64(63)) * np.uint64(0x87))
+    return result
+
+
+def label_hash(keys):
+    """Return pi(K) ^ K for an array of keys K, in a single AES call."""
+    blocks = keys.astype(">u8").tobytes()
+    hashes = yao.fixed_key_permutation().update(blocks)
+    return np.frombuffer(hashes, dtype=">u8").astype(np.uint64).reshape(
+        -1, 2) ^ keys
@@ -1,9 +1,187 @@
+import codec
+import compiler
+import metrics
 import pickle
 import random
+import secrets
+import threading
+import time
+import util
+from itertools import chain
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives import padding
 import os
 
+SCHEMES = ("classic", "free-xor", "half-gates", "fixed-key")  # garbling schemes
+LABEL_SCHEMES = ("half-gates", "fixed-key")  # schemes with 128-bit labels
+FREE_GATES = ("XOR", "XNOR", "NOT")  # gates without table under Free-XOR
+LABEL_BITS = 128  # size of the wire labels of LABEL_SCHEMES
+LABEL_BYTES = LABEL_BITS // 8  # size of a label and of a table row
+LABEL_MASK = (1 << LABEL_BITS) - 1
+
+# Public key of the fixed-key AES permutation used as gate hash
+FIXED_KEY = bytes.fromhex("59616f2773206761726268656420636b")
+# AES-ECB encryptor under FIXED_KEY, set once per thread (contexts are not
+# meant to be shared between threads)
+_permutation = threading.local()
+
+# Logical function of each 2-input gate type
+OPERATORS = {
+    "OR": lambda b1, b2: b1 or b2,
+    "AND": lambda b1, b2: b1 and b2,
+    "XOR": lambda b1, b2: b1 ^ b2,
+    "NOR": lambda b1, b2: not (b1 or b2),
+    "NAND": lambda b1, b2: not (b1 and b2),
+    "XNOR": lambda b1, b2: not (b1 ^ b2)
+}
+
+# Half-gates garble f(a, b) = ((a ^ alpha_a) and (b ^ alpha_b)) ^ alpha_out
+HALF_GATES = {
+    "AND": (0, 0, 0),
+    "NAND": (0, 0, 1),
+    "OR": (1, 1, 1),
+    "NOR": (1, 1, 0),
+}
+
+
+def xor_keys(key1, key2):
+    """XOR two keys: (key, iv) pairs component-wise, labels directly."""
+    if isinstance(key1, int):
+        return key1 ^ key2
+    return (util.xor_bytes(key1[0], key2[0]), util.xor_bytes(key1[1], key2[1]))
+
+
+def to_block(label):
+    """Convert a label into a raw 16-byte block."""
+    return label.to_bytes(LABEL_BYTES, "big")
+
+
+def from_block(block):
+    """Convert a raw 16-byte block into a label."""
+    return int.from_bytes(block, "big")
+
+
+def fixed_key_permutation():
+    """Return the fixed-key AES permutation, creating it on first use."""
+    encryptor = getattr(_permutation, "encryptor", None)
+    if encryptor is None:
+        cipher = Cipher(algorithms.AES(FIXED_KEY), modes.ECB())
+        encryptor = _permutation.encryptor = cipher.encryptor()
+    return encryptor
+
+
+def double(label):
+    """Multiply a label by 2 in GF(2^128)."""
+    return (label << 1) & LABEL_MASK ^ (0x87 if label >> 127 else 0)
+
+
+def label_hash(label, tweak):
+    """Hash a label along with a gate-dependent tweak into a label.
+
+    Computes pi(K) ^ K with K = 2 * label ^ tweak, where pi is the fixed-key
+    AES permutation: a single block encryption and no key schedule per call.
+    """
+    k = double(label) ^ tweak
+    return from_block(fixed_key_permutation().update(to_block(k))) ^ k
+
+
+def garble_half_gate(gate_id, gate_type, label_a, label_b, offset):
+    """Garble a 2-input non-linear gate with the half-gates technique.
+
+    Args:
+        gate_id: The ID of the gate, used to derive the hash tweaks.
+        gate_type: One of the HALF_GATES types.
+        label_a: The 0-label of the first input wire.
+        label_b: The 0-label of the second input wire.
+        offset: The global Free-XOR offset R (its lsb is 1).
+
+    Returns:
+        A pair (garbled table, 0-label of the output wire). The table holds
+        two raw rows: the garbler half-gate and the evaluator half-gate.
+    """
+    alpha_a, alpha_b, alpha_out = HALF_GATES[gate_type]
+    tweak_g, tweak_e = 2 * gate_id, 2 * gate_id + 1
+    # Inverting an input just swaps the meaning of its two labels
+    label_a ^= alpha_a * offset
+    label_b ^= alpha_b * offset
+    pbit_a, pbit_b = label_a & 1, label_b & 1
+
+    # Garbler half-gate: the garbler knows pbit_b
+    hash_a0 = label_hash(label_a, tweak_g)
+    row_g = hash_a0 ^ label_hash(label_a ^ offset, tweak_g) ^ pbit_b * offset
+    label_g = hash_a0 ^ pbit_a * row_g
+    # Evaluator half-gate: the evaluator knows b ^ pbit_b
+    hash_b0 = label_hash(label_b, tweak_e)
+    row_e = hash_b0 ^ label_hash(label_b ^ offset, tweak_e) ^ label_a
+    label_e = hash_b0 ^ pbit_b * (row_e ^ label_a)
+
+    table = to_block(row_g) + to_block(row_e)
+    return table, label_g ^ label_e ^ alpha_out * offset
+
+
+def eval_half_gate(gate_id, table, label_a, label_b):
+    """Evaluate a half-gates garbled table.
+
+    Args:
+        gate_id: The ID of the gate, used to derive the hash tweaks.
+        table: The rows returned by garble_half_gate.
+        label_a: The label held for the first input wire.
+        label_b: The label held for the second input wire.
+
+    Returns:
+        The label of the output wire.
+    """
+    row_g = from_block(table[:LABEL_BYTES])
+    row_e = from_block(table[LABEL_BYTES:2 * LABEL_BYTES])
+    label_g = label_hash(label_a, 2 * gate_id) ^ (label_a & 1) * row_g
+    label_e = label_hash(label_b, 2 * gate_id + 1) ^ (label_b & 1) * (row_e ^
+                                                                      label_a)
+    return label_g ^ label_e
+
+
+def garble_fixed_key_gate(gate_id, gate_type, keys_a, keys_b, keys_out):
+    """Garble a 2-input gate into 4 point-and-permute rows of 16 bytes.
+
+    Row 2 * lsb(Wa) + lsb(Wb) masks the output label with H(2Wa ^ Wb, ID).
+
+    Args:
+        gate_id: The ID of the gate, used as hash tweak.
+        gate_type: One of the OPERATORS types.
+        keys_a: The pair of labels of the first input wire.
+        keys_b: The pair of labels of the second input wire.
+        keys_out: The pair of labels of the output wire.
+
+    Returns:
+        The garbled table, as 4 raw rows.
+    """
+    operator = OPERATORS[gate_type]
+    rows = [None] * 4
+    for bit_a in (0, 1):
+        for bit_b in (0, 1):
+            label_a, label_b = keys_a[bit_a], keys_b[bit_b]
+            label_out = keys_out[int(operator(bit_a, bit_b))]
+            mask = label_hash(double(label_a) ^ label_b, gate_id)
+            rows[2 * (label_a & 1) + (label_b & 1)] = to_block(mask ^ label_out)
+    return b"".join(rows)
+
+
+def eval_fixed_key_gate(gate_id, table, label_a, label_b):
+    """Evaluate a fixed-key garbled table.
+
+    Args:
+        gate_id: The ID of the gate, used as hash tweak.
+        table: The rows returned by garble_fixed_key_gate.
+        label_a: The label held for the first input wire.
+        label_b: The label held for the second input wire.
+
+    Returns:
+        The label of the output wire.
+    """
+    offset = (2 * (label_a & 1) + (label_b & 1)) * LABEL_BYTES
+    row = from_block(table[offset:offset + LABEL_BYTES])
+    return row ^ label_hash(double(label_a) ^ label_b, gate_id)
+
+
 def encrypt(key, data):
     """Encrypt a message.
 
@@ -39,142 +217,253 @@ def decrypt(key, data):
     return plaintext
 
 
-def evaluate(circuit, g_tables, pbits_out, a_inputs, b_inputs):
+def table_row(table, row, num_rows):
+    """Return a row of a garbled table made of 'num_rows' equal-size rows."""
+    size = len(table) // num_rows
+    return table[row * size:(row + 1) * size]
+
+
+def evaluate(circuit, g_tables, pbits_out, a_inputs, b_inputs,
+             scheme="classic"):
     """Evaluate yao circuit with given inputs.
 
+    Each garbled table is a bytes-like object made of equal-size rows,
+    indexed by the encrypted bits of the gate inputs. Gates without a garbled
+    table were garbled with Free-XOR: their output key is the XOR of their
+    input keys and their encrypted bit the XOR of the input encrypted bits,
+    so no decryption is needed.
+
     Args:
-        circuit: A dict containing circuit spec.
-        g_tables: The yao circuit garbled tables.
+        circuit: A dict containing circuit spec, or its CompiledCircuit.
+        g_tables: The yao circuit garbled tables, in compiled gate order.
         pbits_out: The pbits of outputs.
         a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
         b_inputs: A dict mapping Bob's wires to (key, encr_bit) inputs.
+        scheme: Optional; the scheme the circuit was garbled with.
+            ("classic" by default)
 
     Returns:
         A dict mapping output wires with their result bit.
     """
-    gates = circuit["gates"]  # dict containing circuit gates
-    wire_outputs = circuit["out"]  # list of output wires
-    wire_inputs = {}  # dict containing Alice and Bob inputs
-    evaluation = {}  # dict containing result of evaluation
-
-    wire_inputs.update(a_inputs)
-    wire_inputs.update(b_inputs)
-
-    # Iterate over all gates
-    for gate in sorted(gates, key=lambda g: g["id"]):
-        gate_id, gate_in, msg = gate["id"], gate["in"], None
-        # Special case if it's a NOT gate
-        if (len(gate_in) < 2) and (gate_in[0] in wire_inputs):
-            # Fetch input key associated with the gate's input wire
-            key_in, encr_bit_in = wire_inputs[gate_in[0]]
-            # Fetch the encrypted message in the gate's garbled table
-            encr_msg = g_tables[gate_id][(encr_bit_in, )]
-            # Decrypt message
-            msg = decrypt(key_in, encr_msg)
-        # Else the gate has two input wires (same model)
-        elif (gate_in[0] in wire_inputs) and (gate_in[1] in wire_inputs):
-            key_a, encr_bit_a = wire_inputs[gate_in[0]]
-            key_b, encr_bit_b = wire_inputs[gate_in[1]]
-            encr_msg = g_tables[gate_id][(encr_bit_a, encr_bit_b)]
-            msg = decrypt(key_b, decrypt(key_a, encr_msg))
-        if msg:
-            wire_inputs[gate_id] = pickle.loads(msg)
-
-    # After all gates have been evaluated, we populate the dict of results
-    for out in wire_outputs:
-        evaluation[out] = wire_inputs[out][1] ^ pbits_out[out]
-
-    return evaluation
+    evaluator = Evaluator(circuit, a_inputs, b_inputs, scheme=scheme)
+    evaluator.evaluate_gates(g_tables)
+    return evaluator.get_result(pbits_out)
+
+
+class Evaluator:
+    """An evaluator of a garbled circuit, one range of gates at a time.
+
+    Args:
+        circuit: A dict containing circuit spec, or its CompiledCircuit.
+        a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
+        b_inputs: A dict mapping Bob's wires to (key, encr_bit) inputs.
+        scheme: Optional; the scheme the circuit was garbled with.
+            ("classic" by default)
+        live_only: Optional; forget the value of a wire as soon as its last
+            reader is evaluated, to bound memory when streaming.
+            (False by default)
+    """
+    def __init__(self, circuit, a_inputs, b_inputs, scheme="classic",
+                 live_only=False):
+        self.circuit = compiler.compile_circuit(circuit)
+        self.scheme = scheme
+        self.last_uses = self.circuit.last_uses() if live_only else None
+        # (key, encr_bit) of each wire
+        self.wire_inputs = {} if live_only else [None] * self.circuit.num_wires
+
+        index = self.circuit.input_index()
+        for wire, wire_input in chain(a_inputs.items(), b_inputs.items()):
+            self.wire_inputs[index[wire]] = wire_input
+
+    def evaluate_gates(self, g_tables, start=0):
+        """Evaluate consecutive gates, in topological order.
+
+        Args:
+            g_tables: The garbled tables of the gates to evaluate.
+            start: Optional; the index of the first gate to evaluate.
+                (0 by default)
+        """
+        begin = time.perf_counter()
+        circuit, scheme = self.circuit, self.scheme
+        types, in0, in1 = circuit.types, circuit.in0, circuit.in1
+        wire_inputs = self.wire_inputs
+        eval_gate = (eval_half_gate if scheme == "half-gates" else
+                     eval_fixed_key_gate)
+
+        i = start
+        out = circuit.num_inputs + start  # output wire of the current gate
+        free = 0  # number of free gates
+        for table in g_tables:
+            key_a, encr_bit_a = wire_inputs[in0[i]]
+            # Free gate (Free-XOR): combine input keys, no table to decrypt
+            if table is None:
+                free += 1
+                if types[i] != compiler.NOT:
+                    key_b, encr_bit_b = wire_inputs[in1[i]]
+                    key_a = xor_keys(key_a, key_b)
+                    encr_bit_a ^= encr_bit_b
+                wire_inputs[out] = (key_a, encr_bit_a)
+            elif scheme in LABEL_SCHEMES:
+                label = eval_gate(out, table, key_a, wire_inputs[in1[i]][0])
+                wire_inputs[out] = (label, label & 1)
+            # Special case if it's a NOT gate
+            elif types[i] == compiler.NOT:
+                # Decrypt the message in the gate's garbled table
+                msg = decrypt(key_a, table_row(table, encr_bit_a, 2))
+                wire_inputs[out] = pickle.loads(msg)
+            # Else the gate has two input wires (same model)
+            else:
+                key_b, encr_bit_b = wire_inputs[in1[i]]
+                encr_msg = table_row(table, 2 * encr_bit_a + encr_bit_b, 4)
+                msg = decrypt(key_b, decrypt(key_a, encr_msg))
+                wire_inputs[out] = pickle.loads(msg)
+            i += 1
+            out += 1
+
+        if self.last_uses is not None:
+            release_dead_wires(circuit, self.last_uses, wire_inputs,
+                               start=start, end=i)
+        metrics.count("evaluation.gates", i - start)
+        metrics.count("evaluation.decryptions", i - start - free)
+        metrics.count("evaluation.time_s", time.perf_counter() - begin)
+
+    def get_result(self, pbits_out):
+        """Return a dict mapping output wires with their result bit.
+
+        Args:
+            pbits_out: The pbits of outputs.
+        """
+        wire_ids = self.circuit.wire_ids
+        return {
+            wire_ids[out]:
+            self.wire_inputs[out][1] ^ pbits_out[wire_ids[out]]
+            for out in self.circuit.out
+        }
+
+
+def count_garbled(tables):
+    """Count garbled gates and the bytes of their tables (see metrics)."""
+    garbled = [table for table in tables if table is not None]
+    metrics.count("garbling.gates", len(tables))
+    metrics.count("garbling.tables", len(garbled))
+    metrics.count("garbling.table_bytes", sum(len(table) for table in garbled))
+
+
+def release_dead_wires(circuit, last_uses, *wire_dicts, start, end):
+    """Drop the wires whose last reader is one of gates start to end - 1.
+
+    Args:
+        circuit: The CompiledCircuit.
+        last_uses: The array returned by circuit.last_uses().
+        wire_dicts: Dicts mapping live wires to their values.
+        start: The index of the first gate evaluated or garbled.
+        end: The index following the last gate evaluated or garbled.
+    """
+    in0, in1, num_inputs = circuit.in0, circuit.in1, circuit.num_inputs
+    for i in range(start, end):
+        for wire in (in0[i], in1[i], num_inputs + i):
+            if wire >= 0 and last_uses[wire] == i:
+                for wire_dict in wire_dicts:
+                    wire_dict.pop(wire, None)
 
 
 class GarbledGate:
     """A representation of a garbled gate.
 
+    The keys and p-bits are only read while garbling: the gate keeps its
+    garbled table, and a clear one only if asked for debugging.
+
     Args:
         gate: A dict containing gate spec.
         keys: A dict mapping each wire to a pair of keys.
         pbits: A dict mapping each wire to its p-bit.
+        debug: Optional; also keep a clear representation of the garbled
+            table (see print_garbled_table). (False by default)
     """
-    def __init__(self, gate, keys, pbits):
-        self.keys = keys  # dict of yao circuit keys
-        self.pbits = pbits  # dict of p-bits
+    __slots__ = ("input", "output", "gate_type", "garbled_table",
+                 "clear_garbled_table")
+
+    def __init__(self, gate, keys, pbits, debug=False):
         self.input = gate["in"]  # list of inputs'ID
         self.output = gate["id"]  # ID of output
         self.gate_type = gate["type"]  # Gate type: OR, AND, ...
         self.garbled_table = {}  # The garbled table of the gate
         # A clear representation of the garbled table for debugging purposes
-        self.clear_garbled_table = {}
-
-        # Create the garbled table according to the gate type
-        switch = {
-            "OR": lambda b1, b2: b1 or b2,
-            "AND": lambda b1, b2: b1 and b2,
-            "XOR": lambda b1, b2: b1 ^ b2,
-            "NOR": lambda b1, b2: not (b1 or b2),
-            "NAND": lambda b1, b2: not (b1 and b2),
-            "XNOR": lambda b1, b2: not (b1 ^ b2)
-        }
+        self.clear_garbled_table = {} if debug else None
 
         # NOT gate is a special case since it has only one input
         if (self.gate_type == "NOT"):
-            self._gen_garbled_table_not()
+            self._gen_garbled_table_not(keys, pbits)
         else:
-            operator = switch[self.gate_type]
-            self._gen_garbled_table(operator)
+            # Create the garbled table according to the gate type
+            operator = OPERATORS[self.gate_type]
+            self._gen_garbled_table(operator, keys, pbits)
 
-    def _gen_garbled_table_not(self):
+    def _gen_garbled_table_not(self, keys, pbits):
         """Create the garbled table of a NOT gate."""
         inp, out = self.input[0], self.output
 
         # For each entry in the garbled table
         for encr_bit_in in (0, 1):
             # Retrieve original bit
-            bit_in = encr_bit_in ^ self.pbits[inp]
+            bit_in = encr_bit_in ^ pbits[inp]
             # Compute output bit according to the gate type
             bit_out = int(not (bit_in))
             # Compute encrypted bit with the p-bit table
-            encr_bit_out = bit_out ^ self.pbits[out]
+            encr_bit_out = bit_out ^ pbits[out]
             # Retrieve related keys
-            key_in = self.keys[inp][bit_in]
-            key_out = self.keys[out][bit_out]
+            key_in = keys[inp][bit_in]
+            key_out = keys[out][bit_out]
 
             # Serialize the output key along with the encrypted bit
             msg = pickle.dumps((key_out, encr_bit_out))
             # Encrypt message and add it to the garbled table
             self.garbled_table[(encr_bit_in, )] = encrypt(key_in, msg)
             # Add to the clear table indexes of each keys
-            self.clear_garbled_table[(encr_bit_in, )] = [(inp, bit_in),
-                                                         (out, bit_out),
-                                                         encr_bit_out]
+            if self.clear_garbled_table is not None:
+                self.clear_garbled_table[(encr_bit_in, )] = [
+                    (inp, bit_in), (out, bit_out), encr_bit_out
+                ]
 
-    def _gen_garbled_table(self, operator):
+    def _gen_garbled_table(self, operator, keys, pbits):
         """Create the garbled table of a 2-input gate.
 
         Args:
             operator: The logical function of to the 2-input gate type.
+            keys: A dict mapping each wire to a pair of keys.
+            pbits: A dict mapping each wire to its p-bit.
         """
         in_a, in_b, out = self.input[0], self.input[1], self.output
 
         # Same model as for the NOT gate except for 2 inputs instead of 1
         for encr_bit_a in (0, 1):
             for encr_bit_b in (0, 1):
-                bit_a = encr_bit_a ^ self.pbits[in_a]
-                bit_b = encr_bit_b ^ self.pbits[in_b]
+                bit_a = encr_bit_a ^ pbits[in_a]
+                bit_b = encr_bit_b ^ pbits[in_b]
                 bit_out = int(operator(bit_a, bit_b))
-                encr_bit_out = bit_out ^ self.pbits[out]
-                key_a = self.keys[in_a][bit_a]
-                key_b = self.keys[in_b][bit_b]
-                key_out = self.keys[out][bit_out]
+                encr_bit_out = bit_out ^ pbits[out]
+                key_a = keys[in_a][bit_a]
+                key_b = keys[in_b][bit_b]
+                key_out = keys[out][bit_out]
 
                 msg = pickle.dumps((key_out, encr_bit_out))
                 self.garbled_table[(encr_bit_a, encr_bit_b)] = encrypt(
                     key_a, encrypt(key_b, msg))
-                self.clear_garbled_table[(encr_bit_a, encr_bit_b)] = [
-                    (in_a, bit_a), (in_b, bit_b), (out, bit_out), encr_bit_out
-                ]
+                if self.clear_garbled_table is not None:
+                    self.clear_garbled_table[(encr_bit_a, encr_bit_b)] = [
+                        (in_a, bit_a), (in_b, bit_b), (out, bit_out),
+                        encr_bit_out
+                    ]
 
     def print_garbled_table(self):
-        """Print a clear representation of the garbled table."""
+        """Print a clear representation of the garbled table.
+
+        Raises:
+            ValueError: The gate was not garbled with 'debug'.
+        """
+        if self.clear_garbled_table is None:
+            raise ValueError("The clear garbled table is only kept with "
+                             "'debug'")
         print(f"GATE: {self.output}, TYPE: {self.gate_type}")
         for k, v in self.clear_garbled_table.items():
             # If it's a 2-input gate
@@ -200,65 +489,408 @@ class GarbledGate:
 class GarbledCircuit:
     """A representation of a garbled circuit.
 
+    Keys, p-bits and garbled tables are stored in lists indexed by the dense
+    wire and gate indices of the compiled circuit. Each garbled table is the
+    concatenation of its rows, ordered by the encrypted bits of the inputs.
+
+    With the "free-xor" scheme, the two keys of every wire differ by a global
+    offset R. XOR, XNOR and NOT gates then get no garbled table: their output
+    keys and p-bits are derived from their inputs' ones.
+
+    The "half-gates" and "fixed-key" schemes add to Free-XOR 128-bit integer
+    labels, whose least significant bit is the encrypted bit, and hash them
+    with a fixed-key AES permutation. Every other gate is garbled into raw
+    16-byte rows: two with half-gates, four with fixed-key. With half-gates,
+    p-bits are fixed by the labels: the given ones only apply to the inputs.
+
     Args:
-        circuit: A dict containing circuit spec.
+        circuit: A dict containing circuit spec, or its CompiledCircuit.
         pbits: Optional; a dict of p-bits for the given circuit.
+        scheme: Optional; the garbling scheme, one of SCHEMES.
+            ("classic" by default)
     """
-    def __init__(self, circuit, pbits={}):
-        self.circuit = circuit
-        self.gates = circuit["gates"]  # list of gates
-        self.wires = set()  # list of circuit wires
-
-        self.pbits = {}  # dict of p-bits
-        self.keys = {}  # dict of keys
-        self.garbled_tables = {}  # dict of garbled tables
-
-        # Retrieve all wire IDs from the circuit
-        for gate in self.gates:
-            self.wires.add(gate["id"])
-            self.wires.update(set(gate["in"]))
-        self.wires = list(self.wires)
-
-        self._gen_pbits(pbits)
-        self._gen_keys()
-        self._gen_garbled_tables()
-
-    def _gen_pbits(self, pbits):
-        """Create a dict mapping each wire to a random p-bit."""
-        if pbits:
-            self.pbits = pbits
-        else:
-            self.pbits = {wire: random.randint(0, 1) for wire in self.wires}
+    def __init__(self, circuit, pbits={}, scheme="classic"):
+        if scheme not in SCHEMES:
+            raise ValueError(f"Unknown garbling scheme '{scheme}'")
+        self.circuit = compiler.compile_circuit(circuit)
+        self.scheme = scheme
+        self.given_pbits = pbits  # dict of p-bits chosen by the caller
+        self.offset = None  # global offset R (all but classic)
+
+        self.pbits = [None] * self.circuit.num_wires  # list of p-bits
+        self.keys = [None] * self.circuit.num_wires  # list of key pairs
+        self.garbled_tables = []  # list of garbled tables (None if free)
+
+        with metrics.timer("garbling.time_s"):
+            self._gen_keys()
+            self._gen_garbled_tables()
+        count_garbled(self.get_garbled_tables())
 
     def _gen_keys(self):
-        """Create pair of keys for each wire."""
-        for wire in self.wires:
+        """Create pair of keys for each input wire.
+
+        The keys of the other wires are created while garbling their gate.
+        """
+        if self.scheme != "classic":
+            self.offset = self._new_key(1)
+        for wire in range(self.circuit.num_inputs):
+            self._set_new_key(wire)
+
+    def _new_key(self, pbit):
+        """Return a random key; for labels, its lsb is set to 'pbit'."""
+        if self.scheme in LABEL_SCHEMES:
+            return secrets.randbits(LABEL_BITS) & ~1 | pbit
+        return (os.urandom(32), os.urandom(16))
+
+    def _set_new_key(self, wire):
+        """Give a random p-bit and a fresh pair of keys to the wire.
+
+        Keys are (K0, K0 ^ R), or two independent keys with "classic".
+        """
+        if self.given_pbits:
+            wire_id = self.circuit.wire_ids[wire]
+            pbit = self.given_pbits.get(wire_id, random.getrandbits(1))
+        else:
+            pbit = random.getrandbits(1)
+        key0 = self._new_key(pbit)
+        if self.scheme == "classic":
             #self.keys[wire] = (Fernet.generate_key(), Fernet.generate_key())
-            self.keys[wire] = ((os.urandom(32), os.urandom(16)), (os.urandom(32), os.urandom(16)))
+            self.keys[wire] = (key0, self._new_key(pbit))
+        else:
+            self.keys[wire] = (key0, xor_keys(key0, self.offset))
+        self.pbits[wire] = pbit
+
+    def _derive_free_gate(self, i):
+        """Derive output keys and p-bit of free gate i from its inputs."""
+        circuit = self.circuit
+        in_a, out = circuit.in0[i], circuit.num_inputs + i
+        key0, pbit = self.keys[in_a][0], self.pbits[in_a]
+        if circuit.types[i] != compiler.NOT:
+            in_b = circuit.in1[i]
+            key0 = xor_keys(key0, self.keys[in_b][0])
+            pbit ^= self.pbits[in_b]
+        # XNOR and NOT invert the output: swap its keys
+        if circuit.types[i] != compiler.GATE_CODES["XOR"]:
+            key0 = xor_keys(key0, self.offset)
+            pbit ^= 1
+        self.keys[out] = (key0, xor_keys(key0, self.offset))
+        self.pbits[out] = pbit
 
     def _gen_garbled_tables(self):
         """Create the garbled table of each gate."""
-        for gate in self.gates:
-            garbled_gate = GarbledGate(gate, self.keys, self.pbits)
-            self.garbled_tables[gate["id"]] = garbled_gate.get_garbled_table()
+        self.garbled_tables = [
+            self._garble_gate(i) for i in range(self.circuit.num_gates)
+        ]
+
+    def _garble_gate(self, i):
+        """Create the output keys of gate i and return its garbled table.
+
+        Output keys of free gates are derived from their inputs', which
+        precede them in the compiled gate order. With half-gates, output
+        labels are derived from the table.
+
+        Returns:
+            The garbled table, or None if the gate is free.
+        """
+        circuit, keys = self.circuit, self.keys
+        gate_type = compiler.GATE_TYPES[circuit.types[i]]
+        out = circuit.num_inputs + i
+
+        if self._is_free(gate_type):
+            self._derive_free_gate(i)
+            return None
+        if self.scheme == "half-gates":
+            table, label0 = garble_half_gate(out, gate_type,
+                                             keys[circuit.in0[i]][0],
+                                             keys[circuit.in1[i]][0],
+                                             self.offset)
+            keys[out] = (label0, label0 ^ self.offset)
+            self.pbits[out] = label0 & 1
+            return table
+
+        self._set_new_key(out)
+        if self.scheme == "fixed-key":
+            return garble_fixed_key_gate(out, gate_type, keys[circuit.in0[i]],
+                                         keys[circuit.in1[i]], keys[out])
+        garbled_gate = GarbledGate(circuit.gate(i), keys, self.pbits)
+        table = garbled_gate.get_garbled_table()
+        return b"".join(table[encr_bits] for encr_bits in sorted(table))
+
+    def _is_free(self, gate_type):
+        """Return True if gates of this type need no garbled table."""
+        return self.scheme != "classic" and gate_type in FREE_GATES
 
     def print_garbled_tables(self):
-        """Print p-bits and a clear representation of all garbled tables."""
-        print(f"======== {self.circuit['id']} ========")
-        print(f"P-BITS: {self.pbits}")
-        for gate in self.gates:
-            garbled_table = GarbledGate(gate, self.keys, self.pbits)
+        """Print p-bits and a clear representation of all garbled tables.
+
+        Wires are designated by their index in the compiled circuit.
+        """
+        print(f"======== {self.circuit.id} ========")
+        print(f"P-BITS: {dict(enumerate(self.pbits))}")
+        for i, table in enumerate(self.get_garbled_tables()):
+            gate = self.circuit.gate(i)
+            if self._is_free(gate["type"]):
+                print(f"GATE: {gate['id']}, TYPE: {gate['type']} (free)")
+                continue
+            if self.scheme in LABEL_SCHEMES:
+                print(f"GATE: {gate['id']}, TYPE: {gate['type']}")
+                for row in range(0, len(table), LABEL_BYTES):
+                    print(f"[{row // LABEL_BYTES}]: "
+                          f"{table[row:row + LABEL_BYTES].hex()}")
+                continue
+            garbled_table = GarbledGate(gate, self.keys, self.pbits,
+                                        debug=True)
             garbled_table.print_garbled_table()
         print()
 
     def get_pbits(self):
         """Return dict mapping each wire to its p-bit."""
-        return self.pbits
+        return dict(zip(self.circuit.wire_ids, self.pbits))
 
     def get_garbled_tables(self):
-        """Return dict mapping each gate to its garbled table."""
+        """Return list of garbled tables, in compiled gate order."""
         return self.garbled_tables
 
     def get_keys(self):
         """Return dict mapping each wire to its pair of keys."""
-        return self.keys
+        return dict(zip(self.circuit.wire_ids, self.keys))
+
+    def release_tables(self):
+        """Drop the garbled tables, once they are sent."""
+        self.garbled_tables = None
+
+
+class StreamingGarbledCircuit(GarbledCircuit):
+    """A garbled circuit whose tables are created and sent chunk by chunk.
+
+    Only the keys of the input wires are created up front. garble_chunks
+    then garbles gates in compiled order, and the keys and p-bits of a wire
+    are forgotten as soon as its last reader is garbled, output wires
+    excepted. Memory is thus bounded by the live wires, not the circuit size.
+
+    Args:
+        circuit: A dict containing circuit spec, or its CompiledCircuit.
+        pbits: Optional; a dict of p-bits for the given circuit.
+        scheme: Optional; the garbling scheme, one of SCHEMES.
+            ("classic" by default)
+    """
+    def __init__(self, circuit, pbits={}, scheme="classic"):
+        self.last_uses = None
+        super().__init__(circuit, pbits=pbits, scheme=scheme)
+
+    def _gen_keys(self):
+        """Create pair of keys for each input wire, in dicts of live wires."""
+        self.keys, self.pbits = {}, {}
+        self.last_uses = self.circuit.last_uses()
+        super()._gen_keys()
+
+    def _gen_garbled_tables(self):
+        """Defer garbling to garble_chunks."""
+
+    def garble_chunks(self, chunk_size):
+        """Garble the gates by chunks of consecutive gates.
+
+        Args:
+            chunk_size: The number of gates of each chunk.
+
+        Yields:
+            The list of garbled tables of each chunk (None for free gates).
+            At least one, possibly empty, chunk is yielded.
+        """
+        num_gates = self.circuit.num_gates
+        for start in range(0, num_gates or 1, chunk_size):
+            end = min(start + chunk_size, num_gates)
+            with metrics.timer("garbling.time_s"):
+                tables = [self._garble_gate(i) for i in range(start, end)]
+                release_dead_wires(self.circuit, self.last_uses, self.keys,
+                                   self.pbits, start=start, end=end)
+            count_garbled(tables)
+            yield tables
+
+    def get_pbits(self):
+        """Return dict mapping each live wire to its p-bit."""
+        wire_ids = self.circuit.wire_ids
+        return {wire_ids[w]: pbit for w, pbit in self.pbits.items()}
+
+    def get_keys(self):
+        """Return dict mapping each live wire to its pair of keys."""
+        wire_ids = self.circuit.wire_ids
+        return {wire_ids[w]: keys for w, keys in self.keys.items()}
+
+
+class Labels:
+    """The labels of the wires of a circuit, in one contiguous bytearray.
+
+    Only the 0-label of each wire is stored, as a raw 16-byte block: its
+    1-label is the 0-label XOR the global offset R, and its p-bit the lsb of
+    the 0-label. Items are pairs of labels, as in the list of keys of a
+    GarbledCircuit.
+
+    Args:
+        num_wires: The number of wires.
+        offset: The global offset R.
+    """
+    __slots__ = ("blocks", "offset")
+
+    def __init__(self, num_wires, offset):
+        self.blocks = bytearray(num_wires * LABEL_BYTES)
+        self.offset = offset
+
+    def __len__(self):
+        return len(self.blocks) // LABEL_BYTES
+
+    def __iter__(self):
+        return (self[wire] for wire in range(len(self)))
+
+    def __getitem__(self, wire):
+        label0 = self.label(wire)
+        return (label0, label0 ^ self.offset)
+
+    def __setitem__(self, wire, labels):
+        self.set_label(wire, labels[0])
+
+    def label(self, wire):
+        """Return the 0-label of a wire."""
+        start = wire * LABEL_BYTES
+        return int.from_bytes(self.blocks[start:start + LABEL_BYTES], "big")
+
+    def set_label(self, wire, label0):
+        """Set the 0-label of a wire."""
+        start = wire * LABEL_BYTES
+        self.blocks[start:start + LABEL_BYTES] = label0.to_bytes(LABEL_BYTES,
+                                                                 "big")
+
+    def pbit(self, wire):
+        """Return the p-bit of a wire, the lsb of its 0-label."""
+        return self.blocks[(wire + 1) * LABEL_BYTES - 1] & 1
+
+
+class LabelPBits:
+    """The p-bits of the wires of Labels, read from the labels themselves.
+
+    Setting a p-bit does nothing: with 128-bit labels, the p-bit of every
+    wire is already the lsb of the 0-label it is given along with.
+
+    Args:
+        labels: The Labels of the wires.
+    """
+    __slots__ = ("labels",)
+
+    def __init__(self, labels):
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __iter__(self):
+        return map(self.labels.pbit, range(len(self.labels)))
+
+    def __getitem__(self, wire):
+        return self.labels.pbit(wire)
+
+    def __setitem__(self, wire, pbit):
+        pass
+
+
+class LeanGarbledCircuit(GarbledCircuit):
+    """A garbled circuit held in as little memory as possible.
+
+    Only for the schemes with 128-bit labels (LABEL_SCHEMES). The labels of
+    all the wires are stored in one contiguous bytearray (see Labels), and
+    the garbled tables back to back in another one, read through a
+    codec.GarbledTablesView: no Python object is kept per wire or per gate,
+    only 16 bytes per wire and the rows of each garbled gate. Once the
+    circuit is garbled, the garbler only needs the keys of the input wires
+    and the p-bits of the input and output wires: get_keys and get_pbits
+    only return these.
+
+    Args:
+        circuit: A dict containing circuit spec, or its CompiledCircuit.
+        pbits: Optional; a dict of p-bits for the given circuit.
+        scheme: Optional; the garbling scheme, one of LABEL_SCHEMES.
+            ("half-gates" by default)
+
+    Raises:
+        ValueError: The scheme has no 128-bit labels.
+    """
+    def __init__(self, circuit, pbits={}, scheme="half-gates"):
+        if scheme not in LABEL_SCHEMES:
+            raise ValueError(f"Lean garbling needs 128-bit labels, which the "
+                             f"'{scheme}' scheme has not")
+        self.table_sizes = None  # table size of each gate type code
+        super().__init__(circuit, pbits=pbits, scheme=scheme)
+
+    def _gen_keys(self):
+        """Create pair of labels for each input wire, in one bytearray."""
+        self.offset = self._new_key(1)
+        self.keys = Labels(self.circuit.num_wires, self.offset)
+        self.pbits = LabelPBits(self.keys)
+        for wire in range(self.circuit.num_inputs):
+            self._set_new_key(wire)
+
+    def _gen_garbled_tables(self):
+        """Create the garbled table of each gate, back to back."""
+        rows = 2 if self.scheme == "half-gates" else 4
+        self.table_sizes = [
+            0 if self._is_free(gate_type) else rows * LABEL_BYTES
+            for gate_type in compiler.GATE_TYPES
+        ]
+        self.garbled_tables = bytearray()
+        for i in range(self.circuit.num_gates):
+            table = self._garble_gate(i)
+            if table is not None:
+                self.garbled_tables += table
+
+    def _derive_free_gate(self, i):
+        """Derive the output labels of free gate i from its inputs.
+
+        Same as GarbledCircuit._derive_free_gate, on 0-labels only: their
+        lsb is the p-bit.
+        """
+        circuit, labels = self.circuit, self.keys
+        label0 = labels.label(circuit.in0[i])
+        if circuit.types[i] != compiler.NOT:
+            label0 ^= labels.label(circuit.in1[i])
+        # XNOR and NOT invert the output: swap its labels
+        if circuit.types[i] != compiler.GATE_CODES["XOR"]:
+            label0 ^= self.offset
+        labels.set_label(circuit.num_inputs + i, label0)
+
+    def _garble_gate(self, i):
+        """Create the output labels of gate i and return its garbled table.
+
+        Half-gates are garbled on 0-labels only, as free gates.
+        """
+        circuit, labels = self.circuit, self.keys
+        gate_type = compiler.GATE_TYPES[circuit.types[i]]
+        if self.scheme != "half-gates" or self._is_free(gate_type):
+            return super()._garble_gate(i)
+        out = circuit.num_inputs + i
+        table, label0 = garble_half_gate(out, gate_type,
+                                         labels.label(circuit.in0[i]),
+                                         labels.label(circuit.in1[i]),
+                                         self.offset)
+        labels.set_label(out, label0)
+        return table
+
+    def get_pbits(self):
+        """Return dict mapping each input and output wire to its p-bit."""
+        circuit, pbits = self.circuit, self.pbits
+        wires = chain(range(circuit.num_inputs), circuit.out)
+        return {circuit.wire_ids[w]: pbits[w] for w in wires}
+
+    def get_garbled_tables(self):
+        """Return the garbled tables, in compiled gate order, as a
+        codec.GarbledTablesView (None once released)."""
+        if self.garbled_tables is None:
+            return None
+        return codec.GarbledTablesView(self.circuit.types, self.table_sizes,
+                                       self.garbled_tables)
+
+    def get_keys(self):
+        """Return dict mapping each input wire to its pair of labels."""
+        wire_ids = self.circuit.wire_ids
+        return {
+            wire_ids[w]: self.keys[w]
+            for w in range(self.circuit.num_inputs)
+        }